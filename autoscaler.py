@@ -0,0 +1,238 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import os.path
+import random
+import string
+import time
+
+from bench_orchestrator import log
+import fleet_solver
+from providers import Provider
+from zone_index import create_in_region
+
+AUTOSCALER_STATE_FILE = "autoscaler_state.json"
+
+def new_worker_name():
+    return "fishnetworker-" + "".join([random.choice(string.ascii_lowercase) for x in range(20)])
+
+# Keeps a fleet of spot fishnet workers sized to a demand source (see
+# demand.py). Every tick, the fleet is scaled up as soon as its throughput
+# falls below the demand plus headroom, with the cheapest mix of machine
+# types fleet_solver finds for the missing mnps. It is scaled down, most
+# expensive workers per mnps first, only once it has had more than
+# scale_down_margin extra throughput for scale_down_delay seconds, so that
+# a noisy demand doesn't make VMs come and go. At most max_launches VMs are
+# created and max_deletes deleted per tick.
+# options is a function returning fleet_solver options, called every tick
+# so that the fleet follows the prices. worker_command, if given, is run
+# over ssh on every new VM and should start fishnet in the background; as
+# sshd takes a while to come up on a new VM, it is tried up to ssh_attempts
+# times, with exponential backoff, before the VM is given up on.
+# The workers launched are persisted in state_path. With an
+# inventory.FleetInventory, workers that stopped running (preempted, mostly)
+# are noticed at the next tick, deleted and replaced. Launches,
+# preemptions and deletions go to preemption_log, if given.
+# compute, zone_index and inventory are those of the "gcp" provider. To
+# run workers on several clouds, providers maps provider names to
+# providers.Provider instead, and every worker is launched on the
+# provider of its option. A tick that fails is logged and the next one
+# runs as usual.
+class Autoscaler:
+    def __init__(self, compute, demand, options, state_path = AUTOSCALER_STATE_FILE, headroom = 0.1, scale_down_margin = 0.25, scale_down_delay = 600, max_launches = 4, max_deletes = 2, region_caps = None, default_cap = None, zone_index = None, worker_command = None, ssh_attempts = 10, inventory = None, preemption_log = None, providers = None, clock = time.time, sleep = time.sleep):
+        self.providers = providers or {"gcp": Provider("gcp", None, compute, zone_index, inventory)}
+        self.preemption_log = preemption_log
+        self.demand = demand
+        self.options = options
+        self.state_path = state_path
+        self.headroom = headroom
+        self.scale_down_margin = scale_down_margin
+        self.scale_down_delay = scale_down_delay
+        self.max_launches = max_launches
+        self.max_deletes = max_deletes
+        self.region_caps = region_caps or {}
+        self.default_cap = default_cap
+        self.worker_command = worker_command
+        self.ssh_attempts = ssh_attempts
+        self.clock = clock
+        self.sleep = sleep
+
+        self.state = {"workers": {}, "over_since": None}
+        if os.path.isfile(state_path):
+            self.state = json.load(open(state_path))
+
+    def _save(self):
+        tmp_path = self.state_path + ".tmp"
+        open(tmp_path, "w").write(json.dumps(self.state, indent = 4))
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def workers(self):
+        return self.state["workers"]
+
+    def capacity(self):
+        return sum(worker["mnps"] for worker in self.workers.values())
+
+    # Caps left in every region, once the running workers are counted.
+    def _caps_left(self, options):
+        caps = {}
+        for option in options:
+            cap = self.region_caps.get(option["region"], self.default_cap)
+            if cap is not None:
+                cap -= sum(1 for worker in self.workers.values() if worker["region"] == option["region"])
+            caps[option["region"]] = max(0, cap) if cap is not None else None
+        return caps
+
+    # The provider of an option or a worker. Workers saved before there were
+    # providers are on Compute Engine.
+    def _provider(self, x):
+        return self.providers[x.get("provider", "gcp")]
+
+    def _record(self, event, vm_name, instance_type, zone):
+        if self.preemption_log is not None:
+            self.preemption_log.record(event, vm_name, instance_type, zone)
+
+    # Creates one worker. Returns its record, or None if it couldn't be
+    # created or started.
+    def _launch(self, option):
+        vm_name = new_worker_name()
+        provider = self._provider(option)
+        zone, out = create_in_region(provider.compute, vm_name, option["instance-type"], option["region"], provider.zone_index)
+        if zone is None:
+            log(option["instance-type"], "unsuccessful in starting a worker in {}:\n{}".format(option["region"], out))
+            return None
+
+        if self.worker_command is not None:
+            for attempt in range(self.ssh_attempts):
+                success, stdout, stderr = provider.compute.exec_ssh(vm_name, zone, self.worker_command)
+                if success or provider.compute.is_preempted(stdout + stderr) or attempt == self.ssh_attempts - 1:
+                    break
+                self.sleep(min(2 ** attempt, 30))
+            if not success:
+                log(option["instance-type"], "could not start fishnet on `{}`:\n{}".format(vm_name, stdout + stderr))
+                provider.compute.delete_spot_instance(vm_name, zone)
+                return None
+
+        self._record("launch", vm_name, option["instance-type"], zone)
+        log(option["instance-type"], "started worker `{}` in {}".format(vm_name, zone))
+        return {
+            "vm_name": vm_name,
+            "provider": provider.name,
+            "instance-type": option["instance-type"],
+            "region": option["region"],
+            "zone": zone,
+            "mnps": option["mnps"],
+            "price": option["price"],
+            "started_at": self.clock(),
+        }
+
+    def _delete(self, vm_name):
+        worker = self.workers[vm_name]
+        success, out = self._provider(worker).compute.delete_spot_instance(vm_name, worker["zone"])
+        if not success and "was not found" not in out:
+            log(worker["instance-type"], "failed to delete {}! output:\n{}".format(vm_name, out))
+            return False
+        self._record("terminate", vm_name, worker["instance-type"], worker["zone"])
+        log(worker["instance-type"], "deleted worker `{}`".format(vm_name))
+        return True
+
+    # Forgets the workers the inventories no longer list as running,
+    # deleting what is left of them. Returns their names. Workers of
+    # providers without an inventory are left alone.
+    def _forget_lost(self):
+        lost = []
+        for name, provider in sorted(self.providers.items()):
+            if provider.inventory is None:
+                continue
+            listed = {vm["name"]: vm for vm in provider.inventory.vms(force = True)}
+            provider_lost = [vm_name for vm_name, worker in self.workers.items() if worker.get("provider", "gcp") == name and listed.get(vm_name, {}).get("status") != "RUNNING"]
+            provider.inventory.delete([listed[vm_name] for vm_name in provider_lost if vm_name in listed])
+            lost += provider_lost
+        for vm_name in lost:
+            self._record("preempt", vm_name, self.workers[vm_name]["instance-type"], self.workers[vm_name]["zone"])
+            log(self.workers[vm_name]["instance-type"], "worker `{}` is gone".format(vm_name))
+            del self.workers[vm_name]
+        if lost:
+            self._save()
+        return lost
+
+    def _scale_up(self, options, missing_mnps):
+        fleet = fleet_solver.solve(options, missing_mnps, region_caps = self._caps_left(options))
+        if fleet is None:
+            log("autoscaler", "the region caps don't allow {:.2f} more mnps".format(missing_mnps))
+            return []
+
+        to_launch = [x for x in fleet["instances"] for i in range(x["count"])][:self.max_launches]
+        if not to_launch:
+            return []
+        with ThreadPoolExecutor(max_workers = len(to_launch)) as executor:
+            launched = [worker for worker in executor.map(self._launch, to_launch) if worker is not None]
+        for worker in launched:
+            self.workers[worker["vm_name"]] = worker
+        self._save()
+        return [worker["vm_name"] for worker in launched]
+
+    def _scale_down(self, options, target):
+        prices = {(x["instance-type"], x["region"]): x["price"] for x in options}
+
+        def cost_per_mnps(vm_name):
+            worker = self.workers[vm_name]
+            return prices.get((worker["instance-type"], worker["region"]), worker["price"]) / worker["mnps"]
+
+        capacity = self.capacity()
+        to_delete = []
+        for vm_name in sorted(self.workers, key = cost_per_mnps, reverse = True):
+            if len(to_delete) == self.max_deletes:
+                break
+            if capacity - self.workers[vm_name]["mnps"] >= target:
+                to_delete.append(vm_name)
+                capacity -= self.workers[vm_name]["mnps"]
+        if not to_delete:
+            return []
+
+        with ThreadPoolExecutor(max_workers = len(to_delete)) as executor:
+            deleted = [vm_name for vm_name, success in zip(to_delete, executor.map(self._delete, to_delete)) if success]
+        for vm_name in deleted:
+            del self.workers[vm_name]
+        self._save()
+        return deleted
+
+    # Polls the demand once and scales the fleet. Returns what it saw and
+    # did, as a dict.
+    def tick(self):
+        lost = self._forget_lost()
+        required = self.demand.required_mnps()
+        capacity = self.capacity()
+        summary = {"required": required, "capacity": capacity, "lost": lost, "launched": [], "deleted": []}
+        if required is None:
+            log("autoscaler", "demand unknown, leaving the fleet as it is")
+            return summary
+
+        target = required * (1 + self.headroom)
+        if capacity < target:
+            self.state["over_since"] = None
+            summary["launched"] = self._scale_up(self.options(), target - capacity)
+        elif capacity > target * (1 + self.scale_down_margin):
+            if self.state["over_since"] is None:
+                self.state["over_since"] = self.clock()
+            if self.clock() - self.state["over_since"] >= self.scale_down_delay:
+                summary["deleted"] = self._scale_down(self.options(), target)
+        else:
+            self.state["over_since"] = None
+        self._save()
+
+        summary["capacity"] = self.capacity()
+        log("autoscaler", "{:.2f} mnps required, {:.2f} mnps running on {} workers".format(required, summary["capacity"], len(self.workers)))
+        return summary
+
+    # Ticks every interval seconds, n_ticks times (forever by default).
+    def run(self, interval = 60, n_ticks = None):
+        n = 0
+        while n_ticks is None or n < n_ticks:
+            try:
+                self.tick()
+            except Exception as e:
+                log("autoscaler", "tick failed, trying again in {} seconds: {}".format(interval, e))
+            n += 1
+            if n_ticks is None or n < n_ticks:
+                self.sleep(interval)
@@ -0,0 +1,292 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import shutil
+import subprocess
+
+from ssh_session import SshSession
+from zone_index import region_of
+
+AWS_ZONE_INDEX_FILE = "zone_index_aws.json"
+AWS_REGIONS = ["us-east-1", "us-east-2", "us-west-2", "eu-west-1", "eu-central-1", "eu-north-1"]
+# The 8 and 16 vCPU compute-oriented instance types we price, like
+# machine_families.DEFINED_SHAPES on Compute Engine.
+AWS_INSTANCE_TYPES = [
+    "c5.2xlarge", "c5.4xlarge",
+    "c5a.2xlarge", "c5a.4xlarge",
+    "c6i.2xlarge", "c6i.4xlarge",
+    "c6a.2xlarge", "c6a.4xlarge",
+    "m5.2xlarge", "m5.4xlarge",
+]
+# Ubuntu 20.04, as on Compute Engine, resolved in every region by EC2 itself.
+UBUNTU_IMAGE = "resolve:ssm:/aws/service/canonical/ubuntu/server/20.04/stable/current/amd64/hvm/ebs-gp2/ami-id"
+
+# Strings in our output telling us the instance went away under our feet:
+# spot instances are reclaimed without a trace, so ssh_args() finds no
+# live instance with a public IP. ssh's own errors (timeouts, refused or
+# reset connections) aren't markers: a booting instance gives them too, and
+# ssh_session.SshSession asks ssh_args() again after them.
+PREEMPTION_MARKERS = ["has no public IP address"]
+# Strings telling us an availability zone is out of spot capacity.
+STOCKOUT_MARKERS = ["InsufficientInstanceCapacity", "capacity-not-available"]
+# Strings telling us an availability zone doesn't offer an instance type.
+UNSUPPORTED_MARKERS = ["(Unsupported)", "is not supported in your requested Availability Zone"]
+
+# EC2 instance states, as Compute Engine would call them (only "RUNNING"
+# matters to us).
+STATUSES = {"pending": "PROVISIONING", "running": "RUNNING", "stopping": "STOPPING", "stopped": "TERMINATED", "shutting-down": "STOPPING", "terminated": "TERMINATED"}
+
+def is_preempted(out):
+    return any(marker in out for marker in PREEMPTION_MARKERS)
+
+def is_stockout(out):
+    return any(marker in out for marker in STOCKOUT_MARKERS)
+
+def is_unsupported(out):
+    return any(marker in out for marker in UNSUPPORTED_MARKERS)
+
+# "2021-03-01T12:00:00.000Z" -> seconds since the epoch
+def parse_timestamp(value):
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+# Instance lifecycle and remote execution on EC2 spot instances through the
+# aws CLI, with the same methods as compute.GcloudCompute, so that the
+# benchmark orchestrator, the inventory and the autoscaler work on it
+# unchanged. VMs are found by their Name tag, over every region of regions.
+# They boot from image (an AMI id or an SSM parameter), with the key pair
+# key_name, whose private key is key_file, and security_group, which must
+# let ssh in. Remote commands and transfers go through plain ssh as user.
+class AwsCompute:
+    def __init__(self, aws_cmd = None, regions = AWS_REGIONS, image = UBUNTU_IMAGE, key_name = None, key_file = None, security_group = None, user = "ubuntu", max_workers = 8):
+        self.aws_cmd = aws_cmd or shutil.which("aws")
+        self.regions = regions
+        self.image = image
+        self.key_name = key_name
+        self.key_file = key_file
+        self.security_group = security_group
+        self.user = user
+        self.max_workers = max_workers
+
+    def _run(self, args, region):
+        p = subprocess.run([self.aws_cmd, "ec2"] + args + ["--region", region, "--output", "json"], capture_output = True, encoding = "utf8")
+        return p.returncode == 0, p.stdout, p.stderr
+
+    def is_preempted(self, out):
+        return is_preempted(out)
+
+    def is_stockout(self, out):
+        return is_stockout(out)
+
+    def is_unsupported(self, out):
+        return is_unsupported(out)
+
+    # The EC2 descriptions of our instances in a region whose Name tag
+    # matches one of names (which can end with a * wildcard).
+    def _describe(self, names, region, zone = None):
+        filters = ["Name=tag:Name,Values=" + ",".join(names), "Name=instance-state-name,Values=pending,running,stopping,stopped"]
+        if zone is not None:
+            filters.append("Name=availability-zone,Values=" + zone)
+        success, stdout, stderr = self._run(["describe-instances", "--filters"] + filters, region)
+        if not success:
+            raise RuntimeError(stderr)
+        return [x for reservation in json.loads(stdout)["Reservations"] for x in reservation["Instances"]]
+
+    # The instance ids of VMs of a zone. Returns them with the names that
+    # matched no instance.
+    def _instance_ids(self, vm_names, zone):
+        ids = {}
+        for x in self._describe(vm_names, region_of(zone), zone):
+            for tag in x.get("Tags", []):
+                if tag["Key"] == "Name":
+                    ids[tag["Value"]] = x["InstanceId"]
+        return [ids[name] for name in vm_names if name in ids], [name for name in vm_names if name not in ids]
+
+    # Creates a spot instance with the given name, instance type and zone,
+    # and waits for it to be running. image can be an AMI id to boot from
+    # instead of the default one. An instance that doesn't come up is
+    # terminated, since nothing else knows about it.
+    def make_spot_instance(self, vm_name, instance_type, zone, image = None):
+        args = [
+            "run-instances",
+            "--image-id", image or self.image,
+            "--instance-type", instance_type,
+            "--placement", "AvailabilityZone=" + zone,
+            "--instance-market-options", "MarketType=spot",
+            "--tag-specifications", "ResourceType=instance,Tags=[{{Key=Name,Value={}}}]".format(vm_name),
+        ]
+        if self.key_name is not None:
+            args += ["--key-name", self.key_name]
+        if self.security_group is not None:
+            args += ["--security-group-ids", self.security_group]
+        success, stdout, stderr = self._run(args, region_of(zone))
+        if not success:
+            return False, stdout + stderr
+
+        instance_id = json.loads(stdout)["Instances"][0]["InstanceId"]
+        success, wait_stdout, wait_stderr = self._run(["wait", "instance-running", "--instance-ids", instance_id], region_of(zone))
+        out = "Created [{}] ({}).\n".format(vm_name, instance_id) + wait_stdout + wait_stderr
+        if not success:
+            terminated, terminate_stdout, terminate_stderr = self._run(["terminate-instances", "--instance-ids", instance_id], region_of(zone))
+            if not terminated:
+                out += "ERROR: could not terminate {}, it may still be running:\n".format(instance_id) + terminate_stdout + terminate_stderr
+        return success, out
+
+    # Lists the instance types of AWS_INSTANCE_TYPES every availability zone
+    # offers, as {"name", "zone"} dicts, one call per region.
+    def list_machine_types(self, instance_types = AWS_INSTANCE_TYPES):
+        def offerings(region):
+            success, stdout, stderr = self._run([
+                "describe-instance-type-offerings", "--location-type", "availability-zone",
+                "--filters", "Name=instance-type,Values=" + ",".join(instance_types),
+            ], region)
+            if not success:
+                raise RuntimeError(stderr)
+            return [{"name": x["InstanceType"], "zone": x["Location"]} for x in json.loads(stdout)["InstanceTypeOfferings"]]
+
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(self.regions))) as executor:
+            return [x for region_offerings in executor.map(offerings, self.regions) for x in region_offerings]
+
+    # Lists the instances whose name starts with one of name_prefixes, as
+    # compute.GcloudCompute.list_instances() does, one call per region.
+    def list_instances(self, name_prefixes):
+        def instances(region):
+            out = []
+            for x in self._describe([prefix + "*" for prefix in name_prefixes], region):
+                name = [tag["Value"] for tag in x.get("Tags", []) if tag["Key"] == "Name"][0]
+                out.append({
+                    "name": name,
+                    "instance-type": x["InstanceType"],
+                    "zone": x["Placement"]["AvailabilityZone"],
+                    "status": STATUSES.get(x["State"]["Name"], x["State"]["Name"].upper()),
+                    "created_at": parse_timestamp(x["LaunchTime"]),
+                })
+            return out
+
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(self.regions))) as executor:
+            return [x for region_instances in executor.map(instances, self.regions) for x in region_instances]
+
+    def create_image(self, image_name, image_family, vm_name, zone):
+        return False, "ERROR: benchmark images are only built on Compute Engine"
+
+    # runs an EC2 action (terminate-instances, stop-instances) on several
+    # vms of the same zone in a single call
+    def _act(self, action, vm_names, zone):
+        instance_ids, missing = self._instance_ids(list(vm_names), zone)
+        out = ""
+        if instance_ids:
+            success, stdout, stderr = self._run([action, "--instance-ids"] + instance_ids, region_of(zone))
+            out = stdout + stderr
+            if not success:
+                return False, out
+        if missing:
+            return False, out + "ERROR: The resource '{}' was not found".format(missing[0])
+        return True, out
+
+    def delete_spot_instance(self, vm_name, zone):
+        return self._act("terminate-instances", [vm_name], zone)
+
+    def delete_instances(self, vm_names, zone):
+        return self._act("terminate-instances", vm_names, zone)
+
+    # Only works for persistent spot requests: one-time spot instances can't
+    # be stopped, and EC2 says so.
+    def stop_instances(self, vm_names, zone):
+        return self._act("stop-instances", vm_names, zone)
+
+    # The ssh options and user@host to reach a vm. Returns a success flag,
+    # the options, the destination and what went wrong.
+    def ssh_args(self, vm_name, zone):
+        try:
+            instances = self._describe([vm_name], region_of(zone), zone)
+        except RuntimeError as e:
+            return False, None, None, str(e)
+        ips = [x["PublicIpAddress"] for x in instances if x.get("PublicIpAddress")]
+        if not ips:
+            return False, None, None, "ERROR: Instance [{}] in zone [{}] has no public IP address".format(vm_name, zone)
+
+        options = ["-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "ConnectTimeout=30"]
+        if self.key_file is not None:
+            options += ["-i", self.key_file]
+        return True, options, self.user + "@" + ips[0], ""
+
+    def open_session(self, vm_name, zone):
+        return SshSession(self, vm_name, zone)
+
+    def put_file(self, vm_name, zone, local_fname, remote_fname):
+        with self.open_session(vm_name, zone) as session:
+            return session.put_file(local_fname, remote_fname)
+
+    def get_file(self, vm_name, zone, remote_fname, local_fname):
+        with self.open_session(vm_name, zone) as session:
+            return session.get_file(remote_fname, local_fname)
+
+    def exec_ssh(self, vm_name, zone, command):
+        with self.open_session(vm_name, zone) as session:
+            return session.exec_ssh(command)
+
+# The current Linux spot price of every (instance type, availability zone)
+# of a describe-spot-price-history result, reduced to the cheapest zone of
+# every region, as {"instance-type", "price", "region"} dicts.
+def spot_prices(history):
+    latest = {}
+    for x in history:
+        key = (x["InstanceType"], x["AvailabilityZone"])
+        if key not in latest or x["Timestamp"] > latest[key]["Timestamp"]:
+            latest[key] = x
+
+    cheapest = {}
+    for (instance_type, zone), x in latest.items():
+        key = (instance_type, region_of(zone))
+        cheapest[key] = min(cheapest.get(key, float("inf")), float(x["SpotPrice"]))
+    return [{"instance-type": instance_type, "price": price, "region": region} for (instance_type, region), price in sorted(cheapest.items())]
+
+# EC2 spot price catalog: the current prices of instance_types in regions,
+# from the spot price history, one call per region, the regions in
+# parallel. machine_types() returns them like get_defined_machine_types(
+# return_all = True) does on Compute Engine.
+class AwsSpotPrices:
+    def __init__(self, instance_types = AWS_INSTANCE_TYPES, regions = AWS_REGIONS, aws_cmd = None, max_workers = 8):
+        self.instance_types = instance_types
+        self.regions = regions
+        self.aws_cmd = aws_cmd or shutil.which("aws")
+        self.max_workers = max_workers
+
+    # The spot price history records of a region since now, that is the
+    # price in effect in every availability zone.
+    def _history(self, region):
+        p = subprocess.run([
+            self.aws_cmd, "ec2", "describe-spot-price-history",
+            "--instance-types"] + self.instance_types + [
+            "--product-descriptions", "Linux/UNIX",
+            "--start-time", datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "--region", region, "--output", "json",
+        ], capture_output = True, encoding = "utf8")
+        if p.returncode != 0:
+            raise RuntimeError(p.stderr)
+        return json.loads(p.stdout)["SpotPriceHistory"]
+
+    def machine_types(self):
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(self.regions))) as executor:
+            return spot_prices([x for records in executor.map(self._history, self.regions) for x in records])
+
+# AwsSpotPrices without the aws CLI, for running offline. prices maps
+# (instance type, availability zone) to an hourly price.
+class FakeAwsSpotPrices(AwsSpotPrices):
+    def __init__(self, prices, max_workers = 8):
+        super().__init__(
+            instance_types = sorted(set(instance_type for instance_type, zone in prices)),
+            regions = sorted(set(region_of(zone) for instance_type, zone in prices)),
+            aws_cmd = "aws",
+            max_workers = max_workers,
+        )
+        self.prices = prices
+
+    def _history(self, region):
+        now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        return [{
+            "AvailabilityZone": zone,
+            "InstanceType": instance_type,
+            "ProductDescription": "Linux/UNIX",
+            "SpotPrice": "{:.6f}".format(price),
+            "Timestamp": now,
+        } for (instance_type, zone), price in sorted(self.prices.items()) if region_of(zone) == region]
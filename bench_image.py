@@ -0,0 +1,46 @@
+import datetime
+
+from bench_orchestrator import BENCH_SCRIPT, log, new_vm_name, put_file_when_up
+
+BENCH_IMAGE_FAMILY = "fishnet-bench"
+BASE_IMAGE = ("ubuntu-os-cloud", "ubuntu-2004-lts")
+
+# Builds an image with fishnet and Stockfish already installed, in the
+# BENCH_IMAGE_FAMILY family of our project: boots a VM from the stock Ubuntu
+# image, runs `make_benchmark.py prepare` on it, then snapshots its disk.
+# Benchmark VMs booted from that family skip the whole installation. Returns
+# the image name, or None if something failed.
+def build_benchmark_image(compute, zone, instance_type = "e2-standard-2", image_family = BENCH_IMAGE_FAMILY):
+    vm_name = new_vm_name()
+    image_name = image_family + "-" + datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+    log(image_name, "making spot instance `{}` in {}".format(vm_name, zone))
+    success, out = compute.make_spot_instance(vm_name, instance_type, zone, image = BASE_IMAGE)
+    if not success:
+        log(image_name, "unsuccessful in starting server:\n" + out)
+        return None
+
+    try:
+        with compute.open_session(vm_name, zone) as session:
+            success, out = put_file_when_up(session, BENCH_SCRIPT, "/home/ubuntu/make_benchmark.py")
+            if not success:
+                log(image_name, "could not SCP the benchmark script:\n" + out)
+                return None
+
+            log(image_name, "installing fishnet and Stockfish")
+            success, stdout, stderr = session.exec_ssh("python3 make_benchmark.py prepare")
+            if not success:
+                log(image_name, "preparation FAILED!\n" + stdout + stderr)
+                return None
+
+        log(image_name, "creating image from `{}`".format(vm_name))
+        success, out = compute.create_image(image_name, image_family, vm_name, zone)
+        if not success:
+            log(image_name, "could not create the image:\n" + out)
+            return None
+
+        return image_name
+    finally:
+        success, out = compute.delete_spot_instance(vm_name, zone)
+        if not success:
+            log(image_name, "failed to delete {}! output:\n{}".format(vm_name, out))
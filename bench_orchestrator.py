@@ -0,0 +1,300 @@
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+import datetime
+import json
+import os
+import os.path
+import random
+import string
+import threading
+import time
+
+from filelock import Timeout, FileLock
+
+from bench_state import BENCH_STATE_DIR, BenchRun, parse_progress
+from zone_index import create_in_region
+
+BENCH_DATA_DIR = "fishnet_benchmarker/data/gcp"
+BENCH_SCRIPT = "fishnet_benchmarker/make_benchmark.py"
+
+def new_vm_name():
+    return "fishnetbench-" + "".join([random.choice(string.ascii_lowercase) for x in range(20)])
+
+def log(instance_type, message):
+    print("[{}] {}: {}".format(datetime.datetime.now().strftime("%H:%M:%S"), instance_type, message))
+
+# Uploads a file to a VM that may still be booting: sshd refuses connections
+# for a while after the instance is created, so failed attempts are retried
+# with exponential backoff (1, 2, 4... seconds, at most max_delay) up to
+# attempts times, unless give_up(output) says retrying is pointless (e.g.
+# the VM was preempted). Returns put_file()'s (success, output).
+def put_file_when_up(session, local_fname, remote_fname, attempts = 20, max_delay = 30, give_up = lambda out: False, sleep = time.sleep):
+    for attempt in range(attempts):
+        success, out = session.put_file(local_fname, remote_fname)
+        if success or give_up(out) or attempt == attempts - 1:
+            break
+        sleep(min(2 ** attempt, max_delay))
+    return success, out
+
+# Runs the fishnet benchmark of several machine types concurrently, each one
+# on its own VM. A type is skipped if it already has results (other than
+# partial credit) or if another process holds its lock. At most region_quota VMs run in the same region at
+# once, and a benchmark whose VM gets preempted is retried on a new VM up to
+# max_retries times. Every run is tracked as a bench_state.BenchRun, so that
+# a preempted run that got at least min_partial_seconds of benchmarking done
+# is credited with its partial throughput instead of being started over, and
+# VMs and locks left behind by a dead process are cleaned up on the next run.
+# With a zone_index.ZoneIndex, VMs are only created in zones known to
+# support their machine family. wheelhouse is a local directory of wheels
+# (fishnet and its dependencies) to install from instead of PyPI, for VMs
+# that don't boot from a bench_image image. bench_args are passed on to
+# make_benchmark.py, e.g. "sweep --threads 1,2,4,8 --length 300".
+# VM launches, preemptions and deletions are recorded in preemption_log, a
+# preemption_log.PreemptionLog, if given.
+# Runs are kept under state_dir/<name of data_dir>, so that benchmarks into
+# different data directories (other providers, other engines) never share
+# samples, and a run's state is removed once it reaches a final status.
+class BenchOrchestrator:
+    def __init__(self, compute, data_dir = BENCH_DATA_DIR, state_dir = BENCH_STATE_DIR, max_workers = 4, region_quota = 2, max_retries = 2, scp_attempts = 20, min_partial_seconds = 600, zone_index = None, wheelhouse = None, bench_args = "", preemption_log = None):
+        self.compute = compute
+        self.preemption_log = preemption_log
+        self.bench_args = bench_args
+        self.zone_index = zone_index
+        self.wheelhouse = wheelhouse
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok = True)
+        self.state_dir = os.path.join(state_dir, os.path.basename(os.path.normpath(data_dir)))
+        self.max_workers = max_workers
+        self.region_quota = region_quota
+        self.max_retries = max_retries
+        self.scp_attempts = scp_attempts
+        self.min_partial_seconds = min_partial_seconds
+
+        self._quota_lock = threading.Lock()
+        self._region_slots = {}
+
+    def _region_slot(self, region):
+        with self._quota_lock:
+            if region not in self._region_slots:
+                self._region_slots[region] = threading.BoundedSemaphore(self.region_quota)
+            return self._region_slots[region]
+
+    def results_path(self, instance_type):
+        return os.path.join(self.data_dir, instance_type + ".json")
+
+    # Whether a machine type has results from a full benchmark. Partial
+    # credit for a preempted run (see _credit_partial()) doesn't count, so
+    # that the type gets benchmarked again.
+    def has_full_results(self, instance_type):
+        if not os.path.isfile(self.results_path(instance_type)):
+            return False
+        return not all(entry.get("partial", False) for entry in json.load(open(self.results_path(instance_type))))
+
+    # Tries the candidate zones of a region until one can create the instance
+    # type. Returns the zone, or None with gcloud's output.
+    def _create_vm(self, vm_name, instance_type, region):
+        return create_in_region(self.compute, vm_name, instance_type, region, self.zone_index)
+
+    def _record(self, event, run):
+        if self.preemption_log is not None:
+            self.preemption_log.record(event, run.vm_name, run.instance_type, run.zone)
+
+    # Deletes the VM of a run, if it still has one.
+    def _delete_vm(self, run):
+        if not run.has_vm():
+            return True
+        success, out = self.compute.delete_spot_instance(run.vm_name, run.zone)
+        if not success and "was not found" not in out:
+            log(run.instance_type, "failed to delete {}! output:\n{}".format(run.vm_name, out))
+            return False
+        self._record("terminate", run)
+        run.advance("deleted")
+        return True
+
+    def _preempted(self, run):
+        log(run.instance_type, "we have been interrupted!")
+        self._record("preempt", run)
+        return "preempted"
+
+    # Writes the best partial result of a run as the benchmark result of its
+    # machine type, if it ran for long enough. Returns whether it did.
+    def _credit_partial(self, run):
+        sample = run.best_partial()
+        if sample is None or sample["elapsed"] < self.min_partial_seconds:
+            return False
+
+        log(run.instance_type, "crediting the {:.0f} seconds benchmarked before preemption".format(sample["elapsed"]))
+        open(self.results_path(run.instance_type), "w").write(json.dumps([{
+            "n_cores": sample["n_cores"],
+            "n_thread_per_process": sample["n_thread_per_process"],
+            "bench_length": sample["elapsed"],
+            "n_nodes": sample["n_nodes"],
+            "partial": True,
+            "provisioning": run.data.get("provisioning", {}),
+        }]))
+        return True
+
+    def _put_wheelhouse(self, session):
+        success, stdout, stderr = session.exec_ssh("mkdir -p /home/ubuntu/wheelhouse")
+        if not success:
+            return False, stdout + stderr
+        for f in sorted(glob(os.path.join(self.wheelhouse, "*.whl"))):
+            success, out = session.put_file(f, "/home/ubuntu/wheelhouse/" + os.path.basename(f))
+            if not success:
+                return False, out
+        return True, ""
+
+    # One attempt at benchmarking a machine type. Returns "done", "preempted"
+    # or "failed". The VM is always deleted, whatever happens.
+    def _attempt(self, machine_type, run):
+        instance_type = machine_type["instance-type"]
+        vm_name = new_vm_name()
+        log(instance_type, "making spot instance `{}` in {}".format(vm_name, machine_type["region"]))
+        start = time.time()
+        zone, out = self._create_vm(vm_name, instance_type, machine_type["region"])
+        if zone is None:
+            log(instance_type, "unsuccessful in starting server:\n" + out)
+            return "failed"
+        run.start_attempt(vm_name, zone)
+        self._record("launch", run)
+        # Seconds of billed VM time spent before benchmarking could start.
+        provisioning = {"create_seconds": round(time.time() - start, 1)}
+
+        # Progress lines are persisted as they arrive, so a run that dies
+        # with us still gets credited for them.
+        def on_line(line):
+            if line.startswith("SETUP "):
+                provisioning.update(json.loads(line[len("SETUP "):]))
+                log(instance_type, "provisioning took {}".format(", ".join("{} = {}".format(k, v) for k, v in provisioning.items())))
+                run.data["provisioning"] = provisioning
+                run.save()
+                return
+
+            samples = parse_progress(line)
+            if samples:
+                run.add_samples(samples)
+                log(instance_type, "{n_nodes} nodes after {elapsed:.0f} seconds".format(**samples[0]))
+
+        try:
+            with self.compute.open_session(vm_name, zone) as session:
+                success, out = put_file_when_up(session, BENCH_SCRIPT, "/home/ubuntu/make_benchmark.py", self.scp_attempts, give_up = self.compute.is_preempted)
+                if success and self.wheelhouse is not None:
+                    success, out = self._put_wheelhouse(session)
+                if not success:
+                    if self.compute.is_preempted(out):
+                        return self._preempted(run)
+                    log(instance_type, "could not SCP the benchmark script:\n" + out)
+                    return "failed"
+                provisioning["upload_seconds"] = round(time.time() - start - provisioning["create_seconds"], 1)
+                run.advance("provisioned", provisioning = provisioning)
+
+                log(instance_type, "running benchmark on {}. Should take <15 minutes.".format(vm_name))
+                run.advance("running")
+                success, stdout, stderr = session.exec_ssh(("python3 make_benchmark.py " + self.bench_args).strip(), on_line = on_line)
+                if not success:
+                    if self.compute.is_preempted(stdout + stderr):
+                        return self._preempted(run)
+                    log(instance_type, "benchmark FAILED!\n" + stdout + stderr)
+                    return "failed"
+
+                success, out = session.get_file("/home/ubuntu/results.json", self.results_path(instance_type))
+                if not success:
+                    log(instance_type, "could not get results.json:\n" + out)
+                    return self._preempted(run) if self.compute.is_preempted(out) else "failed"
+                # The run's state goes away with it: its provisioning times
+                # are kept with its results, and from there in the registry.
+                results = json.load(open(self.results_path(instance_type)))
+                open(self.results_path(instance_type), "w").write(json.dumps([dict(entry, provisioning = provisioning) for entry in results]))
+                run.advance("collected")
+
+            log(instance_type, "done")
+            return "done"
+        finally:
+            self._delete_vm(run)
+
+    # Benchmarks one machine type, holding its lock for the whole time.
+    # Returns its final status.
+    def run_one(self, machine_type):
+        instance_type = machine_type["instance-type"]
+        if self.has_full_results(instance_type):
+            log(instance_type, "has already been benchmarked. Skipping it.")
+            return "skipped"
+        if os.path.isfile(self.results_path(instance_type)):
+            log(instance_type, "only has a partial benchmark, running it again")
+
+        lock = FileLock(os.path.join(self.data_dir, instance_type + ".lock"))
+        try:
+            lock.acquire(timeout = 0)
+        except Timeout:
+            log(instance_type, "is being benchmarked by someone else. Skipping it.")
+            return "skipped"
+
+        try:
+            run = BenchRun.load(self.state_dir, instance_type)
+            status = self._run_with_retries(machine_type, run)
+            # Done with this run, unless its VM couldn't be deleted: the
+            # next reconcile() needs its state to find it.
+            if not run.has_vm():
+                run.remove()
+            return status
+        finally:
+            lock.release()
+
+    def _run_with_retries(self, machine_type, run):
+        instance_type = machine_type["instance-type"]
+        # A run a dead process left behind: get rid of its VM, and use what
+        # it measured if that is enough.
+        if run.has_vm():
+            log(instance_type, "deleting `{}`, left behind by an interrupted run".format(run.vm_name))
+            self._delete_vm(run)
+        if self._credit_partial(run):
+            return "partial"
+
+        with self._region_slot(machine_type["region"]):
+            status = self._attempt(machine_type, run)
+            n_retries = 0
+            while status == "preempted":
+                if self._credit_partial(run):
+                    return "partial"
+                if n_retries == self.max_retries:
+                    break
+                n_retries += 1
+                log(instance_type, "retrying on a new VM ({}/{})".format(n_retries, self.max_retries))
+                status = self._attempt(machine_type, run)
+            return status
+
+    # Cleans up after processes that died while benchmarking: deletes the VMs
+    # of their runs and removes their lock files. Runs and locks held by live
+    # processes are left alone.
+    def reconcile(self):
+        for run in BenchRun.load_all(self.state_dir):
+            if not run.has_vm():
+                continue
+            lock = FileLock(os.path.join(self.data_dir, run.instance_type + ".lock"))
+            try:
+                with lock.acquire(timeout = 0):
+                    log(run.instance_type, "deleting orphaned VM `{}`".format(run.vm_name))
+                    self._delete_vm(run)
+            except Timeout:
+                continue
+
+        for lock_path in glob(os.path.join(self.data_dir, "*.lock")):
+            lock = FileLock(lock_path)
+            try:
+                lock.acquire(timeout = 0)
+            except Timeout:
+                continue
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+            finally:
+                lock.release()
+
+    # Benchmarks every machine type, max_workers at a time. Returns a dict
+    # instance type -> status.
+    def run(self, machine_types):
+        self.reconcile()
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            statuses = list(executor.map(self.run_one, machine_types))
+        return {machine_type["instance-type"]: status for machine_type, status in zip(machine_types, statuses)}
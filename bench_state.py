@@ -0,0 +1,120 @@
+import json
+import os
+import os.path
+import socket
+import time
+
+BENCH_STATE_DIR = "bench_state"
+
+# The lifecycle of a benchmark VM, in order. A run can jump to "deleted" from
+# any state (e.g. when it gets preempted), but never goes backwards.
+STATES = ["created", "provisioned", "running", "collected", "deleted"]
+
+# Parses the "PROGRESS {...}" lines make_benchmark.py prints while running
+# into a list of samples.
+def parse_progress(out):
+    samples = []
+    for line in out.splitlines():
+        if line.startswith("PROGRESS "):
+            try:
+                samples.append(json.loads(line[len("PROGRESS "):]))
+            except ValueError:
+                continue
+    return samples
+
+# The persisted state of the benchmark of one machine type. Every transition
+# is written to <state_dir>/<instance type>.json before the next gcloud call
+# is made, so that a new process can find out which VM an interrupted run
+# left behind and what it had measured so far.
+class BenchRun:
+    def __init__(self, state_dir, instance_type, data = None):
+        self.state_dir = state_dir
+        self.instance_type = instance_type
+        self.data = data or {
+            "instance-type": instance_type,
+            "state": None,
+            "vm_name": None,
+            "zone": None,
+            "attempts": 0,
+            "samples": [],
+            "history": [],
+        }
+
+    @classmethod
+    def load(cls, state_dir, instance_type):
+        path = os.path.join(state_dir, instance_type + ".json")
+        if os.path.isfile(path):
+            return cls(state_dir, instance_type, json.load(open(path)))
+        return cls(state_dir, instance_type)
+
+    # Every run that was persisted in a state directory.
+    @classmethod
+    def load_all(cls, state_dir):
+        if not os.path.isdir(state_dir):
+            return []
+        return [cls.load(state_dir, f[:-len(".json")]) for f in sorted(os.listdir(state_dir)) if f.endswith(".json")]
+
+    @property
+    def state(self):
+        return self.data["state"]
+
+    @property
+    def vm_name(self):
+        return self.data["vm_name"]
+
+    @property
+    def zone(self):
+        return self.data["zone"]
+
+    # True when a VM of this run may still exist.
+    def has_vm(self):
+        return self.state not in (None, "deleted")
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok = True)
+        path = os.path.join(self.state_dir, self.instance_type + ".json")
+        tmp_path = path + ".tmp"
+        open(tmp_path, "w").write(json.dumps(self.data, indent = 4))
+        os.replace(tmp_path, path)
+
+    def advance(self, state, **fields):
+        if state not in STATES:
+            raise ValueError("unknown benchmark state `{}`".format(state))
+        if state != "deleted" and self.state is not None and STATES.index(state) <= STATES.index(self.state):
+            raise ValueError("{}: can't go from `{}` to `{}`".format(self.instance_type, self.state, state))
+
+        self.data.update(fields)
+        self.data["state"] = state
+        if state == "collected":
+            self.data.setdefault("completed", []).append(self.data["attempts"])
+        self.data["history"].append({"state": state, "t": int(time.time()), "host": socket.gethostname(), "pid": os.getpid()})
+        self.save()
+
+    # Starts a new attempt on a fresh VM.
+    def start_attempt(self, vm_name, zone):
+        self.data["attempts"] += 1
+        self.data["state"] = None
+        self.advance("created", vm_name = vm_name, zone = zone)
+
+    def add_samples(self, samples):
+        for sample in samples:
+            sample["attempt"] = self.data["attempts"]
+        self.data["samples"] += samples
+        self.save()
+
+    # The longest stretch any attempt that never completed ran for, as its
+    # last progress sample. Completed attempts have their own results file.
+    def best_partial(self):
+        completed = set(self.data.get("completed", []))
+        last = {}
+        for sample in self.data["samples"]:
+            if sample["attempt"] not in completed:
+                last[sample["attempt"]] = sample
+        if not last:
+            return None
+        return max(last.values(), key = lambda x: x["elapsed"])
+
+    def remove(self):
+        path = os.path.join(self.state_dir, self.instance_type + ".json")
+        if os.path.isfile(path):
+            os.remove(path)
@@ -0,0 +1,156 @@
+from glob import glob
+import hashlib
+import json
+import math
+import os
+import os.path
+
+BENCH_ROOT = "fishnet_benchmarker/data"
+REGISTRY_FILE = os.path.join(BENCH_ROOT, "benchmarks.jsonl")
+
+# Two-sided 95% Student t quantiles by degrees of freedom; 1.96 past the end.
+T_95 = [None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# "7065 million" -> 7065000000
+def parse_nodes(n_nodes):
+    if isinstance(n_nodes, (int, float)):
+        return int(n_nodes)
+    units = {"thousand": 10 ** 3, "million": 10 ** 6, "billion": 10 ** 9}
+    parts = n_nodes.split()
+    return int(float(parts[0]) * units.get(parts[1], 1)) if len(parts) > 1 else int(parts[0])
+
+# "fishnet_benchmarker/data/gcp_stockfish/x.json" -> "gcp"
+def provider_of(bench_dir):
+    return os.path.basename(os.path.normpath(bench_dir)).split("_")[0]
+
+# Mean, standard deviation and 95% confidence interval of the mean of a list
+# of mnps figures.
+def summarize(values):
+    n = len(values)
+    mean = sum(values) / n
+    stddev = math.sqrt(sum((x - mean) ** 2 for x in values) / (n - 1)) if n > 1 else 0.0
+    t = T_95[n - 1] if 1 <= n - 1 < len(T_95) else 1.96
+    half_width = t * stddev / math.sqrt(n) if n > 1 else float("inf")
+    return {"n_runs": n, "mnps": mean, "stddev": stddev, "ci95": (mean - half_width, mean + half_width)}
+
+# Every benchmark result we have, indexed by (provider, shape, config) where
+# config is (n_cores, n_thread_per_process, engine). Runs are kept in an
+# append-only JSON lines file; the result files the benchmarks write under
+# fishnet_benchmarker/data/<provider>/ are imported into it (raw entry
+# included) the first time the registry sees them.
+class BenchmarkRegistry:
+    def __init__(self, path = REGISTRY_FILE, bench_root = BENCH_ROOT, regression_threshold = 0.1, sync = True):
+        self.path = path
+        self.bench_root = bench_root
+        self.regression_threshold = regression_threshold
+
+        self.index = {}
+        self.sources = set()
+        if os.path.isfile(path):
+            for line in open(path):
+                if line.strip():
+                    self._index(json.loads(line))
+
+        if sync:
+            self.sync()
+
+    def _index(self, run):
+        key = (run["provider"], run["shape"], tuple(run["config"]))
+        self.index.setdefault(key, []).append(run)
+        if run.get("source"):
+            self.sources.add(run["source"])
+
+    # Imports the result files that aren't in the registry yet. A file is
+    # identified by its path and content, so rewriting it adds new runs.
+    def sync(self):
+        flagged = []
+        for f in sorted(glob(os.path.join(self.bench_root, "*", "*.json"))):
+            content = open(f, "rb").read()
+            rel_path = os.path.relpath(f, self.bench_root).replace("\\", "/")
+            source = rel_path + "@" + hashlib.sha1(content).hexdigest()[:12]
+            if source in self.sources:
+                continue
+
+            provider = provider_of(os.path.dirname(f))
+            shape = os.path.basename(f).split(".")[0]
+            for idx, entry in enumerate(json.loads(content)):
+                if self.add_run(provider, shape, entry, source = source, source_idx = idx):
+                    flagged.append((provider, shape))
+        return flagged
+
+    # Records one result entry (as make_benchmark.py writes them). Returns
+    # whether it deviates from the previous runs of the same configuration
+    # by more than regression_threshold, relative to their mean.
+    def add_run(self, provider, shape, entry, source = None, source_idx = 0):
+        n_nodes = parse_nodes(entry["n_nodes"])
+        bench_length = float(entry["bench_length"])
+        run = {
+            "provider": provider,
+            "shape": shape,
+            "config": [int(entry.get("n_cores", 0)), int(entry.get("n_thread_per_process", 0)), entry.get("engine", "fishnet")],
+            "n_nodes": n_nodes,
+            "bench_length": bench_length,
+            "mnps": n_nodes / 10 ** 6 / bench_length,
+            "partial": bool(entry.get("partial", False)),
+            # Seconds spent creating the VM, uploading and setting up before
+            # benchmarking started (see bench_orchestrator).
+            "provisioning": entry.get("provisioning", {}),
+            "source": source,
+            "source_idx": source_idx,
+            "raw": entry,
+        }
+
+        key = (provider, shape, tuple(run["config"]))
+        flagged = False
+        previous = summarize([x["mnps"] for x in self.index[key]]) if key in self.index else None
+        if previous is not None and previous["mnps"] > 0:
+            deviation = abs(run["mnps"] - previous["mnps"]) / previous["mnps"]
+            if deviation > self.regression_threshold:
+                flagged = True
+                print("WARNING! {} {} {}: new run at {:.3f} mnps is {:.0%} off the previous {} runs ({:.3f} mnps)".format(
+                    provider, shape, run["config"], run["mnps"], deviation, previous["n_runs"], previous["mnps"]))
+        run["flagged"] = flagged
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok = True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(run) + "\n")
+        self._index(run)
+        return flagged
+
+    def runs(self, provider, shape, config = None):
+        if config is not None:
+            return list(self.index.get((provider, shape, tuple(config)), []))
+        return [run for key, runs in self.index.items() if key[:2] == (provider, shape) for run in runs]
+
+    # Statistics of every configuration of every shape of a provider, as a
+    # dict shape -> config -> summarize() result (plus the shortest run
+    # summarized). Partial runs and runs shorter than min_length are left
+    # out, unless a configuration has nothing else, in which case they are
+    # all summarized and the summary is marked "short".
+    def stats(self, provider, engine = "fishnet", min_length = 0):
+        out = {}
+        for (p, shape, config), runs in sorted(self.index.items()):
+            if p != provider or config[2] != engine:
+                continue
+            full = [x for x in runs if not x.get("partial") and x["bench_length"] >= min_length]
+            summary = summarize([x["mnps"] for x in full or runs])
+            summary["bench_length"] = min(x["bench_length"] for x in full or runs)
+            summary["short"] = not full
+            out.setdefault(shape, {})[config] = summary
+        return out
+
+    # The best configuration of every shape of a provider, as a dict
+    # shape -> summary (with its "config"). Configurations with full runs
+    # beat "short" ones.
+    def best(self, provider, engine = "fishnet", min_length = 0):
+        out = {}
+        for shape, configs in self.stats(provider, engine, min_length).items():
+            config, summary = max(configs.items(), key = lambda x: (not x[1]["short"], x[1]["mnps"]))
+            out[shape] = dict(summary, config = config)
+        return out
+
+    # dict shape -> mean mnps of its best configuration.
+    def mnps(self, provider = "gcp", engine = "fishnet", min_length = 0):
+        return {shape: summary["mnps"] for shape, summary in self.best(provider, engine, min_length).items()}
@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import os.path
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BILLING_URL = "https://cloudbilling.googleapis.com/v1"
+COMPUTE_SERVICE_NAME = "Compute Engine"
+
+# Only preemptible compute instances are of any use to us.
+def is_preemptible_compute(sku):
+    return sku["category"]["usageType"] == "Preemptible" and sku["category"]["resourceFamily"] == "Compute"
+
+# Client for the Cloud Billing catalog. It keeps one pooled HTTP session for
+# all its requests and caches the preemptible Compute Engine SKUs on disk, so
+# that repeated calls within ttl seconds don't touch the network at all. Once
+# the ttl has expired, the whole catalog is downloaded again: prices are
+# spread over many pages, so no single page tells whether it changed.
+class SkuClient:
+    def __init__(self, api_key, cache_dir = "sku_cache", ttl = 3600, base_url = BILLING_URL, pool_size = 4):
+        self.api_key = api_key
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.base_url = base_url.rstrip("/")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._service_id = None
+        self._cache = None
+
+    def _get(self, path, params = None):
+        params = dict(params or {})
+        params["key"] = self.api_key
+        r = self.session.get(self.base_url + path, params = params, timeout = 30)
+        r.raise_for_status()
+        return r
+
+    def service_id(self):
+        if self._service_id is None:
+            services = self._get("/services").json()["services"]
+            self._service_id = [x for x in services if x["displayName"] == COMPUTE_SERVICE_NAME][0]["serviceId"]
+        return self._service_id
+
+    # Yields the raw SKU pages of the Compute Engine catalog. The request for
+    # the next page is sent as soon as its token is known, so it is in flight
+    # while the caller processes the current page. first_page can be given to
+    # start from an already fetched response.
+    def iter_pages(self, first_page = None):
+        path = "/services/{}/skus".format(self.service_id())
+        with ThreadPoolExecutor(max_workers = 1) as executor:
+            page = first_page if first_page is not None else self._get(path).json()
+            while True:
+                token = page.get("nextPageToken", "").strip()
+                next_page = executor.submit(self._get, path, {"pageToken": token}) if token else None
+                yield page
+                if next_page is None:
+                    break
+                page = next_page.result().json()
+
+    # Streams the preemptible Compute Engine SKUs, filtering every page as it
+    # arrives instead of keeping the whole catalog around.
+    def iter_preemptible_compute_skus(self, first_page = None):
+        for page in self.iter_pages(first_page):
+            for sku in page.get("skus", []):
+                if is_preemptible_compute(sku):
+                    yield sku
+
+    def _cache_path(self):
+        return os.path.join(self.cache_dir, "compute_skus.json")
+
+    def _load_cache(self):
+        if self._cache is None and os.path.isfile(self._cache_path()):
+            try:
+                self._cache = json.load(open(self._cache_path()))
+                self._service_id = self._service_id or self._cache["service_id"]
+            except (ValueError, KeyError):
+                self._cache = None
+        return self._cache
+
+    def _save_cache(self, cache):
+        os.makedirs(self.cache_dir, exist_ok = True)
+        tmp_path = self._cache_path() + ".tmp"
+        open(tmp_path, "w").write(json.dumps(cache))
+        os.replace(tmp_path, self._cache_path())
+        self._cache = cache
+
+    # Returns the list of preemptible Compute Engine SKUs, from the cache if
+    # it is fresh, from the API otherwise. force skips the ttl check.
+    def preemptible_compute_skus(self, force = False):
+        cache = self._load_cache()
+        now = time.time()
+        if cache is not None and not force and now - cache["fetched_at"] < self.ttl:
+            return cache["skus"]
+
+        skus = list(self.iter_preemptible_compute_skus())
+        self._save_cache({"service_id": self.service_id(), "fetched_at": now, "skus": skus})
+        return skus
@@ -0,0 +1,30 @@
+from benchmark_registry import BenchmarkRegistry
+
+# How many fishnet mnps one Stockfish bench mnps is worth, from the machine
+# types that were benchmarked both ways (see make_benchmark.py's --engine).
+# Returns the mean ratio and the per-type ratios, or None and {} if no type
+# was benchmarked both ways.
+def calibration_factor(registry = None, provider = "gcp"):
+    registry = registry or BenchmarkRegistry()
+    fishnet = registry.mnps(provider, "fishnet")
+    stockfish = registry.mnps(provider, "stockfish")
+
+    ratios = {name: fishnet[name] / stockfish[name] for name in sorted(set(fishnet) & set(stockfish)) if stockfish[name] > 0}
+    if not ratios:
+        return None, ratios
+    return sum(ratios.values()) / len(ratios), ratios
+
+# Fishnet mnps for every benchmarked machine type: measured where we have a
+# fishnet benchmark, estimated from the Stockfish bench and the calibration
+# factor otherwise.
+def calibrated_benchmarks(registry = None, provider = "gcp"):
+    registry = registry or BenchmarkRegistry()
+    benchmarks = registry.mnps(provider, "fishnet")
+    factor, ratios = calibration_factor(registry, provider)
+    if factor is None:
+        return benchmarks
+
+    for name, mnps in registry.mnps(provider, "stockfish").items():
+        if name not in benchmarks:
+            benchmarks[name] = mnps * factor
+    return benchmarks
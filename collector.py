@@ -0,0 +1,63 @@
+import datetime
+import math
+import time
+
+# Polls prices on a fixed cadence and records them in a
+# pricing_store.PriceDeltaLog. Ticks are scheduled every interval seconds
+# from the first one, whatever the time fetching took, so the samples don't
+# drift; ticks missed because a fetch overran are skipped rather than
+# bunched up. After a failed fetch, the next attempt is the first tick of
+# the grid at least interval seconds after it, doubled per consecutive
+# failure up to max_backoff, so backing off doesn't shift the grid.
+# fetch returns a get_defined_machine_types(return_all = True) result, and
+# must really fetch it (not return cached prices), or the log would record
+# stale prices under new timestamps.
+class PricingCollector:
+    def __init__(self, fetch, log, interval = 60, max_backoff = 15 * 60, clock = time.time, sleep = time.sleep):
+        self.fetch = fetch
+        self.log = log
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.n_failures = 0
+
+    # Fetches and records prices once. Returns the number of rows written,
+    # or None if fetching failed.
+    def tick(self):
+        t = int(self.clock())
+        stamp = datetime.datetime.fromtimestamp(t).strftime("%H:%M")
+        try:
+            machine_types = self.fetch()
+        except Exception as e:
+            self.n_failures += 1
+            print("[{}]: exception ".format(stamp), str(e))
+            return None
+
+        self.n_failures = 0
+        n_rows = self.log.append_snapshot(t, machine_types)
+        print("[{}]: saved pricing data ({} changes)".format(stamp, n_rows))
+        return n_rows
+
+    # When the tick after one scheduled at `scheduled` is due.
+    def next_tick(self, scheduled):
+        if self.n_failures:
+            earliest = max(scheduled + min(self.max_backoff, self.interval * 2 ** (self.n_failures - 1)), self.clock())
+            return scheduled + math.ceil((earliest - scheduled) / self.interval) * self.interval
+        scheduled += self.interval
+        now = self.clock()
+        if scheduled <= now:
+            scheduled += (now - scheduled) // self.interval * self.interval + self.interval
+        return scheduled
+
+    # Collects n_ticks times (forever by default).
+    def run(self, n_ticks = None):
+        scheduled = self.clock()
+        n = 0
+        while n_ticks is None or n < n_ticks:
+            self.tick()
+            n += 1
+            if n_ticks is not None and n == n_ticks:
+                break
+            scheduled = self.next_tick(scheduled)
+            self.sleep(max(0, scheduled - self.clock()))
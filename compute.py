@@ -0,0 +1,199 @@
+import datetime
+import json
+import shlex
+import shutil
+import subprocess
+
+from ssh_session import SshSession
+
+# Strings in gcloud's output telling us the VM went away under our feet.
+# ssh's own "Connection closed by remote host" isn't one: sshd says it too
+# while a new VM boots. A VM that is gone has no external IP address left
+# (see ssh_session.SshSession).
+PREEMPTION_MARKERS = ["External IP", "external IP address", "unexpectedly closed"]
+# Strings in gcloud's output telling us a zone is out of capacity.
+STOCKOUT_MARKERS = ["ZONE_RESOURCE_POOL_EXHAUSTED", "does not have enough resources available"]
+# Strings in gcloud's output telling us a zone doesn't offer a machine type.
+UNSUPPORTED_MARKERS = ["does not exist in zone"]
+
+def is_preempted(out):
+    return any(marker in out for marker in PREEMPTION_MARKERS)
+
+def is_stockout(out):
+    return any(marker in out for marker in STOCKOUT_MARKERS)
+
+def is_unsupported(out):
+    return any(marker in out for marker in UNSUPPORTED_MARKERS)
+
+# Instance lifecycle and remote execution on Compute Engine through the
+# gcloud CLI. Every method returns a success flag followed by gcloud's output.
+# Anything implementing the same methods (see fake_compute.FakeCompute and
+# aws.AwsCompute) can stand in for it. is_preempted(), is_stockout() and
+# is_unsupported() tell what went wrong from that output, since every cloud
+# words it differently.
+# VMs boot from image_family, taken from image_project (or from our own
+# project when it is None, as for images made by bench_image).
+class GcloudCompute:
+    def __init__(self, gcloud_cmd = None, image_project = "ubuntu-os-cloud", image_family = "ubuntu-2004-lts"):
+        self.gcloud_cmd = gcloud_cmd or shutil.which("gcloud")
+        self.image_project = image_project
+        self.image_family = image_family
+
+    def _run(self, args):
+        p = subprocess.run([self.gcloud_cmd] + args, capture_output = True, encoding = "utf8")
+        return p.stdout, p.stderr
+
+    def is_preempted(self, out):
+        return is_preempted(out)
+
+    def is_stockout(self, out):
+        return is_stockout(out)
+
+    def is_unsupported(self, out):
+        return is_unsupported(out)
+
+    # Creates a spot instance with the given name, instance type and zone.
+    # image can be an (image project, image family) pair to boot from instead
+    # of the default one.
+    def make_spot_instance(self, vm_name, instance_type, zone, image = None):
+        image_project, image_family = image or (self.image_project, self.image_family)
+        image_args = ["--image-family", image_family]
+        if image_project is not None:
+            image_args += ["--image-project", image_project]
+        stdout, stderr = self._run([
+            "compute", "instances", "create",
+            "--machine-type", instance_type,
+            "--zone", zone,
+            vm_name] + image_args + [
+            "--subnet", "defaulteuwb1", "--preemptible"
+        ])
+        out = stdout + stderr
+        if "Created" in out:
+            return True, out
+
+        return False, out
+
+    # Lists every predefined machine type of every zone, in a single call, as
+    # {"name", "zone"} dicts.
+    def list_machine_types(self):
+        stdout, stderr = self._run(["compute", "machine-types", "list", "--format", "json(name,zone)"])
+        if "ERROR" in stderr:
+            raise RuntimeError(stderr)
+        return [{"name": x["name"], "zone": x["zone"].split("/")[-1]} for x in json.loads(stdout)]
+
+    # Lists the instances whose name starts with one of name_prefixes, in a
+    # single call, as {"name", "instance-type", "zone", "status",
+    # "created_at"} dicts (created_at in seconds since the epoch).
+    def list_instances(self, name_prefixes):
+        name_filter = "name ~ ^({})".format("|".join(name_prefixes))
+        stdout, stderr = self._run(["compute", "instances", "list", "--filter", name_filter, "--format", "json(name,zone,machineType,status,creationTimestamp)"])
+        if "ERROR" in stderr:
+            raise RuntimeError(stderr)
+        return [{
+            "name": x["name"],
+            "instance-type": x["machineType"].split("/")[-1],
+            "zone": x["zone"].split("/")[-1],
+            "status": x["status"],
+            "created_at": datetime.datetime.fromisoformat(x["creationTimestamp"]).timestamp(),
+        } for x in json.loads(stdout)]
+
+    # Makes an image of the boot disk of a vm, in the given image family of
+    # our project.
+    def create_image(self, image_name, image_family, vm_name, zone):
+        stdout, stderr = self._run([
+            "compute", "images", "create", image_name,
+            "--source-disk", vm_name, "--source-disk-zone", zone,
+            "--family", image_family, "--force"
+        ])
+        out = stdout + stderr
+        if "ERROR" in out:
+            return False, out
+
+        return True, out
+
+    # deletes a vm
+    def delete_spot_instance(self, vm_name, zone):
+        stdout, stderr = self._run([
+            "-q", "compute", "instances", "delete",
+            vm_name, "--zone", zone
+        ])
+        out = stdout + stderr
+
+        if "Delete" in out:
+            return True, out
+
+        return False, out
+
+    # deletes several vms of the same zone in a single call
+    def delete_instances(self, vm_names, zone):
+        stdout, stderr = self._run(["-q", "compute", "instances", "delete"] + list(vm_names) + ["--zone", zone])
+        out = stdout + stderr
+        if "ERROR" in out:
+            return False, out
+
+        return True, out
+
+    # stops several vms of the same zone in a single call
+    def stop_instances(self, vm_names, zone):
+        stdout, stderr = self._run(["-q", "compute", "instances", "stop"] + list(vm_names) + ["--zone", zone])
+        out = stdout + stderr
+        if "ERROR" in out:
+            return False, out
+
+        return True, out
+
+    # scp a file into a vm
+    def put_file(self, vm_name, zone, local_fname, remote_fname):
+        stdout, stderr = self._run([
+            "compute", "scp", "--force-key-file-overwrite",
+            local_fname, "ubuntu@" + vm_name + ":" + remote_fname, "--zone", zone,
+        ])
+        out = stdout + stderr
+        if "ERROR" in out:
+            return False, out
+
+        return True, out
+
+    # scp a file from a vm
+    def get_file(self, vm_name, zone, remote_fname, local_fname):
+        stdout, stderr = self._run([
+            "compute", "scp", "--force-key-file-overwrite",
+            "ubuntu@" + vm_name + ":" + remote_fname, local_fname, "--zone", zone,
+        ])
+        out = stdout + stderr
+        if "ERROR" in out:
+            return False, out
+
+        return True, out
+
+    # The ssh options and user@host gcloud would use to reach a vm, without
+    # connecting. Returns a success flag, the options, the destination and
+    # gcloud's output.
+    def ssh_args(self, vm_name, zone):
+        stdout, stderr = self._run([
+            "compute", "ssh", "--force-key-file-overwrite", "--dry-run",
+            "ubuntu@" + vm_name, "--zone", zone
+        ])
+        if "ERROR" in stdout + stderr or not stdout.strip():
+            return False, None, None, stdout + stderr
+
+        args = shlex.split(stdout.strip().splitlines()[-1])
+        options = [x for x in args[1:-1] if x != "-t"]
+        return True, options, args[-1], stdout + stderr
+
+    # Opens an SshSession to a vm, to run several commands and transfers
+    # over a single connection.
+    def open_session(self, vm_name, zone):
+        return SshSession(self, vm_name, zone)
+
+    # executes a command in a vm through ssh
+    def exec_ssh(self, vm_name, zone, command):
+        stdout, stderr = self._run([
+            "compute", "ssh", "--force-key-file-overwrite",
+            "ubuntu@" + vm_name, "--command", command, "--zone", zone
+        ])
+
+        if "ERROR" in stdout + stderr:
+            return False, stdout, stderr
+
+        return True, stdout, stderr
@@ -0,0 +1,65 @@
+import time
+
+import requests
+
+from simulator import lichess_demand
+
+FISHNET_STATUS_URL = "https://lichess.org/fishnet/status"
+
+# Demand sources tell the autoscaler how much throughput it should have
+# running: required_mnps() returns million nodes per second, or None when
+# the demand can't be known right now (the autoscaler then leaves the fleet
+# alone).
+
+# Demand from the fishnet analysis queue. Every job queued or being analysed
+# is assumed to need mnodes_per_job million nodes, and the backlog should be
+# cleared within drain_seconds. min_mnps is kept running whatever the queue
+# looks like, so that new jobs don't have to wait for a VM to boot.
+class FishnetQueueDemand:
+    def __init__(self, url = FISHNET_STATUS_URL, mnodes_per_job = 160, drain_seconds = 60, min_mnps = 0.0, timeout = 10):
+        self.url = url
+        self.mnodes_per_job = mnodes_per_job
+        self.drain_seconds = drain_seconds
+        self.min_mnps = min_mnps
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    # Number of analysis jobs queued or acquired, summed over the user and
+    # system queues, or None if the status can't be fetched.
+    def queue_depth(self):
+        try:
+            r = self.session.get(self.url, timeout = self.timeout)
+            r.raise_for_status()
+            analysis = r.json()["analysis"]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print("could not get the fishnet queue status: {}".format(e))
+            return None
+        return sum(queue.get("queued", 0) + queue.get("acquired", 0) for queue in analysis.values())
+
+    def required_mnps(self):
+        depth = self.queue_depth()
+        if depth is None:
+            return None
+        return max(self.min_mnps, depth * self.mnodes_per_job / self.drain_seconds)
+
+# The simulator's schedule (simulator.lichess_demand()) as a demand source:
+# the throughput of that many instances of a machine type doing mnps each.
+class ScheduleDemand:
+    def __init__(self, mnps_per_instance, clock = time.time):
+        self.mnps_per_instance = mnps_per_instance
+        self.clock = clock
+
+    def required_mnps(self):
+        return float(lichess_demand(int(self.clock()))) * self.mnps_per_instance
+
+# Replays a list of mnps figures (None meaning "unknown"), one per call, then
+# keeps returning the last one. For running the autoscaler offline.
+class FakeDemand:
+    def __init__(self, values):
+        self.values = list(values)
+        self.n_calls = 0
+
+    def required_mnps(self):
+        value = self.values[min(self.n_calls, len(self.values) - 1)]
+        self.n_calls += 1
+        return value
@@ -0,0 +1,212 @@
+import json
+import random
+import threading
+import time
+
+from compute import is_preempted, is_stockout, is_unsupported
+
+# What list_machine_types() reports for zones that can create anything.
+ANY_ZONE_TYPES = ["c2-standard-4", "e2-standard-2", "n1-standard-1", "n2-standard-2", "n2d-standard-2"]
+
+# In-memory stand-in for compute.GcloudCompute, for running the benchmark
+# and fleet code offline. zones maps a zone to the set of instance types it
+# can create (None for any); zones in stockouts never have capacity.
+# Running make_benchmark.py takes bench_seconds and gets preempted with
+# probability preempt_rate, somewhere uniformly within the run; otherwise
+# the VM ends up with a results.json built from results[instance_type] (or
+# a default).
+class FakeCompute:
+    def __init__(self, zones, bench_seconds = 0, preempt_rate = 0.0, results = None, seed = None, stockouts = None):
+        self.zones = zones
+        self.stockouts = set(stockouts or [])
+        self.bench_seconds = bench_seconds
+        self.preempt_rate = preempt_rate
+        self.results = results or {}
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.vms = {}
+        self.images = {}
+        self.calls = []
+        self.max_running = 0
+
+    def _log(self, *call):
+        with self.lock:
+            self.calls.append(call)
+
+    # The fake words its errors like gcloud.
+    def is_preempted(self, out):
+        return is_preempted(out)
+
+    def is_stockout(self, out):
+        return is_stockout(out)
+
+    def is_unsupported(self, out):
+        return is_unsupported(out)
+
+    def make_spot_instance(self, vm_name, instance_type, zone, image = None):
+        self._log("create", vm_name, instance_type, zone)
+        if zone not in self.zones or (self.zones[zone] is not None and instance_type not in self.zones[zone]):
+            return False, "ERROR: Machine type {} does not exist in zone {}.".format(instance_type, zone)
+        if zone in self.stockouts:
+            return False, "ERROR: The zone '{}' does not have enough resources available to fulfill the request. (ZONE_RESOURCE_POOL_EXHAUSTED)".format(zone)
+        with self.lock:
+            if vm_name in self.vms:
+                return False, "ERROR: The resource '{}' already exists".format(vm_name)
+            self.vms[vm_name] = {"instance-type": instance_type, "zone": zone, "files": {}, "preempted": False, "created_at": time.time()}
+            self.max_running = max(self.max_running, len(self.vms))
+        return True, "Created [{}].".format(vm_name)
+
+    def list_machine_types(self):
+        self._log("list_machine_types")
+        machine_types = []
+        for zone, instance_types in sorted(self.zones.items()):
+            for name in sorted(instance_types if instance_types is not None else ANY_ZONE_TYPES):
+                machine_types.append({"name": name, "zone": zone})
+        return machine_types
+
+    def create_image(self, image_name, image_family, vm_name, zone):
+        self._log("create_image", image_name, image_family, vm_name)
+        vm = self._vm(vm_name, zone)
+        if vm is None:
+            return False, "ERROR: The resource '{}' was not found".format(vm_name)
+        with self.lock:
+            self.images[image_name] = {"family": image_family, "files": dict(vm["files"])}
+        return True, "Created [{}].".format(image_name)
+
+    def delete_spot_instance(self, vm_name, zone):
+        self._log("delete", vm_name, zone)
+        with self.lock:
+            if vm_name not in self.vms:
+                return False, "ERROR: The resource '{}' was not found".format(vm_name)
+            del self.vms[vm_name]
+        return True, "Deleted [{}].".format(vm_name)
+
+    def list_instances(self, name_prefixes):
+        self._log("list_instances")
+        with self.lock:
+            return [{
+                "name": vm_name,
+                "instance-type": vm["instance-type"],
+                "zone": vm["zone"],
+                "status": "TERMINATED" if vm["preempted"] or vm.get("stopped") else "RUNNING",
+                "created_at": vm["created_at"],
+            } for vm_name, vm in sorted(self.vms.items()) if vm_name.startswith(tuple(name_prefixes))]
+
+    def delete_instances(self, vm_names, zone):
+        self._log("delete_instances", tuple(vm_names), zone)
+        with self.lock:
+            missing = [vm_name for vm_name in vm_names if self._vm(vm_name, zone) is None]
+            for vm_name in vm_names:
+                if vm_name not in missing:
+                    del self.vms[vm_name]
+        if missing:
+            return False, "ERROR: The resource '{}' was not found".format(missing[0])
+        return True, "Deleted {}.".format(", ".join("[{}]".format(vm_name) for vm_name in vm_names))
+
+    def stop_instances(self, vm_names, zone):
+        self._log("stop_instances", tuple(vm_names), zone)
+        with self.lock:
+            missing = [vm_name for vm_name in vm_names if self._vm(vm_name, zone) is None]
+            for vm_name in vm_names:
+                if vm_name not in missing:
+                    self.vms[vm_name]["stopped"] = True
+        if missing:
+            return False, "ERROR: The resource '{}' was not found".format(missing[0])
+        return True, "Updated {}.".format(", ".join("[{}]".format(vm_name) for vm_name in vm_names))
+
+    def _vm(self, vm_name, zone):
+        vm = self.vms.get(vm_name)
+        if vm is None or vm["zone"] != zone:
+            return None
+        return vm
+
+    def put_file(self, vm_name, zone, local_fname, remote_fname):
+        self._log("put", vm_name, remote_fname)
+        vm = self._vm(vm_name, zone)
+        if vm is None or vm["preempted"]:
+            return False, "ERROR: Instance [{}] in zone [{}] does not have an External IP address".format(vm_name, zone)
+        vm["files"][remote_fname] = open(local_fname, "rb").read()
+        return True, ""
+
+    def get_file(self, vm_name, zone, remote_fname, local_fname):
+        self._log("get", vm_name, remote_fname)
+        vm = self._vm(vm_name, zone)
+        if vm is None or vm["preempted"]:
+            return False, "ERROR: Instance [{}] in zone [{}] does not have an External IP address".format(vm_name, zone)
+        if remote_fname not in vm["files"]:
+            return False, "ERROR: scp: {}: No such file or directory".format(remote_fname)
+        open(local_fname, "wb").write(vm["files"][remote_fname])
+        return True, ""
+
+    def exec_ssh(self, vm_name, zone, command):
+        self._log("ssh", vm_name, command)
+        vm = self._vm(vm_name, zone)
+        if vm is None or vm["preempted"]:
+            return False, "", "ERROR: Instance [{}] in zone [{}] does not have an External IP address".format(vm_name, zone)
+
+        if "make_benchmark.py prepare" in command:
+            vm["files"]["/home/ubuntu/.local/fishnet"] = b""
+            return True, "", ""
+
+        if "make_benchmark.py" in command:
+            time.sleep(self.bench_seconds)
+            with self.lock:
+                preempted = self.random.random() < self.preempt_rate
+            if preempted:
+                vm["preempted"] = True
+                progress = self._progress(vm, self.random.random())
+                return False, progress, "Connection to {} closed by remote host.\nERROR: ssh: connection unexpectedly closed".format(vm_name)
+
+            result = self.results.get(vm["instance-type"], [{"n_cores": 8, "n_thread_per_process": 8, "bench_length": 1000, "n_nodes": "7000 million"}])
+            vm["files"]["/home/ubuntu/results.json"] = json.dumps(result).encode("utf8")
+            return True, self._progress(vm, 1.0), ""
+
+        return True, "", ""
+
+    # The PROGRESS lines make_benchmark.py prints when it gets through the
+    # given fraction of its 1000 seconds run, at 7 million nodes per second.
+    def _progress(self, vm, fraction):
+        lines = ["SETUP " + json.dumps({"setup_seconds": 0.0})]
+        for elapsed in range(30, int(1000 * fraction) + 1, 30):
+            lines.append("PROGRESS " + json.dumps({"n_cores": 8, "n_thread_per_process": 8, "elapsed": elapsed, "n_nodes": "{} million".format(7 * elapsed)}))
+        return "\n".join(lines)
+
+    def open_session(self, vm_name, zone):
+        self._log("session", vm_name)
+        return FakeSession(self, vm_name, zone)
+
+    # Preempts a running VM, as Compute Engine would.
+    def preempt(self, vm_name):
+        with self.lock:
+            self.vms[vm_name]["preempted"] = True
+
+# What FakeCompute.open_session() returns: the same interface as
+# ssh_session.SshSession, on top of the fake's own methods.
+class FakeSession:
+    def __init__(self, compute, vm_name, zone):
+        self.compute = compute
+        self.vm_name = vm_name
+        self.zone = zone
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def put_file(self, local_fname, remote_fname):
+        return self.compute.put_file(self.vm_name, self.zone, local_fname, remote_fname)
+
+    def get_file(self, remote_fname, local_fname):
+        return self.compute.get_file(self.vm_name, self.zone, remote_fname, local_fname)
+
+    def exec_ssh(self, command, on_line = None):
+        success, stdout, stderr = self.compute.exec_ssh(self.vm_name, self.zone, command)
+        if on_line is not None:
+            for line in stdout.splitlines():
+                on_line(line)
+        return success, stdout, stderr
+
+    def close(self):
+        pass
@@ -1,31 +1,57 @@
+import argparse
 import subprocess
 import json
 import datetime
 import getpass
+import glob
+import os
+import shutil
+import sys
+import threading
+import time
 
-for i in range(5):
-    try:
-        print("Updating packages...")
-        p = subprocess.run(["sudo", "apt", "update", "-y"], capture_output = True)
-        out, err = p.stdout, p.stderr
-        print("Installing pip...")
-        p = subprocess.run(["sudo", "apt", "install", "-y", "python3-pip"], capture_output = True)
-        out, err = p.stdout, p.stderr
-        print("Updating fishnet...")
-        p = subprocess.run(["pip3", "install", "--user", "fishnet"], capture_output = True)
-        out, err = p.stdout, p.stderr
-        break
-    except:
-        print("FAILED installation! Trying again.")
-        print("out:", out)
-        print("err:", err)
+BENCH_LENGTH = 1000
+# Every PROGRESS_INTERVAL seconds, the node count so far is printed as a
+# "PROGRESS {...}" line, so that whoever runs us over ssh still gets partial
+# results if the VM is preempted before the end.
+PROGRESS_INTERVAL = 30
 
-results = []
+def report_progress(n_cores, n_thread_per_process, elapsed, n_nodes):
+    print("PROGRESS " + json.dumps({
+        "n_cores": n_cores,
+        "n_thread_per_process": n_thread_per_process,
+        "elapsed": round(elapsed, 1),
+        "n_nodes": n_nodes,
+    }), flush = True)
 
-fishnet_key = "XXXXXXXXX"
+WHEELHOUSE = "/home/ubuntu/wheelhouse"
 
-n_cores = int(subprocess.run(["nproc"], capture_output = True).stdout.decode("utf8").strip())
-for n_thread_per_process in [n_cores]:
+def fishnet_installed():
+    return subprocess.run(["python3", "-c", "import fishnet"], capture_output = True).returncode == 0
+
+# Installs fishnet, from the uploaded wheelhouse if there is one, from PyPI
+# otherwise. Not needed on VMs booted from an image made with `prepare`.
+def install_fishnet():
+    pip_args = ["--no-index", "--find-links", WHEELHOUSE] if os.path.isdir(WHEELHOUSE) else []
+    for i in range(5):
+        try:
+            if subprocess.run(["which", "pip3"], capture_output = True).returncode != 0:
+                print("Updating packages...")
+                p = subprocess.run(["sudo", "apt", "update", "-y"], capture_output = True)
+                out, err = p.stdout, p.stderr
+                print("Installing pip...")
+                p = subprocess.run(["sudo", "apt", "install", "-y", "python3-pip"], capture_output = True)
+                out, err = p.stdout, p.stderr
+            print("Updating fishnet...")
+            p = subprocess.run(["pip3", "install", "--user"] + pip_args + ["fishnet"], capture_output = True)
+            out, err = p.stdout, p.stderr
+            break
+        except:
+            print("FAILED installation! Trying again.")
+            print("out:", out)
+            print("err:", err)
+
+def write_config(n_cores, n_thread_per_process):
     open("fishnet.ini", "w").write("""
 [Fishnet]
 enginedir = /home/ubuntu
@@ -39,18 +65,174 @@ key = {key}
 [Stockfish]
     """.strip().format(n_cores = n_cores, n_thread_per_process = n_thread_per_process, key = fishnet_key))
 
-    print("Starting benchmark for {} threads per instance at {}. Should take 17 minutes.".format(n_thread_per_process, datetime.datetime.now().strftime("%H:%M:%S")))
-    stdout = subprocess.run(["timeout", "1000", "python3", "-m", "fishnet"], capture_output = True).stdout.decode("utf8")
-    if "ConfigError" in stdout:
-        break
+results = []
+
+fishnet_key = "XXXXXXXXX"
+
+n_cores = int(subprocess.run(["nproc"], capture_output = True).stdout.decode("utf8").strip())
+
+def int_list(x):
+    return [int(v) for v in x.split(",")]
+
+# `bench` (the default) runs fishnet once with every core in one process.
+# `sweep` tries every combination of --cores and --threads instead, so that
+# we learn which process/thread layout gets the most out of a machine type.
+# `prepare` only installs fishnet and lets it download Stockfish, on a VM
+# that is then turned into a benchmark image.
+parser = argparse.ArgumentParser()
+parser.add_argument("mode", nargs = "?", default = "bench", choices = ["bench", "sweep", "prepare"])
+parser.add_argument("--cores", type = int_list, default = [n_cores], help = "comma-separated core counts (sweep)")
+parser.add_argument("--threads", type = int_list, default = None, help = "comma-separated threads per process (sweep, default: 1,2,4,... up to the cores)")
+parser.add_argument("--length", type = int, default = BENCH_LENGTH, help = "seconds per configuration")
+parser.add_argument("--warmup", type = int, default = 60, help = "seconds of samples left out of the statistics")
+parser.add_argument("--engine", default = "fishnet", choices = ["fishnet", "stockfish"], help = "stockfish runs Stockfish's own bench instead of analysing lichess traffic, and needs no fishnet key")
+parser.add_argument("--stockfish", default = None, help = "Stockfish binary (default: the one fishnet downloaded, or the stockfish package)")
+parser.add_argument("--movetime", type = int, default = 200, help = "milliseconds per bench position (stockfish)")
+args = parser.parse_args()
+
+# The Stockfish binary fishnet downloaded into its enginedir, or the one of
+# the distribution's stockfish package (installed if needed).
+def find_stockfish():
+    candidates = sorted(glob.glob("/home/ubuntu/stockfish*"))
+    if candidates:
+        return candidates[-1]
+    if shutil.which("stockfish") is None and not os.path.isfile("/usr/games/stockfish"):
+        print("Installing stockfish...")
+        subprocess.run(["sudo", "apt", "update", "-y"], capture_output = True)
+        subprocess.run(["sudo", "apt", "install", "-y", "stockfish"], capture_output = True)
+    return shutil.which("stockfish") or "/usr/games/stockfish"
 
+setup_start = time.time()
+if args.engine == "stockfish":
+    stockfish = args.stockfish or find_stockfish()
+elif not fishnet_installed():
+    install_fishnet()
+setup_seconds = round(time.time() - setup_start, 1)
+print("SETUP " + json.dumps({"setup_seconds": setup_seconds}), flush = True)
+
+if args.mode == "prepare":
+    write_config(n_cores, n_cores)
+    subprocess.run(["timeout", "120", "python3", "-m", "fishnet"], capture_output = True)
+    sys.exit(0)
+
+# "7065 million" -> 7065000000
+def parse_nodes(n_nodes):
+    units = {"thousand": 10 ** 3, "million": 10 ** 6, "billion": 10 ** 9}
+    parts = n_nodes.split()
+    return int(float(parts[0]) * units.get(parts[1], 1)) if len(parts) > 1 else int(parts[0])
+
+# Nodes per second (in millions) between consecutive samples, leaving out
+# the ones taken during the first warmup seconds. Returns the per-interval
+# rates, their mean and their standard deviation.
+def sample_stats(samples, warmup):
+    rates = []
+    for prev, cur in zip(samples, samples[1:]):
+        if prev["elapsed"] < warmup or cur["elapsed"] <= prev["elapsed"]:
+            continue
+        rates.append((cur["n_nodes"] - prev["n_nodes"]) / (cur["elapsed"] - prev["elapsed"]) / 10 ** 6)
+    if not rates:
+        return rates, None, None
+    mean = sum(rates) / len(rates)
+    stddev = (sum((x - mean) ** 2 for x in rates) / len(rates)) ** 0.5
+    return rates, round(mean, 4), round(stddev, 4)
+
+def run_fishnet(cores, n_thread_per_process, length):
+    write_config(cores, n_thread_per_process)
+
+    print("Starting benchmark for {} cores and {} threads per instance at {}. Should take {} minutes.".format(cores, n_thread_per_process, datetime.datetime.now().strftime("%H:%M:%S"), round(length / 60)))
+    p = subprocess.Popen(["timeout", str(length), "python3", "-m", "fishnet"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, env = dict(os.environ, PYTHONUNBUFFERED = "1"), encoding = "utf8")
+    start = time.time()
+    last_report = start
+    lines = []
+    samples = []
+    n_nodes = None
+    for line in p.stdout:
+        lines.append(line)
+        if "crunched " in line:
+            n_nodes = line.split("crunched ")[-1].split(" nodes")[0]
+        if n_nodes is not None and time.time() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.time()
+            report_progress(cores, n_thread_per_process, last_report - start, n_nodes)
+            samples.append({"elapsed": round(last_report - start, 1), "n_nodes": parse_nodes(n_nodes)})
+    p.wait()
+    return "".join(lines), samples
+
+# Runs Stockfish's built-in bench over and over for length seconds, in as
+# many processes (of n_thread_per_process threads each) as fishnet would use
+# for that many cores. Returns the node count as fishnet would print it and
+# the node count samples; only completed bench rounds are counted.
+def run_stockfish(cores, n_thread_per_process, length):
+    print("Starting Stockfish bench for {} cores and {} threads per process at {}. Should take {} minutes.".format(cores, n_thread_per_process, datetime.datetime.now().strftime("%H:%M:%S"), round(length / 60)))
+    start = time.time()
+    lock = threading.Lock()
+    total = [0]
+
+    def bench_loop():
+        deadline = start + length
+        while time.time() < deadline:
+            round_start = time.time()
+            p = subprocess.run([stockfish, "bench", "16", str(n_thread_per_process), str(args.movetime), "default", "movetime"], capture_output = True, encoding = "utf8")
+            round_end = time.time()
+            out = p.stdout + p.stderr
+            if "Nodes searched" not in out:
+                print("Stockfish bench FAILED!", out, flush = True)
+                return
+            n_nodes = int(out.split("Nodes searched")[-1].split(":")[1].split()[0])
+            # The last round can run past the deadline: only count its share.
+            if round_end > deadline:
+                n_nodes = int(n_nodes * (deadline - round_start) / (round_end - round_start))
+            with lock:
+                total[0] += n_nodes
+
+    workers = [threading.Thread(target = bench_loop) for x in range(max(1, cores // n_thread_per_process))]
+    for worker in workers:
+        worker.start()
+
+    samples = []
+    while any(worker.is_alive() for worker in workers):
+        time.sleep(min(PROGRESS_INTERVAL, max(0.1, length - (time.time() - start))))
+        elapsed = time.time() - start
+        with lock:
+            n_nodes = total[0]
+        n_nodes_str = "{} million".format(n_nodes // 10 ** 6)
+        report_progress(cores, n_thread_per_process, elapsed, n_nodes_str)
+        # A last sample taken right after the previous one would only add noise.
+        if not samples or elapsed - samples[-1]["elapsed"] >= PROGRESS_INTERVAL / 2:
+            samples.append({"elapsed": round(elapsed, 1), "n_nodes": n_nodes})
+
+    return "{} million".format(total[0] // 10 ** 6), samples
+
+if args.mode == "sweep":
+    threads = args.threads or [2 ** i for i in range(8) if 2 ** i <= max(args.cores)]
+    configs = [(c, t) for c in args.cores if c <= n_cores for t in threads if t <= c]
+else:
+    configs = [(n_cores, n_cores)]
+
+for cores, n_thread_per_process in configs:
+    if args.engine == "stockfish":
+        n_nodes, samples = run_stockfish(cores, n_thread_per_process, args.length)
+    else:
+        stdout, samples = run_fishnet(cores, n_thread_per_process, args.length)
+        if "ConfigError" in stdout:
+            break
+        n_nodes = stdout.split("crunched ")[-1].split(" nodes")[0]
+
+    rates, mnps_mean, mnps_stddev = sample_stats(samples, args.warmup)
     result = {
-        "n_cores": n_cores,
+        "n_cores": cores,
         "n_thread_per_process": n_thread_per_process,
-        "bench_length": 1000,
-        "n_nodes": stdout.split("crunched ")[-1].split(" nodes")[0]
+        "bench_length": args.length,
+        "setup_seconds": setup_seconds,
+        "n_nodes": n_nodes,
+        "engine": args.engine,
+        "warmup": args.warmup,
+        "samples": samples,
+        "mnps_mean": mnps_mean,
+        "mnps_stddev": mnps_stddev,
     }
-    print(result)
+    print(result, flush = True)
     results.append(result)
 
-open("results.json", "w").write(json.dumps(results))
\ No newline at end of file
+# Best configuration first: that's the one consumers read.
+results.sort(key = lambda x: -(x["mnps_mean"] or 0))
+open("results.json", "w").write(json.dumps(results))
@@ -0,0 +1,170 @@
+import math
+
+import numpy as np
+
+from preemption_log import effective_cost_per_mnps
+from zone_index import family_of
+
+# Turns get_defined_machine_types(return_all = True) output and a dict
+# instance type -> mnps into solver options, dropping unbenchmarked and
+# unpriced machine types. Options keep the provider of their machine type
+# ("gcp" unless tagged otherwise, see providers.py). With hazard rates (see
+# preemption_log.PreemptionLog.hazard_rates()), price is the risk-adjusted
+# hourly price, the one we pay per hour of useful work, and list_price the
+# one we are billed.
+def make_options(machine_types, benchmarks, hazard_rates = None):
+    options = []
+    for x in machine_types:
+        mnps = benchmarks.get(x["instance-type"], 0)
+        if x["price"] <= 0.000001 or mnps <= 0:
+            continue
+        rate = (hazard_rates or {}).get((x["region"], family_of(x["instance-type"])), {}).get("rate", 0.0)
+        options.append({
+            "provider": x.get("provider", "gcp"),
+            "instance-type": x["instance-type"],
+            "region": x["region"],
+            "price": effective_cost_per_mnps(x["price"], mnps, rate) * mnps,
+            "list_price": x["price"],
+            "mnps": mnps,
+        })
+    return options
+
+def _fleet_cost(fleet, options):
+    return sum(options[idx]["price"] * count for idx, count in fleet.items())
+
+# The mnps, price and region (as an index into the sorted regions of caps)
+# of every option as numpy arrays, and caps as an array of instances left
+# per region (inf for unlimited), so that _complete() prices every option at
+# once.
+def _as_arrays(options, caps):
+    regions = {region: i for i, region in enumerate(sorted(caps))}
+    arrays = {
+        "mnps": np.array([x["mnps"] for x in options], dtype = float),
+        "price": np.array([x["price"] for x in options], dtype = float),
+        "region": np.array([regions[x["region"]] for x in options], dtype = int),
+    }
+    caps_left = np.array([math.inf if caps[region] is None else caps[region] for region in sorted(caps)], dtype = float)
+    return arrays, caps_left
+
+def _capacity(caps_left, arrays, idx):
+    return caps_left[arrays["region"][idx]]
+
+# The cheapest way to add at least remaining mnps with instances of a single
+# machine type, as (option index, count, cost), or None if the caps are hit.
+def _complete(arrays, remaining, caps_left):
+    if not len(arrays["mnps"]):
+        return None
+    counts = np.ceil(remaining / arrays["mnps"])
+    costs = np.where(counts <= caps_left[arrays["region"]], counts * arrays["price"], np.inf)
+    idx = int(np.argmin(costs))
+    if costs[idx] == np.inf:
+        return None
+    return idx, int(counts[idx]), float(costs[idx])
+
+def _take(fleet, caps_left, arrays, idx, count):
+    fleet[idx] = fleet.get(idx, 0) + count
+    if fleet[idx] == 0:
+        del fleet[idx]
+    caps_left[arrays["region"][idx]] -= count
+
+# Greedy covering of target_mnps taking options in the given order, as many
+# whole instances as fit under the target and the region caps. At every
+# step the partial fleet is also completed with _complete(). Returns the
+# cheapest fleet seen, as a dict option index -> count, and its cost.
+def _greedy(options, arrays, order, target_mnps, caps):
+    caps_left = caps.copy()
+    fleet = {}
+    remaining = target_mnps
+    best_fleet, best_cost = None, math.inf
+
+    for idx in order + [None]:
+        if remaining <= 0:
+            cost = _fleet_cost(fleet, options)
+            if cost < best_cost:
+                best_fleet, best_cost = dict(fleet), cost
+            break
+
+        completion = _complete(arrays, remaining, caps_left)
+        if completion is not None:
+            cost = _fleet_cost(fleet, options) + completion[2]
+            if cost < best_cost:
+                best_fleet, best_cost = dict(fleet), cost
+                best_fleet[completion[0]] = best_fleet.get(completion[0], 0) + completion[1]
+
+        if idx is None:
+            break
+        count = int(min(math.floor(remaining / options[idx]["mnps"]), _capacity(caps_left, arrays, idx)))
+        if count > 0:
+            _take(fleet, caps_left, arrays, idx, count)
+            remaining -= count * options[idx]["mnps"]
+
+    return best_fleet, best_cost
+
+# Local search on a fleet: drops one instance of a machine type and covers
+# the missing mnps again with _complete() (if the fleet still reaches the
+# target without it, it is just dropped), for as long as that saves money.
+def _improve(options, arrays, fleet, target_mnps, caps):
+    improved = True
+    while improved:
+        improved = False
+        caps_left = caps.copy()
+        for idx, count in fleet.items():
+            _take({}, caps_left, arrays, idx, count)
+        cost = _fleet_cost(fleet, options)
+        mnps = sum(options[idx]["mnps"] * count for idx, count in fleet.items())
+
+        for idx in list(fleet):
+            _take(fleet, caps_left, arrays, idx, -1)
+            missing = target_mnps - (mnps - options[idx]["mnps"])
+            if missing <= 0:
+                improved = True
+                break
+            completion = _complete(arrays, missing, caps_left)
+            if completion is not None and cost - options[idx]["price"] + completion[2] < cost - 1e-9:
+                _take(fleet, caps_left, arrays, completion[0], completion[1])
+                improved = True
+                break
+            _take(fleet, caps_left, arrays, idx, 1)
+    return fleet
+
+# Finds a cheap fleet with at least target_mnps of throughput. region_caps
+# maps a region to the most instances we may run there (default_cap for the
+# other regions, None meaning unlimited).
+#
+# It is a covering knapsack, solved greedily twice: once taking machine types
+# by cost per mnps, which is within a factor 2 of the optimum without caps,
+# and once by mnps per instance, which always finds a fleet when the caps
+# allow one. The cheaper fleet is then improved by swapping instances while
+# that saves money. The returned dict also has lower_bound,
+# the cost of the fractional fleet ignoring caps, to judge how far from the
+# optimum we can be. Returns None if the caps don't allow target_mnps.
+def solve(options, target_mnps, region_caps = None, default_cap = None):
+    if target_mnps <= 0:
+        return {"instances": [], "price": 0.0, "mnps": 0.0, "lower_bound": 0.0}
+
+    region_caps = region_caps or {}
+    caps = {option["region"]: region_caps.get(option["region"], default_cap) for option in options}
+    arrays, caps = _as_arrays(options, caps)
+
+    by_efficiency = sorted(range(len(options)), key = lambda idx: options[idx]["price"] / options[idx]["mnps"])
+    by_density = sorted(range(len(options)), key = lambda idx: (-options[idx]["mnps"], options[idx]["price"]))
+    lower_bound = target_mnps * options[by_efficiency[0]]["price"] / options[by_efficiency[0]]["mnps"] if options else math.inf
+
+    best_fleet, best_cost = None, math.inf
+    for order in (by_efficiency, by_density):
+        fleet, cost = _greedy(options, arrays, order, target_mnps, caps)
+        if cost < best_cost:
+            best_fleet, best_cost = fleet, cost
+
+    if best_fleet is None:
+        return None
+    best_fleet = _improve(options, arrays, best_fleet, target_mnps, caps)
+    best_cost = _fleet_cost(best_fleet, options)
+
+    instances = sorted([dict(options[idx], count = count) for idx, count in best_fleet.items()], key = lambda x: x["price"] / x["mnps"])
+    return {
+        "instances": instances,
+        "price": best_cost,
+        "mnps": sum(x["mnps"] * x["count"] for x in instances),
+        "lower_bound": lower_bound,
+    }
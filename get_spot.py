@@ -1,102 +1,88 @@
-from glob import glob
-import subprocess
-import sys
+import argparse
+import datetime
+import itertools
+import json
 import os
-import shutil
+import os.path
+import sys
 import time
-import random
-import string
-import requests
-import json
 from pprint import pprint
-import itertools
-import datetime
-import os.path
-from filelock import Timeout, FileLock
-from matplotlib import pyplot as plt
-
-REGION_BLACKLIST = set()
-print("Blacklisted regions (too many preemptions): {}".format(REGION_BLACKLIST))
-
-API_KEY = os.environ.get("GCLOUD_API_KEY")
-if not API_KEY:
-    print("Please set the GCLOUD_API_KEY environment variable.")
-    sys.exit()
-
-GCLOUD_CMD = shutil.which("gcloud")
-
-# Creates a spot instance with the given name, instance type and region
-def make_spot_instance(vm_name, instance_type, region):
-    p = subprocess.run([
-        GCLOUD_CMD, "compute", "instances", "create",
-        "--machine-type", instance_type,
-        "--zone", region,
-        vm_name, "--image-project", "ubuntu-os-cloud", "--image-family", "ubuntu-2004-lts",
-        "--subnet", "defaulteuwb1", "--preemptible"
-    ], capture_output = True, encoding = "utf8")
-    stdout, stderr = p.stdout, p.stderr
-    out = stdout + stderr
-    if "Created" in out:
-        return True, out
-
-    return False, out
-
-# scp a file into a vm
-def put_file(vm_name, region, local_fname, remote_fname):
-    p = subprocess.run([
-        GCLOUD_CMD, "compute", "scp", "--force-key-file-overwrite",
-        local_fname, "ubuntu@" + vm_name + ":" + remote_fname, "--zone", region,
-    ], capture_output = True, encoding = "utf8")
-    stdout, stderr = p.stdout, p.stderr
-    out = stdout + stderr
-    if "ERROR" in out:
-        return False, out
-    
-    return True, out
-
-# scp a file from a vm
-def get_file(vm_name, region, remote_fname, local_fname):
-    p = subprocess.run([
-        GCLOUD_CMD, "compute", "scp", "--force-key-file-overwrite",
-        "ubuntu@" + vm_name + ":" + remote_fname, local_fname, "--zone", region,
-    ], capture_output = True, encoding = "utf8")
-    stdout, stderr = p.stdout, p.stderr
-    out = stdout + stderr
-    if "ERROR" in out:
-        return False, out
-    
-    return True, out
-
-
-# deletes a vm
-def delete_spot_instance(vm_name):
-    p = subprocess.run([
-        GCLOUD_CMD, "-q", "compute", "instances", "delete",
-        vm_name, "--zone", region
-    ], capture_output = True, encoding = "utf8")
-
-    stdout, stderr = p.stdout, p.stderr
-    out = stdout + stderr
-
-    if "Delete" in out:
-        return True, out
-
-    return False, out
-
-# executes a command in a vm through ssh
-def exec_ssh(vm_name, region, command):
-    p = subprocess.run([
-        GCLOUD_CMD, "compute", "ssh", "--force-key-file-overwrite",
-        "ubuntu@" + vm_name, "--command", command, "--zone", region
-    ], capture_output = True, encoding = "utf8")
-
-    stdout, stderr = p.stdout, p.stderr
-    out = stdout + stderr
-
-    if "ERROR" in out:
-        return False, stdout, stderr
-
-    return True, stdout, stderr
+
+# Only the standard library is imported up front, and nothing runs at import
+# time: every command imports what it needs (numpy, the billing client,
+# gcloud wrappers...) when it runs, so that `-h` and the offline commands
+# start fast and the functions below can be imported as a library.
+
+_compute = None
+_sku_client = None
+_preemption_log = None
+_region_blacklist = None
+_providers = {}
+
+# Set BENCH_IMAGE_FAMILY (e.g. to bench_image.BENCH_IMAGE_FAMILY, after
+# running build-image) to boot benchmark VMs from a prepared image of our
+# project instead of the stock Ubuntu one.
+def get_compute():
+    global _compute
+    if _compute is None:
+        from compute import GcloudCompute
+        if os.environ.get("BENCH_IMAGE_FAMILY"):
+            _compute = GcloudCompute(image_project = None, image_family = os.environ["BENCH_IMAGE_FAMILY"])
+        else:
+            _compute = GcloudCompute()
+    return _compute
+
+def get_sku_client():
+    global _sku_client
+    if _sku_client is None:
+        api_key = os.environ.get("GCLOUD_API_KEY")
+        if not api_key:
+            raise RuntimeError("Please set the GCLOUD_API_KEY environment variable.")
+        from billing import SkuClient
+        _sku_client = SkuClient(api_key, ttl = int(os.environ.get("SKU_CACHE_TTL", 3600)))
+    return _sku_client
+
+def get_preemption_log():
+    global _preemption_log
+    if _preemption_log is None:
+        from preemption_log import PreemptionLog
+        _preemption_log = PreemptionLog()
+    return _preemption_log
+
+# The providers.Provider of a cloud: "gcp", priced with the billing API, or
+# "aws", priced with the EC2 spot price history (the aws CLI must be set up,
+# and workers need an AWS_KEY_NAME key pair, whose private key is
+# AWS_KEY_FILE, and an AWS_SECURITY_GROUP letting ssh in).
+def get_provider(name):
+    if name not in _providers:
+        from inventory import FleetInventory
+        from providers import Provider
+        from zone_index import ZONE_INDEX_FILE, ZoneIndex
+        if name == "gcp":
+            compute = get_compute()
+            catalog = lambda: get_defined_machine_types(return_all = True)
+            zone_index_path = ZONE_INDEX_FILE
+        elif name == "aws":
+            import aws
+            compute = aws.AwsCompute(key_name = os.environ.get("AWS_KEY_NAME"), key_file = os.environ.get("AWS_KEY_FILE"), security_group = os.environ.get("AWS_SECURITY_GROUP"))
+            catalog = aws.AwsSpotPrices().machine_types
+            zone_index_path = aws.AWS_ZONE_INDEX_FILE
+        else:
+            raise RuntimeError("Unknown provider `{}` (not gcp or aws).".format(name))
+        _providers[name] = Provider(name, catalog, compute, ZoneIndex(compute, path = zone_index_path), FleetInventory(compute))
+    return _providers[name]
+
+def get_providers(names):
+    return [get_provider(name) for name in names.split(",")]
+
+# Regions we got preempted too often in lately, from the launches and
+# preemptions the benchmarks and the autoscaler recorded.
+def region_blacklist():
+    global _region_blacklist
+    if _region_blacklist is None:
+        _region_blacklist = get_preemption_log().blacklist()
+        print("Blacklisted regions (too many preemptions): {}".format(_region_blacklist))
+    return _region_blacklist
 
 # gets the price for a sku. if there isn't one, 9999 is returned
 def get_sku_price(sku):
@@ -113,25 +99,13 @@ def get_sku_price(sku):
         print("Exception with", sku, str(e))
         sys.exit(1)
 
-# gets the data we're interested in from all the skus
-def get_skus():
-    services = requests.get("https://cloudbilling.googleapis.com/v1/services?key={}".format(API_KEY)).json()["services"]
-    serviceId = [x for x in services if x["displayName"] == "Compute Engine"][0]["serviceId"]
-
+# gets the data we're interested in from all the preemptible compute skus.
+# fresh skips the SKU cache.
+def get_skus(fresh = False):
     skus_data = {}
-    skus = []
-    
-    r_skus = requests.get("https://cloudbilling.googleapis.com/v1/services/{}/skus?key={}".format(serviceId, API_KEY)).json()
-    skus += r_skus["skus"]
-    while "nextPageToken" in r_skus and r_skus["nextPageToken"].strip():
-        r_skus = requests.get("https://cloudbilling.googleapis.com/v1/services/{}/skus?pageToken={}&key={}".format(serviceId, r_skus["nextPageToken"], API_KEY)).json()
-        skus += r_skus["skus"]
-
-    for sku in sorted(skus, key = lambda sku: get_sku_price(sku)):
-        # Only preemptible compute instances
-        if not (sku["category"]["usageType"] == "Preemptible" and sku["category"]["resourceFamily"] == "Compute"):
-            continue
+    blacklist = region_blacklist()
 
+    for sku in sorted(get_sku_client().preemptible_compute_skus(force = fresh), key = lambda sku: get_sku_price(sku)):
         # Also can't do anything with GPU
         if "GPU" in sku["description"]:
             continue
@@ -155,9 +129,9 @@ def get_skus():
         price = get_sku_price(sku)
 
         for region in sku["geoTaxonomy"]["regions"]:
-            if region in REGION_BLACKLIST:
+            if region in blacklist:
                 continue
-        
+
             if not region in skus_data:
                 skus_data[region] = {}
 
@@ -169,337 +143,351 @@ def get_skus():
 
 # Returns the machine type we can benchmark and spin up.
 # This includes specs, such as number of vCPUs and amount of ram
-def get_defined_machine_types(return_all = False):
-    skus = get_skus()
-    machine_types = []
-
-    for region_name, region in skus.items():
-        ram_name  = "Preemptible Custom Instance Ram"
-        core_name = "Preemptible Custom Instance Core"
-        if ram_name not in skus[region_name].keys():
-            continue
-
-        if core_name not in skus[region_name].keys():
-            continue
-
-        for n_vcpu in [8, 16]:
-            for n_quarter_ram_units in [4 * n_vcpu]:
-                machine_types.append({
-                    "instance-type": "n1-custom-{}-{}".format(n_vcpu, n_quarter_ram_units * 256),
-                    "price": skus[region_name][core_name]["price"] * n_vcpu + skus[region_name][ram_name]["price"] * n_quarter_ram_units / 4,
-                    "region": region_name
-                })
-
-    for region_name, region in skus.items():
-        ram_name  = "Preemptible N2 Custom Instance Ram"
-        core_name = "Preemptible N2 Custom Instance Core"
-        if ram_name not in skus[region_name].keys():
-            continue
-
-        if core_name not in skus[region_name].keys():
-            continue
-
-        for n_vcpu in [8, 16]:
-            for n_quarter_ram_units in [2 * n_vcpu]:
-                machine_types.append({
-                    "instance-type": "n2-custom-{}-{}".format(n_vcpu, n_quarter_ram_units * 256),
-                    "price": skus[region_name][core_name]["price"] * n_vcpu + skus[region_name][ram_name]["price"] * n_quarter_ram_units / 4,
-                    "region": region_name
-                })
-
-    for region_name, region in skus.items():
-        ram_name  = "Preemptible E2 Instance Ram"
-        core_name = "Preemptible E2 Instance Core"
-        if ram_name not in skus[region_name].keys():
-            continue
-
-        if core_name not in skus[region_name].keys():
-            continue
-
-        for n_vcpu in [8, 16]:
-            for n_quarter_ram_units in [2 * n_vcpu]:
-                machine_types.append({
-                    "instance-type": "e2-custom-{}-{}".format(n_vcpu, n_quarter_ram_units * 256),
-                    "price": skus[region_name][core_name]["price"] * n_vcpu + skus[region_name][ram_name]["price"] * n_quarter_ram_units / 4,
-                    "region": region_name
-                })
-
-    for region_name, region in skus.items():
-        ram_name  = "Preemptible N2D AMD Custom Instance Ram"
-        core_name = "Preemptible N2D AMD Custom Instance Core"
-        if ram_name not in skus[region_name].keys():
-            continue
-
-        if core_name not in skus[region_name].keys():
-            continue
-
-        for n_vcpu in [8, 16]:
-            for n_quarter_ram_units in [2 * n_vcpu]:
-                machine_types.append({
-                    "instance-type": "n2d-custom-{}-{}".format(n_vcpu, n_quarter_ram_units * 256),
-                    "price": skus[region_name][core_name]["price"] * n_vcpu + skus[region_name][ram_name]["price"] * n_quarter_ram_units / 4,
-                    "region": region_name
-                })
-
-    for region_name, region in skus.items():
-        ram_name  = "Preemptible Compute optimized Ram"
-        core_name = "Preemptible Compute optimized Core"
-        if ram_name not in skus[region_name].keys():
-            continue
-
-        if core_name not in skus[region_name].keys():
-            continue
-
-        idx = 0
-        for n_vcpu in [8, 16]:
-            for n_quarter_ram_units in [16 * n_vcpu]:
-                machine_types.append({
-                    "instance-type": ["c2-standard-8", "c2-standard-16"][idx],
-                    "price": skus[region_name][core_name]["price"] * n_vcpu + skus[region_name][ram_name]["price"] * n_quarter_ram_units / 4,
-                    "region": region_name
-                })
-                idx += 1
-
-    for region_name, region in skus.items():
-        ram_name  = "Preemptible N1 Predefined Instance Core"
-        core_name = "Preemptible N1 Predefined Instance Ram"
-        if ram_name not in skus[region_name].keys():
-            continue
-
-        if core_name not in skus[region_name].keys():
-            continue
-
-        idx = 0
-        for n_vcpu in [4, 8, 16]:
-            for n_quarter_ram_units in [4 * n_vcpu]:
-                machine_types.append({
-                    "instance-type": ["n1-standard-4", "n1-standard-8", "n1-standard-16"][idx],
-                    "price": skus[region_name][core_name]["price"] * n_vcpu + skus[region_name][ram_name]["price"] * n_quarter_ram_units / 4,
-                    "region": region_name
-                })
-                idx += 1
-
+def get_defined_machine_types(return_all = False, fresh = False):
+    import machine_families
+    skus = get_skus(fresh)
+    regions, prices = machine_families.price_matrix(skus, machine_families.DEFINED_SHAPES)
+    machine_types = machine_families.machine_types(regions, machine_families.DEFINED_SHAPES, prices)
 
     if not return_all:
-        machine_types_grouped = itertools.groupby(sorted(machine_types, key = lambda t: t["instance-type"]), key = lambda t: t["instance-type"])
-        return [min(list(x), key = lambda t: t["price"] if t["price"] > 0.000001 else 999999) for n, x in machine_types_grouped]
+        return cheapest_regions(machine_types)
 
     return machine_types
 
-
-if __name__ == "__main__":
-    reply = input("""
-What would you like to do?
-{simulate_delta, simulate_cum, get_data, show_price_variation, list_running_workers, show_price_per_mnps, get_defined_machine_types, get_skus, bench}
-    """.strip() + " > ").strip().lower()
-    if reply == "simulate_delta" or reply == "simulate_cum":
-        pricing_data_files = sorted(glob("pricing_data/*.json"))
-        pricing_data_files = [{
-            "t": int(x.replace("\\", "/").split(".")[0].split("/")[1]),
-            "data": json.load(open(x))
-        } for x in pricing_data_files]
-        start_t = pricing_data_files[0]["t"]
-        end_t   = pricing_data_files[-1]["t"]
-
-        lichess_costs = []
-        dynascript_costs = []
-
-        cur_t = start_t
-        while cur_t <= end_t:
-            print(min(pricing_data_files, key = lambda pdf: abs(pdf["t"] - cur_t))["t"])
-            machine_types = min(pricing_data_files, key = lambda pdf: abs(pdf["t"] - cur_t))["data"]
-            dollars_per_mnps = []
-
-            for f in glob("fishnet_benchmarker/data/gcp/*.json"):
-                json_data = json.loads(open(f).read())[0]
-                n_nodes = int(json_data["n_nodes"].replace(" million", ""))
-                seconds = json_data["bench_length"]
-
-                instance_name = f.replace("\\", "/").split("/")[-1].split(".")[0]
-
-                try:
-                    matching = [x for x in machine_types if x["instance-type"] == instance_name]
-                    for match in matching:
-                        price = match["price"]
-                        region = match["region"]
-                        dollars_per_mnps.append({
-                            "name": instance_name + "-" + region,
-                            "cost_per_mnps": 1 / (n_nodes / seconds / price),
-                            "price": price,
-                            "mnps": n_nodes / seconds,
-                        })
-                except Exception as e:
-                    continue
-
-            dollars_per_mnps = sorted(dollars_per_mnps, key = lambda x: x["cost_per_mnps"])
-
-            lichess_machine = [x for x in dollars_per_mnps if x["name"] == "n1-custom-8-8192-us-central1"][0]
-            lichess_instance_mpns = lichess_machine["mnps"]
-
-            print("one lichess instance (n1-custom-8-8192-us-central1) has {:.2f} mnps and costs ${:.4f}".format(lichess_instance_mpns, lichess_machine["price"]))
-            print("the cheapest instance ({}) has {:.2f} mnps and costs ${:.4f}".format(dollars_per_mnps[0]["name"], dollars_per_mnps[0]["mnps"], dollars_per_mnps[0]["price"]))    
-
-            n_lichess_instances = 1
-            day_t = cur_t % (24 * 60 * 60)
-            day_hour = day_t // (60 * 60)
-            if day_hour <= 2 or day_hour >= 18:
-                n_lichess_instances = 8
-
-            print("t = {}; day_t = {}; day_hour = {}; n_lichess_instancesinstances = {}".format(cur_t, day_t, day_hour, n_lichess_instances))
-
-            n_dynascript_instances = round(lichess_instance_mpns / dollars_per_mnps[0]["mnps"] * n_lichess_instances)
-            print("we need {} cheapest instances to replace {} lichess instances".format(n_dynascript_instances, n_lichess_instances))
-
-            lichess_costs.append((cur_t, lichess_machine["price"] * n_lichess_instances / 60))
-            dynascript_costs.append((cur_t, dollars_per_mnps[0]["price"] * n_dynascript_instances / 60))
-            cur_t += 60
-        
-        if reply == "simulate_delta":
-            plt.plot([x[0] / 3600 for x in lichess_costs], [x[1] for x in lichess_costs])
-            plt.plot([x[0] / 3600 for x in dynascript_costs], [x[1] for x in dynascript_costs])
-        else:
-            plt.plot([x[0] / 3600 for x in lichess_costs], [sum([a[1] for a in lichess_costs[:idx]]) for idx, x in enumerate(lichess_costs)])
-            plt.plot([x[0] / 3600 for x in dynascript_costs], [sum([a[1] for a in dynascript_costs[:idx]]) for idx, x in enumerate(dynascript_costs)])
-        plt.legend(["lichess costs", "dynascript costs"])
-        plt.show()
-    elif reply == "get_data":
-        while True:
-            t = datetime.datetime.now().strftime("%H:%M")
-            try:
-                machine_types = get_defined_machine_types(return_all = True)
-                open("pricing_data/" + str(int(time.time())) + ".json", "w").write(json.dumps(machine_types))
-                print("[{}]: saved pricing data".format(t))
-            except Exception as e:
-                print("[{}]: exception ".format(t), str(e))
-
-            time.sleep(60)
-    elif reply == "bench":
-        machine_types = get_defined_machine_types()
-        vm_name = "fishnetbench-" + "".join([random.choice(string.ascii_lowercase) for x in range(20)])
-        for machine_type in machine_types:
-            if os.path.isfile("fishnet_benchmarker/data/gcp/" + machine_type["instance-type"] + ".json"):
-                print(machine_type["instance-type"], "has already been benchmarked. Skipping it.")
-                continue
-            elif os.path.isfile("fishnet_benchmarker/data/gcp/" + machine_type["instance-type"] + ".lock"):
-                print(machine_type["instance-type"], "is being benchmarked (or lock leaked). Skipping it.")
-                continue
-            else:
-                print(machine_type["instance-type"], "hasn't been benchmarked yet. Doing it now and locking it.")
-
-            lock = FileLock("fishnet_benchmarker/data/gcp/" + machine_type["instance-type"] + ".lock")
-            with lock:
-                print("Making spot instance `{}`...".format(vm_name))
-
-                for letter in "abcdef":
-                    region = machine_type["region"] + "-" + letter
-
-                    success, out = make_spot_instance(vm_name, machine_type["instance-type"], region)
-                    if not success:
-                        if "does not exist in zone" not in out:
-                            print("Failed! output:")
-                            print(out)
-                            sys.exit(1)
-                        else:
-                            continue
-                    else:
-                        break
-
-                if not success:
-                    "Unsuccessful in starting server."
-
-                print("SCPing benchmark script on server")
-                attempts = 0
-                while True:
-                    if attempts > 20:
-                        print("Something is wrong. Bailing out!")
-                        print(out)
-                        sys.exit(1)
-
-                    attempts += 1
-                    success, out = put_file(vm_name, region, "fishnet_benchmarker/make_benchmark.py", "/home/ubuntu/make_benchmark.py")
-                    if not success:
-                        if "External IP" in out:
-                            print("We have been interrupted!")
-                            break
-                    else:
-                        break
-
-                if "External IP" in out:
-                    print("We have been interrupted!")
-                    continue
-
-                print("[{}]: running benchmark. Should take <15 minutes.".format(datetime.datetime.now().strftime("%H:%M")))
-                success, stdout, stderr = exec_ssh(vm_name, region, "python3 make_benchmark.py")
-                if not success:
-                    if "External IP" in stdout + stderr or "unexpectedly closed" in stdout + stderr:
-                        print("We have been interrupted!")
-                        continue
-
-                    print("FAILED!")
-                    print(stdout)
-                    print(stderr)
-
-                print("Done. Getting result.json...")
-                success, out = get_file(vm_name, region, "/home/ubuntu/results.json", "fishnet_benchmarker/data/gcp/" + machine_type["instance-type"] + ".json")
-                if not success:
-                    print("FAILED!")
-                    print(out)
-
-                print("Deleting spot instance {}".format(vm_name))
-                success, out = delete_spot_instance(vm_name)
-                if not success:
-                    print("Failed! output:")
-                    print(out)
-                    sys.exit(1)
-    elif reply == "get_skus":
-        pprint(get_skus())
-    elif reply == "get_defined_machine_types":
-        for machine_type in get_defined_machine_types():
-            print(json.dumps(machine_type, indent = 4))
-    elif reply == "list_running_workers":
-        print("Unimplemented")
-    elif reply == "show_price_per_mnps":
-        machine_types = get_defined_machine_types()
-        dollars_per_mnps = []
-
-        for f in glob("fishnet_benchmarker/data/gcp/*.json"):
-            json_data = json.loads(open(f).read())[0]
-            n_nodes = int(json_data["n_nodes"].replace(" million", ""))
-            seconds = json_data["bench_length"]
-            if seconds < 1000 and "n1" not in f:
-                print("Skipping short test")
-                continue
-
-            instance_name = f.replace("\\", "/").split("/")[-1].split(".")[0]
-
-            try:
-                price = [x for x in machine_types if x["instance-type"] == instance_name][0]["price"]
-                region = [x for x in machine_types if x["instance-type"] == instance_name][0]["region"]
-            except:
-                print("not available")
-                continue
-
-            print(instance_name, region, 1 / (n_nodes / seconds / price))
-            dollars_per_mnps.append((instance_name.replace("-custom", "") + "-" + region, 1 / (n_nodes / seconds / price)))
-
-        dollars_per_mnps = sorted(dollars_per_mnps, key = lambda x: x[1])
-        plt.bar([x[0] for x in dollars_per_mnps], [x[1] for x in dollars_per_mnps])
-        plt.show()
-    elif reply == "show_price_variation":
+# The cheapest region of every machine type of a list.
+def cheapest_regions(machine_types):
+    machine_types_grouped = itertools.groupby(sorted(machine_types, key = lambda t: t["instance-type"]), key = lambda t: t["instance-type"])
+    return [min(list(x), key = lambda t: t["price"] if t["price"] > 0.000001 else 999999) for n, x in machine_types_grouped]
+
+# Simulates on the collected price history; older data may only be in the
+# snapshot store `import` fills. start_t and end_t default to the span of
+# the data. Says which one it uses, as they don't price a time the same
+# way.
+def simulate(start_t = None, end_t = None, step = 60, store_path = "pricing_store", deltas_path = "pricing_deltas"):
+    from price_history import PriceHistory
+    from pricing_store import PriceDeltaLog, PricingStore
+    import simulator
+
+    delta_log = PriceDeltaLog(deltas_path)
+    if delta_log.n_ticks:
+        print("Simulating on the price change log in {} ({} to {}): every time is priced at the prices in effect then.".format(
+            deltas_path, format_time(delta_log.ticks()[0]), format_time(delta_log.ticks()[-1])))
+        return simulator.simulate_history(PriceHistory(delta_log), simulator.load_benchmarks(), start_t, end_t, step)
+
+    store = PricingStore(store_path)
+    if len(store) == 0:
+        raise ValueError("The pricing store is empty. Run collect or import first.")
+    snapshot_times = store.snapshots()[0]
+    print("Simulating on the snapshot store in {} ({} to {}): every time is priced at the nearest snapshot.".format(
+        store_path, format_time(snapshot_times[0]), format_time(snapshot_times[-1])))
+    return simulator.simulate(store, simulator.load_benchmarks(), start_t, end_t, step)
+
+def price_per_mnps_report(provider_names = "gcp"):
+    from benchmark_registry import BenchmarkRegistry
+    import providers
+    import reports
+    registry = BenchmarkRegistry()
+    clouds = get_providers(provider_names)
+    best = {provider.name: registry.best(provider.name, min_length = reports.MIN_BENCH_LENGTH) for provider in clouds}
+    return reports.price_per_mnps_report(providers.machine_types(clouds), best, get_preemption_log().hazard_rates())
+
+# The latest collected prices if they are at most max_age seconds old, so
+# that we don't hit the billing API, live prices otherwise. Says which ones
+# it uses. Returns the report, the prices, the history and the time of the
+# prices (None for live ones).
+def price_variation_report(deltas_path = "pricing_deltas", max_age = 60 * 60):
+    from price_history import PriceHistory
+    from pricing_store import PriceDeltaLog
+    import reports
+
+    delta_log = PriceDeltaLog(deltas_path)
+    history = PriceHistory(delta_log)
+    now = int(delta_log.ticks()[-1]) if delta_log.n_ticks else None
+    if now is not None and time.time() - now <= max_age:
+        print("Using the prices collected at {}.".format(format_time(now)))
+        machine_types = history.snapshot_at(now)
+    else:
+        if now is not None:
+            print("The last collected prices are from {}, more than {} seconds ago: using live prices.".format(format_time(now), max_age))
+        now = None
         machine_types = get_defined_machine_types(return_all = True)
-        chart = []
-
-        machine_types_grouped = itertools.groupby(sorted(machine_types, key = lambda t: t["instance-type"]), key = lambda t: t["instance-type"])
-        for machine_type, machines in machine_types_grouped:
-            machines = sorted(machines, key = lambda x: x["price"])
-            for machine in machines:
-                print(machine_type, "in", machine["region"], "costs", "{:.5f}$".format(machine["price"]))
-
-            name = (machine_type.replace("-custom", "").replace("-standard", ""))
-
-            chart.append((name, machines[0]["price"] / machines[-1]["price"]))
+    return reports.price_variation_report(machine_types), machine_types, history, now
 
-        plt.bar([x[0] for x in chart], [x[1] for x in chart])
-        plt.show()
+# Epoch seconds, or an ISO 8601 date or time ("2021-03-01",
+# "2021-03-01T12:00"), UTC unless it says otherwise.
+def parse_time(value):
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        t = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("`{}` is neither epoch seconds nor an ISO date".format(value))
+    if t.tzinfo is None:
+        t = t.replace(tzinfo = datetime.timezone.utc)
+    return int(t.timestamp())
+
+# Epoch seconds -> "2021-03-01 12:00 UTC"
+def format_time(t):
+    return datetime.datetime.fromtimestamp(int(t), datetime.timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+def env_int(name, default = None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+# Reports are written to --report-dir, in the comma-separated --formats (see
+# reports.FORMATS).
+def export(args, report):
+    import reports
+    for path in reports.export(report, args.report_dir, args.formats.split(",")):
+        print("wrote {}".format(path))
+
+def cmd_simulate(args):
+    import reports
+    try:
+        result = simulate(args.start, args.end, args.step, args.store, args.deltas)
+    except ValueError as e:
+        print(e)
+        return 1
+    print("simulated {} minutes: lichess costs ${:.2f}, dynascript costs ${:.2f}".format(
+        len(result["t"]), result["lichess_costs"].sum(), result["dynascript_costs"].sum()))
+    for report in reports.simulation_reports(result):
+        if report.name == ("simulate_cum" if args.cumulative else "simulate_delta"):
+            export(args, report)
+
+def cmd_collect(args):
+    from collector import PricingCollector
+    from pricing_store import PriceDeltaLog
+    # Every tick really fetches: the SKU cache would have us record the same
+    # prices under new timestamps until it expires.
+    collector = PricingCollector(lambda: get_defined_machine_types(return_all = True, fresh = True), PriceDeltaLog(args.deltas), interval = args.interval)
+    collector.run()
+
+def cmd_import(args):
+    from pricing_store import PriceDeltaLog, PricingStore, import_json_dir, import_store
+    store = PricingStore(args.store)
+    n_imported = import_json_dir(args.src, store)
+    print("Imported {} snapshots from {} ({} rows in the store)".format(n_imported, args.src, len(store)))
+    delta_log = PriceDeltaLog(args.deltas)
+    n_imported = import_store(store, delta_log)
+    print("Recorded {} snapshots in the price change log ({} rows)".format(n_imported, len(delta_log)))
+
+def cmd_bench(args):
+    from bench_orchestrator import BenchOrchestrator
+    from benchmark_registry import BENCH_ROOT
+    provider = get_provider(args.provider)
+    machine_types = cheapest_regions(provider.machine_types())
+    orchestrator = BenchOrchestrator(
+        provider.compute,
+        data_dir = args.data_dir or os.path.join(BENCH_ROOT, provider.name),
+        zone_index = provider.zone_index,
+        max_workers = args.workers,
+        region_quota = args.region_quota,
+        wheelhouse = args.wheelhouse,
+        bench_args = args.bench_args,
+        preemption_log = get_preemption_log(),
+    )
+    for instance_type, status in orchestrator.run(machine_types).items():
+        print(instance_type, status)
+
+# fleet_solver options over every provider of a comma-separated list, their
+# catalogs fetched concurrently.
+def fleet_options(provider_names):
+    import providers
+    clouds = get_providers(provider_names)
+    return providers.make_options(providers.machine_types(clouds), providers.benchmarks(clouds), get_preemption_log().hazard_rates())
+
+def cmd_solve(args):
+    import fleet_solver
+    fleet = fleet_solver.solve(fleet_options(args.providers), args.target, default_cap = args.region_cap)
+    if fleet is None:
+        if args.region_cap is None:
+            print("No fleet reaches {} mnps.".format(args.target))
+        else:
+            print("No fleet reaches {} mnps with at most {} instances per region.".format(args.target, args.region_cap))
+        return 1
+    for x in fleet["instances"]:
+        print("{:>3} x {} in {} ({}): ${:.4f}/h, {:.2f} mnps".format(x["count"], x["instance-type"], x["region"], x["provider"], x["price"] * x["count"], x["mnps"] * x["count"]))
+    print("total: ${:.4f}/h for {:.2f} mnps (lower bound ${:.4f}/h)".format(fleet["price"], fleet["mnps"], fleet["lower_bound"]))
+
+def cmd_autoscale(args):
+    from autoscaler import Autoscaler
+    from demand import FishnetQueueDemand, ScheduleDemand
+    import simulator
+
+    benchmarks = simulator.load_benchmarks()
+    if args.demand == "schedule":
+        demand = ScheduleDemand(benchmarks[simulator.LICHESS_INSTANCE_TYPE])
     else:
-        print("Unrecognized request `{}`. Quitting.".format(reply))
\ No newline at end of file
+        demand = FishnetQueueDemand(min_mnps = args.min_mnps)
+    autoscaler = Autoscaler(
+        None, demand,
+        lambda: fleet_options(args.providers),
+        default_cap = args.region_cap,
+        worker_command = args.worker_command,
+        preemption_log = get_preemption_log(),
+        providers = {provider.name: provider for provider in get_providers(args.providers)},
+    )
+    autoscaler.run(interval = args.interval)
+
+def cmd_build_image(args):
+    from bench_image import BENCH_IMAGE_FAMILY, build_benchmark_image
+    image_name = build_benchmark_image(get_compute(), args.zone)
+    if image_name is None:
+        return 1
+    print("Built {}. Set BENCH_IMAGE_FAMILY={} to benchmark with it.".format(image_name, BENCH_IMAGE_FAMILY))
+
+def cmd_calibrate(args):
+    from calibration import calibration_factor
+    factor, ratios = calibration_factor()
+    if factor is None:
+        print("No machine type has both a fishnet and a Stockfish bench result.")
+        return
+    for name, ratio in ratios.items():
+        print("{}: 1 Stockfish bench mnps = {:.3f} fishnet mnps".format(name, ratio))
+    print("calibration factor: {:.3f}".format(factor))
+
+def cmd_skus(args):
+    pprint(get_skus())
+
+def cmd_machine_types(args):
+    for machine_type in get_defined_machine_types(return_all = args.all):
+        print(json.dumps(machine_type, indent = 4))
+
+def cmd_workers(args):
+    import providers
+    clouds = get_providers(args.providers)
+    prices = {(x["instance-type"], x["region"]): x["price"] for x in providers.machine_types(clouds)}
+    vms = []
+    for provider in clouds:
+        provider.inventory.prices = prices
+        vms += [dict(vm, provider = provider.name) for vm in provider.inventory.vms()]
+    for vm in sorted(vms, key = lambda x: x["name"]):
+        print("{:<34} {:<4} {:<18} {:<24} {:<11} {:>6} {:>9}".format(
+            vm["name"], vm["provider"], vm["instance-type"], vm["zone"], vm["status"],
+            "{:.1f}h".format(vm["uptime"] / 3600) if vm["uptime"] is not None else "-",
+            "${:.4f}".format(vm["accrued_cost"]) if vm["accrued_cost"] is not None else "-"))
+    print("{} VMs, {} running, ${:.4f} so far".format(
+        len(vms), sum(1 for vm in vms if vm["status"] == "RUNNING"), sum(vm["accrued_cost"] or 0 for vm in vms)))
+
+def cmd_rank(args):
+    report = price_per_mnps_report(args.providers)
+    for row in report.rows():
+        print(row[2], row[3], row[1], row[4], "({} runs, {:.2f} preemptions/h)".format(row[5], row[6]))
+    export(args, report)
+
+def cmd_variation(args):
+    report, machine_types, history, now = price_variation_report(args.deltas, args.max_age)
+    machine_types_grouped = itertools.groupby(sorted(machine_types, key = lambda t: t["instance-type"]), key = lambda t: t["instance-type"])
+    for machine_type, machines in machine_types_grouped:
+        for machine in sorted(machines, key = lambda x: x["price"]):
+            print(machine_type, "in", machine["region"], "costs", "{:.5f}$".format(machine["price"]), end = "")
+            if now is not None:
+                start, mins, means, maxs = history.resample(machine_type, machine["region"], now - 24 * 60 * 60, now, 24 * 60 * 60)
+                print(" (last 24h: {:.5f}$ - {:.5f}$, mean {:.5f}$)".format(mins[0], maxs[0], means[0]), end = "")
+            print()
+    export(args, report)
+
+# Every report, in a single run.
+def cmd_reports(args):
+    import reports
+    all_reports = [price_per_mnps_report(args.providers), price_variation_report(args.deltas)[0]]
+    try:
+        all_reports += reports.simulation_reports(simulate(args.start, args.end, args.step, args.store, args.deltas))
+    except ValueError as e:
+        print("Skipping the simulation: {}".format(e))
+    for report in all_reports:
+        export(args, report)
+
+def add_data_paths(parser, store = True):
+    parser.add_argument("--deltas", default = "pricing_deltas", help = "price change log directory (default: %(default)s)")
+    if store:
+        parser.add_argument("--store", default = "pricing_store", help = "snapshot store directory (default: %(default)s)")
+
+def add_time_range(parser):
+    parser.add_argument("--start", type = parse_time, help = "epoch seconds or ISO date, UTC (default: start of the data)")
+    parser.add_argument("--end", type = parse_time, help = "epoch seconds or ISO date, UTC (default: end of the data)")
+    parser.add_argument("--step", type = int, default = 60, help = "seconds between simulated times (default: %(default)s)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog = "get_spot.py", description = "Spot instance prices, benchmarks and fleets for lichess' fishnet.")
+    parser.add_argument("--report-dir", default = os.environ.get("REPORT_DIR", "reports"), help = "where reports are written (default: %(default)s)")
+    parser.add_argument("--formats", default = os.environ.get("REPORT_FORMATS", "png,csv"), help = "comma-separated report formats, of png, svg, csv and parquet (default: %(default)s)")
+    parser.add_argument("--providers", default = os.environ.get("PROVIDERS", "gcp"), help = "comma-separated clouds to rank, list and run workers on, of gcp and aws (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest = "command", metavar = "command")
+
+    def add(name, func, help):
+        subparser = subparsers.add_parser(name, help = help, description = help)
+        subparser.set_defaults(func = func)
+        return subparser
+
+    p = add("simulate", cmd_simulate, "simulate lichess' fleet against the cheapest one over the price history")
+    p.add_argument("--cumulative", action = "store_true", help = "report running totals instead of costs per step")
+    add_time_range(p)
+    add_data_paths(p)
+
+    p = add("collect", cmd_collect, "record prices every interval, until interrupted")
+    p.add_argument("--interval", type = int, default = 60, help = "seconds (default: %(default)s)")
+    add_data_paths(p, store = False)
+
+    p = add("import", cmd_import, "import legacy <epoch>.json snapshots into the store and the price change log")
+    p.add_argument("--src", default = "pricing_data", help = "(default: %(default)s)")
+    add_data_paths(p)
+
+    p = add("bench", cmd_bench, "benchmark every machine type")
+    p.add_argument("--provider", choices = ["gcp", "aws"], default = "gcp", help = "(default: %(default)s)")
+    p.add_argument("--data-dir", default = os.environ.get("BENCH_DATA_DIR"), help = "where results are saved (default: $BENCH_DATA_DIR or fishnet_benchmarker/data/<provider>)")
+    p.add_argument("--workers", type = int, default = env_int("BENCH_WORKERS", 4), help = "benchmarks in flight (default: %(default)s)")
+    p.add_argument("--region-quota", type = int, default = env_int("BENCH_REGION_QUOTA", 2), help = "benchmarks in flight per region (default: %(default)s)")
+    p.add_argument("--wheelhouse", default = os.environ.get("BENCH_WHEELHOUSE"))
+    p.add_argument("--bench-args", default = os.environ.get("BENCH_ARGS", ""), help = "extra make_benchmark.py arguments")
+
+    add("rank", cmd_rank, "rank machine types by price per mnps, preemptions included")
+
+    p = add("variation", cmd_variation, "compare machine type prices across regions")
+    p.add_argument("--max-age", type = int, default = 60 * 60, help = "seconds after which collected prices are too old and live ones are fetched (default: %(default)s)")
+    add_data_paths(p, store = False)
+
+    p = add("reports", cmd_reports, "write every report")
+    add_time_range(p)
+    add_data_paths(p)
+
+    add("workers", cmd_workers, "list our VMs and what they cost so far")
+
+    p = add("solve", cmd_solve, "find the cheapest fleet for a throughput")
+    p.add_argument("--target", type = float, required = True, help = "mnps")
+    p.add_argument("--region-cap", type = int, default = env_int("FLEET_REGION_CAP"), help = "most instances per region")
+
+    p = add("autoscale", cmd_autoscale, "keep a fleet of workers sized to the demand, until interrupted")
+    p.add_argument("--demand", choices = ["fishnet", "schedule"], default = os.environ.get("AUTOSCALE_DEMAND", "fishnet"), help = "the fishnet queue, or the simulator's lichess schedule (default: %(default)s)")
+    p.add_argument("--min-mnps", type = float, default = float(os.environ.get("AUTOSCALE_MIN_MNPS", 0)))
+    p.add_argument("--interval", type = int, default = env_int("AUTOSCALE_INTERVAL", 60), help = "seconds (default: %(default)s)")
+    p.add_argument("--region-cap", type = int, default = env_int("FLEET_REGION_CAP"), help = "most instances per region")
+    p.add_argument("--worker-command", default = os.environ.get("FISHNET_WORKER_COMMAND"), help = "run over ssh on new workers")
+
+    p = add("build-image", cmd_build_image, "build the benchmark image")
+    p.add_argument("--zone", required = True)
+
+    add("calibrate", cmd_calibrate, "relate Stockfish bench results to fishnet ones")
+    add("skus", cmd_skus, "print the preemptible compute SKUs")
+
+    p = add("machine-types", cmd_machine_types, "print the machine types we can use, in their cheapest region")
+    p.add_argument("--all", action = "store_true", help = "in every region")
+
+    return parser
+
+def main(argv = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+    try:
+        return args.func(args)
+    except RuntimeError as e:
+        print(e)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
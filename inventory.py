@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from bench_orchestrator import log
+from zone_index import region_of
+
+# Names of the VMs we make: benchmark VMs (bench_orchestrator) and fishnet
+# workers (autoscaler).
+FLEET_PREFIXES = ("fishnetbench-", "fishnetworker-")
+
+# Every VM of ours, from a single instance listing cached for ttl seconds.
+# prices maps (instance type, region) to an hourly price, as
+# get_defined_machine_types(return_all = True) has them, to tell what each
+# running VM has cost so far. Deleting or stopping many VMs takes one call
+# per zone, the zones being handled in parallel.
+class FleetInventory:
+    def __init__(self, compute, prices = None, ttl = 30, prefixes = FLEET_PREFIXES, max_workers = 8, clock = time.time):
+        self.compute = compute
+        self.prices = prices or {}
+        self.ttl = ttl
+        self.prefixes = prefixes
+        self.max_workers = max_workers
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self._vms = None
+        self._listed_at = 0
+
+    def invalidate(self):
+        with self.lock:
+            self._vms = None
+
+    # The VMs as {"name", "instance-type", "zone", "region", "status",
+    # "created_at", "uptime", "price", "accrued_cost"} dicts. uptime and
+    # accrued_cost (in dollars, at today's price) are only known for running
+    # VMs, price only for the machine types we have a price for.
+    def vms(self, force = False):
+        with self.lock:
+            now = self.clock()
+            if force or self._vms is None or now - self._listed_at >= self.ttl:
+                self._vms = self.compute.list_instances(self.prefixes)
+                self._listed_at = now
+
+            vms = []
+            for x in self._vms:
+                region = region_of(x["zone"])
+                running = x["status"] == "RUNNING"
+                price = self.prices.get((x["instance-type"], region))
+                uptime = max(0, now - x["created_at"]) if running else None
+                vms.append(dict(x,
+                    region = region,
+                    uptime = uptime,
+                    price = price,
+                    accrued_cost = price * uptime / 3600 if running and price is not None else None,
+                ))
+            return vms
+
+    # Runs action (a compute method taking a list of VM names and a zone) on
+    # vms, one call per zone. Returns the names of the VMs it failed on.
+    def _batch(self, action, vms, what):
+        by_zone = {}
+        for vm in vms:
+            by_zone.setdefault(vm["zone"], []).append(vm["name"])
+        if not by_zone:
+            return []
+
+        def run(zone):
+            success, out = action(by_zone[zone], zone)
+            if not success:
+                log(zone, "failed to {} {}! output:\n{}".format(what, ", ".join(by_zone[zone]), out))
+            return success
+
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(by_zone))) as executor:
+            results = list(executor.map(run, sorted(by_zone)))
+        self.invalidate()
+        return [name for zone, success in zip(sorted(by_zone), results) if not success for name in by_zone[zone]]
+
+    def delete(self, vms):
+        return self._batch(self.compute.delete_instances, vms, "delete")
+
+    def stop(self, vms):
+        return self._batch(self.compute.stop_instances, vms, "stop")
@@ -0,0 +1,128 @@
+import math
+
+import numpy as np
+
+# The machine families we know how to price, with the SKUs their cores and
+# RAM are billed under. Custom families accept any vCPU count listed in
+# "vcpus" and any amount of RAM (in GB) between the "ram_per_vcpu" bounds
+# times the vCPU count, in steps of 256 MB. Predefined families only come in
+# the shapes listed in "shapes", as (name, vCPUs, GB of RAM).
+FAMILIES = [
+    {
+        "name": "n1",
+        "core_sku": "Preemptible Custom Instance Core",
+        "ram_sku": "Preemptible Custom Instance Ram",
+        "custom": True,
+        "vcpus": [1] + list(range(2, 97, 2)),
+        "ram_per_vcpu": (0.9, 6.5),
+    },
+    {
+        "name": "n2",
+        "core_sku": "Preemptible N2 Custom Instance Core",
+        "ram_sku": "Preemptible N2 Custom Instance Ram",
+        "custom": True,
+        "vcpus": list(range(2, 33, 2)) + list(range(36, 81, 4)),
+        "ram_per_vcpu": (0.5, 8),
+    },
+    {
+        "name": "e2",
+        "core_sku": "Preemptible E2 Instance Core",
+        "ram_sku": "Preemptible E2 Instance Ram",
+        "custom": True,
+        "vcpus": list(range(2, 33, 2)),
+        "ram_per_vcpu": (0.5, 8),
+    },
+    {
+        "name": "n2d",
+        "core_sku": "Preemptible N2D AMD Custom Instance Core",
+        "ram_sku": "Preemptible N2D AMD Custom Instance Ram",
+        "custom": True,
+        "vcpus": [2, 4, 8, 16, 32, 48, 64, 80, 96],
+        "ram_per_vcpu": (0.5, 8),
+    },
+    {
+        "name": "c2",
+        "core_sku": "Preemptible Compute optimized Core",
+        "ram_sku": "Preemptible Compute optimized Ram",
+        "custom": False,
+        "shapes": [("c2-standard-{}".format(n), n, 4 * n) for n in [4, 8, 16, 30, 60]],
+    },
+    {
+        "name": "n1-standard",
+        "core_sku": "Preemptible N1 Predefined Instance Core",
+        "ram_sku": "Preemptible N1 Predefined Instance Ram",
+        "custom": False,
+        "shapes": [("n1-standard-{}".format(n), n, 3.75 * n) for n in [1, 2, 4, 8, 16, 32, 64, 96]],
+    },
+]
+FAMILIES_BY_NAME = {family["name"]: family for family in FAMILIES}
+
+def custom_shape(family, n_vcpu, ram_gb):
+    return {
+        "instance-type": "{}-custom-{}-{}".format(family, n_vcpu, int(round(ram_gb * 1024))),
+        "family": family,
+        "n_vcpu": n_vcpu,
+        "ram_gb": ram_gb,
+    }
+
+def predefined_shape(family, name):
+    for shape_name, n_vcpu, ram_gb in FAMILIES_BY_NAME[family]["shapes"]:
+        if shape_name == name:
+            return {"instance-type": name, "family": family, "n_vcpu": n_vcpu, "ram_gb": ram_gb}
+    raise KeyError(name)
+
+# The shapes get_defined_machine_types() prices every minute: the ones we have
+# benchmarks for, or want benchmarks for.
+DEFINED_SHAPES = (
+    [custom_shape("n1", n, 1 * n) for n in [8, 16]]
+    + [custom_shape(family, n, 0.5 * n) for family in ["n2", "e2", "n2d"] for n in [8, 16]]
+    + [predefined_shape("c2", "c2-standard-{}".format(n)) for n in [8, 16]]
+    + [predefined_shape("n1-standard", "n1-standard-{}".format(n)) for n in [4, 8, 16]]
+)
+
+# Every shape the given families can be created with. ram_step_gb can be
+# raised to coarsen the RAM grid of custom families.
+def all_shapes(families = FAMILIES, ram_step_gb = 0.25):
+    shapes = []
+    for family in families:
+        if not family["custom"]:
+            shapes += [predefined_shape(family["name"], x[0]) for x in family["shapes"]]
+            continue
+
+        ram_lo, ram_hi = family["ram_per_vcpu"]
+        for n_vcpu in family["vcpus"]:
+            first = math.ceil(ram_lo * n_vcpu / ram_step_gb)
+            last = math.floor(ram_hi * n_vcpu / ram_step_gb)
+            shapes += [custom_shape(family["name"], n_vcpu, x * ram_step_gb) for x in range(first, last + 1)]
+    return shapes
+
+# Computes the hourly price of every shape in every region of a get_skus()
+# result in one vectorized pass. Returns the sorted region names and a
+# (region x shape) matrix, with nan where a region doesn't sell the family.
+def price_matrix(skus, shapes, families = FAMILIES):
+    regions = sorted(skus)
+    family_ids = {family["name"]: idx for idx, family in enumerate(families)}
+
+    core_prices = np.full((len(regions), len(families)), np.nan)
+    ram_prices = np.full((len(regions), len(families)), np.nan)
+    for r, region in enumerate(regions):
+        for f, family in enumerate(families):
+            if family["core_sku"] in skus[region] and family["ram_sku"] in skus[region]:
+                core_prices[r, f] = skus[region][family["core_sku"]]["price"]
+                ram_prices[r, f] = skus[region][family["ram_sku"]]["price"]
+
+    shape_families = np.array([family_ids[x["family"]] for x in shapes], dtype = np.int64)
+    n_vcpu = np.array([x["n_vcpu"] for x in shapes], dtype = np.float64)
+    ram_gb = np.array([x["ram_gb"] for x in shapes], dtype = np.float64)
+
+    return regions, core_prices[:, shape_families] * n_vcpu + ram_prices[:, shape_families] * ram_gb
+
+# Flattens a price matrix into the list of {"instance-type", "price", "region"}
+# dicts the rest of the code works with, skipping unavailable combinations.
+def machine_types(regions, shapes, prices):
+    region_idx, shape_idx = np.nonzero(np.isfinite(prices))
+    return [{
+        "instance-type": shapes[s]["instance-type"],
+        "price": float(prices[r, s]),
+        "region": regions[r],
+    } for r, s in zip(region_idx, shape_idx)]
@@ -0,0 +1,261 @@
+import argparse
+import cProfile
+import json
+import os
+import os.path
+import pstats
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from price_history import PriceHistory
+from pricing_store import COLUMNS, TICKS_FILE, PriceDeltaLog, PricingStore
+import get_spot
+import machine_families
+import simulator
+
+# Timings and peak memory of our own hot paths (SKU parsing, price matrix,
+# snapshot lookups, simulate) on synthetic data of a configurable size, so
+# that regressions show up before the real pricing history gets that big.
+#
+#   python perf_bench.py --days 90 --save perf.json
+#   python perf_bench.py --compare perf.json
+#   BENCH_PROFILE=cprofile python perf_bench.py --only simulate_history
+#
+# --profile (or BENCH_PROFILE) cprofile prints the top functions of every
+# case by cumulative time, tracemalloc the lines that allocated the most.
+
+# SKUs every region sells besides the ones machine_families prices, so that
+# the catalog is about as big and as mixed as the real one.
+FILLER_SKUS = [
+    "Preemptible Nvidia Tesla T4 GPU",
+    "Preemptible Nvidia Tesla V100 GPU",
+    "Preemptible Memory-optimized Instance Core",
+    "Preemptible Memory-optimized Instance Ram",
+    "Preemptible Local SSD",
+    "Preemptible N2D AMD Instance Core",
+    "Preemptible N2D AMD Instance Ram",
+    "Preemptible A2 Instance Core",
+    "Preemptible A2 Instance Ram",
+    "Preemptible Sole Tenancy Premium",
+]
+
+def sku(description, region, price):
+    nanos = int(round(price * 1000 ** 3))
+    return {
+        "description": "{} running in {}".format(description, region),
+        "category": {"resourceFamily": "Compute", "usageType": "Preemptible"},
+        "pricingInfo": [{"pricingExpression": {
+            "usageUnit": "h",
+            "tieredRates": [{"unitPrice": {"units": str(nanos // 1000 ** 3), "nanos": nanos % 1000 ** 3}}],
+        }}],
+        "geoTaxonomy": {"regions": [region]},
+    }
+
+# us-central1 (where lichess runs, see simulator.LICHESS_REGION) and
+# n_regions - 1 made up ones.
+def synthetic_regions(n_regions):
+    return [simulator.LICHESS_REGION] + ["synthetic-region{}".format(idx) for idx in range(1, n_regions)]
+
+# A billing catalog like SkuClient.preemptible_compute_skus() returns: the
+# core and RAM SKUs of every family in every region, plus filler_per_region
+# SKUs per region no machine type uses.
+def synthetic_skus(regions, filler_per_region = 40, seed = 0):
+    rng = np.random.default_rng(seed)
+    skus = []
+    for region in regions:
+        for family in machine_families.FAMILIES:
+            skus.append(sku(family["core_sku"], region, rng.uniform(0.005, 0.02)))
+            skus.append(sku(family["ram_sku"], region, rng.uniform(0.0005, 0.003)))
+        for idx in range(filler_per_region):
+            skus.append(sku(FILLER_SKUS[idx % len(FILLER_SKUS)] + " {}".format(idx), region, rng.uniform(0.001, 1)))
+    rng.shuffle(skus)
+    return skus
+
+class FakeSkuClient:
+    def __init__(self, skus):
+        self.skus = skus
+
+    def preemptible_compute_skus(self, force = False):
+        return self.skus
+
+# mnps of every defined shape, roughly proportional to its vCPUs.
+def synthetic_benchmarks(shapes = machine_families.DEFINED_SHAPES, seed = 0):
+    rng = np.random.default_rng(seed)
+    return {x["instance-type"]: x["n_vcpu"] * rng.uniform(0.6, 1.2) for x in shapes}
+
+# Writes days of prices observed every interval seconds, starting from the
+# machine_types of a get_defined_machine_types(return_all = True) result,
+# into a PriceDeltaLog at deltas_path and a PricingStore of the full
+# snapshots at store_path. At every tick, every price moves by up to 10%
+# with probability change_rate. Returns the log and the store.
+def synthetic_history(deltas_path, store_path, machine_types, days = 60, interval = 600, change_rate = 0.002, start_t = 1600000000, batch_size = 1000, seed = 0):
+    rng = np.random.default_rng(seed)
+    ticks = np.arange(start_t, start_t + days * 24 * 60 * 60, interval, dtype = COLUMNS["t"])
+    instance_types = [x["instance-type"] for x in machine_types]
+    regions = [x["region"] for x in machine_types]
+    current = np.array([x["price"] for x in machine_types])
+
+    log = PriceDeltaLog(deltas_path)
+    store = PricingStore(store_path)
+    for batch_start in range(0, len(ticks), batch_size):
+        batch = ticks[batch_start:batch_start + batch_size]
+        changed = rng.random((len(batch), len(current))) < change_rate
+        if batch_start == 0:
+            changed[0] = True
+        factors = np.where(changed, rng.uniform(0.9, 1.1, changed.shape), 1.0)
+        prices = current * np.cumprod(factors, axis = 0)
+        current = prices[-1]
+
+        tick_idx, pair_idx = np.nonzero(changed)
+        log.append_rows(batch[tick_idx], [instance_types[x] for x in pair_idx], [regions[x] for x in pair_idx], prices[tick_idx, pair_idx])
+        store.append_rows(np.repeat(batch, len(current)), instance_types * len(batch), regions * len(batch), prices.ravel())
+
+    # Every tick is an observation, changed or not: see PriceDeltaLog.
+    with open(os.path.join(deltas_path, TICKS_FILE), "ab") as f:
+        f.write(ticks.tobytes())
+    return PriceDeltaLog(deltas_path), store
+
+# The data every case runs on.
+class Workload:
+    def __init__(self, data_dir, n_regions = 30, filler_per_region = 40, days = 60, interval = 600, change_rate = 0.002, seed = 0):
+        self.regions = synthetic_regions(n_regions)
+        self.skus = synthetic_skus(self.regions, filler_per_region, seed)
+        self.benchmarks = synthetic_benchmarks(seed = seed)
+
+        get_spot._sku_client = FakeSkuClient(self.skus)
+        get_spot._region_blacklist = set()
+        self.machine_types = get_spot.get_defined_machine_types(return_all = True)
+
+        deltas_path = os.path.join(data_dir, "pricing_deltas")
+        store_path = os.path.join(data_dir, "pricing_store")
+        if os.path.isdir(deltas_path) and os.path.isdir(store_path):
+            self.log, self.store = PriceDeltaLog(deltas_path), PricingStore(store_path)
+        else:
+            self.log, self.store = synthetic_history(deltas_path, store_path, self.machine_types, days, interval, change_rate, seed = seed)
+        self.ticks = np.asarray(self.log.ticks())
+        self.lookup_times = np.random.default_rng(seed).integers(self.ticks[0], self.ticks[-1] + 1, 200)
+
+    def describe(self):
+        return "{} SKUs, {} machine types in {} regions, {} ticks ({:.0f} days), {} delta rows, {} snapshot rows".format(
+            len(self.skus), len(self.machine_types), len(self.regions), len(self.ticks),
+            (self.ticks[-1] - self.ticks[0]) / (24 * 60 * 60), len(self.log), len(self.store))
+
+def snapshot_at_cold(workload):
+    # A new history every time, so that nothing comes from its cache.
+    history = PriceHistory(workload.log)
+    for t in workload.lookup_times[:20].tolist():
+        history.snapshot_at(t)
+
+def prices_at(workload):
+    history = PriceHistory(workload.log)
+    for x in workload.machine_types:
+        history.prices_at(x["instance-type"], x["region"], workload.lookup_times)
+
+def store_snapshot_decode(workload):
+    snapshot_times, offsets = workload.store.snapshots()
+    for idx in np.searchsorted(snapshot_times, workload.lookup_times[:20], side = "right").tolist():
+        workload.store.decode(offsets[idx - 1], offsets[idx])
+
+# name -> function of the workload. Every case must leave the workload as it
+# found it.
+CASES = {
+    "get_sku_price": lambda w: [get_spot.get_sku_price(x) for x in w.skus],
+    "get_skus": lambda w: get_spot.get_skus(),
+    "price_matrix_all_shapes": lambda w: machine_families.price_matrix(get_spot.get_skus(), machine_families.all_shapes(ram_step_gb = 1)),
+    "get_defined_machine_types": lambda w: get_spot.get_defined_machine_types(),
+    "get_defined_machine_types_all": lambda w: get_spot.get_defined_machine_types(return_all = True),
+    "delta_state_at": lambda w: [w.log.state_at(t) for t in w.lookup_times[:20].tolist()],
+    "snapshot_at_cold": snapshot_at_cold,
+    "prices_at": prices_at,
+    "store_snapshot_decode": store_snapshot_decode,
+    "simulate_store": lambda w: simulator.simulate(w.store, w.benchmarks),
+    "simulate_history": lambda w: simulator.simulate_history(PriceHistory(w.log), w.benchmarks),
+}
+
+# Minimum and median wall time over repeat runs, then the peak of memory
+# traced during one more run (a separate one: tracing slows everything
+# down). Memory-mapped columns are not counted, only what gets allocated.
+def measure(func, workload, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(workload)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(workload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"min": min(times), "median": statistics.median(times), "peak_bytes": peak}
+
+def profile(func, workload, mode, top = 15):
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.runcall(func, workload)
+        pstats.Stats(profiler, stream = sys.stdout).sort_stats("cumulative").print_stats(top)
+    elif mode == "tracemalloc":
+        tracemalloc.start(10)
+        func(workload)
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        for stat in snapshot.statistics("lineno")[:top]:
+            print("    {}".format(stat))
+    else:
+        raise ValueError("unknown profiler `{}` (not cprofile or tracemalloc)".format(mode))
+
+# Cases of results that got more than tolerance times slower than in
+# baseline (both {name: measure() result}), as (name, old, new) tuples.
+def regressions(baseline, results, tolerance = 1.25):
+    return [(name, baseline[name]["min"], result["min"]) for name, result in results.items()
+            if name in baseline and result["min"] > baseline[name]["min"] * tolerance]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Time the hot paths of the analysis code on synthetic data.")
+    parser.add_argument("--regions", type = int, default = 30)
+    parser.add_argument("--filler-skus", type = int, default = 40, help = "unused SKUs per region (default: %(default)s)")
+    parser.add_argument("--days", type = int, default = 60, help = "of price history (default: %(default)s)")
+    parser.add_argument("--interval", type = int, default = 600, help = "seconds between price ticks (default: %(default)s)")
+    parser.add_argument("--change-rate", type = float, default = 0.002, help = "probability that a price changes at a tick (default: %(default)s)")
+    parser.add_argument("--data-dir", help = "keep the generated history there and reuse it on later runs (default: a temporary directory)")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--only", help = "comma-separated cases, of {}".format(", ".join(CASES)))
+    parser.add_argument("--profile", choices = ["cprofile", "tracemalloc"], default = os.environ.get("BENCH_PROFILE") or None)
+    parser.add_argument("--save", help = "write the results to this JSON file")
+    parser.add_argument("--compare", help = "JSON file of earlier results; exit 1 on regressions")
+    parser.add_argument("--tolerance", type = float, default = 1.25, help = "slowdown counted as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(CASES)
+    for name in names:
+        if name not in CASES:
+            parser.error("unknown case `{}`".format(name))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        workload = Workload(args.data_dir or tmp_dir, args.regions, args.filler_skus, args.days, args.interval, args.change_rate)
+        print("{} (set up in {:.1f}s)".format(workload.describe(), time.perf_counter() - start))
+
+        results = {}
+        for name in names:
+            results[name] = measure(CASES[name], workload, args.repeat)
+            print("{:<30} min {:>9.2f}ms  median {:>9.2f}ms  peak {:>8.1f}MB".format(
+                name, results[name]["min"] * 1000, results[name]["median"] * 1000, results[name]["peak_bytes"] / 1024 ** 2))
+            if args.profile:
+                profile(CASES[name], workload, args.profile)
+
+    if args.save:
+        open(args.save, "w").write(json.dumps({"workload": workload.describe(), "results": results}, indent = 4))
+    if args.compare:
+        slower = regressions(json.load(open(args.compare))["results"], results, args.tolerance)
+        for name, old, new in slower:
+            print("REGRESSION {}: {:.2f}ms -> {:.2f}ms".format(name, old * 1000, new * 1000))
+        if slower:
+            return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import json
+import os
+import os.path
+import threading
+import time
+
+from zone_index import family_of, region_of
+
+PREEMPTION_LOG_FILE = "preemption_log.jsonl"
+EVENTS = ["launch", "preempt", "terminate"]
+
+# Seconds of billed but useless VM time a preemption costs us on top of the
+# lost VM: booting and setting up the replacement, and redoing the analysis
+# that was in flight.
+RESTART_SECONDS = 180
+LOST_WORK_SECONDS = 60
+
+# Append-only log of the life of every VM we start, one
+# [t, event, vm name, instance type, zone] JSON array per line, where event
+# is one of EVENTS. Written by the benchmark orchestrator and the
+# autoscaler, read to learn how often each (region, machine family) gets
+# preempted.
+class PreemptionLog:
+    def __init__(self, path = PREEMPTION_LOG_FILE, window = 7 * 24 * 60 * 60, clock = time.time):
+        self.path = path
+        self.window = window
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def record(self, event, vm_name, instance_type, zone):
+        if event not in EVENTS:
+            raise ValueError("unknown event {}".format(event))
+        line = json.dumps([round(self.clock(), 1), event, vm_name, instance_type, zone], separators = (",", ":"))
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def events(self):
+        if not os.path.isfile(self.path):
+            return []
+        with self.lock:
+            return [json.loads(line) for line in open(self.path) if line.strip()]
+
+    # Preemptions per VM hour of every (region, family) over the last window
+    # seconds, as a dict (region, family) -> {"preemptions", "vm_hours",
+    # "rate"}. A VM counts from its launch to its first preemption or
+    # termination, or until now if it is still running.
+    def hazard_rates(self):
+        now = self.clock()
+        start = now - self.window
+        vms = {}
+        for t, event, vm_name, instance_type, zone in self.events():
+            if event == "launch":
+                vms[vm_name] = {"key": (region_of(zone), family_of(instance_type)), "start": t, "end": None, "preempted": False}
+            elif vm_name in vms and vms[vm_name]["end"] is None:
+                vms[vm_name]["end"] = t
+                vms[vm_name]["preempted"] = event == "preempt"
+
+        rates = {}
+        for vm in vms.values():
+            end = now if vm["end"] is None else vm["end"]
+            if end < start:
+                continue
+            rate = rates.setdefault(vm["key"], {"preemptions": 0, "vm_hours": 0.0})
+            rate["vm_hours"] += (end - max(vm["start"], start)) / 3600
+            rate["preemptions"] += int(vm["preempted"])
+        for rate in rates.values():
+            rate["rate"] = rate["preemptions"] / rate["vm_hours"] if rate["vm_hours"] > 0 else 0.0
+        return rates
+
+    # Regions that got preempted more than max_rate times per VM hour over
+    # the window, all families together, with at least min_vm_hours of
+    # history to judge on.
+    def blacklist(self, max_rate = 0.5, min_vm_hours = 4):
+        regions = {}
+        for (region, family), rate in self.hazard_rates().items():
+            total = regions.setdefault(region, {"preemptions": 0, "vm_hours": 0.0})
+            total["preemptions"] += rate["preemptions"]
+            total["vm_hours"] += rate["vm_hours"]
+        return set(region for region, total in regions.items() if total["vm_hours"] > 0 and total["vm_hours"] >= min_vm_hours and total["preemptions"] / total["vm_hours"] > max_rate)
+
+# Dollars per mnps once preemptions are accounted for: with rate
+# preemptions per hour, every preemption wastes restart_seconds plus
+# lost_work_seconds of billed time, so only 1 / (1 + rate * overhead) of
+# the billed hours do useful work.
+def effective_cost_per_mnps(price, mnps, rate, restart_seconds = RESTART_SECONDS, lost_work_seconds = LOST_WORK_SECONDS):
+    overhead_hours = (restart_seconds + lost_work_seconds) / 3600
+    return price * (1 + rate * overhead_hours) / mnps
@@ -0,0 +1,118 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+# The prices of a series (change times and prices, as PriceHistory.series()
+# returns them) at every time of ts, nan before its first change.
+def prices_as_of(series, ts):
+    ts = np.asarray(ts)
+    times, prices = series
+    if len(times) == 0:
+        return np.full(len(ts), np.nan)
+    idx = np.searchsorted(times, ts, side = "right") - 1
+    return np.where(idx >= 0, prices[np.maximum(idx, 0)], np.nan)
+
+# As-of queries over a pricing_store.PriceDeltaLog. The log's rows are
+# sorted by time; the rows of a single (instance-type, region) series are
+# found once, then kept decoded (change times and prices) in an LRU cache of
+# cache_size series, so that every further lookup in that series is a
+# binary search. Full snapshots are cached the same way, by tick. Series
+# are cached along with the log's length, so rows appended since are seen.
+# Prices are None (or nan in arrays) where the series doesn't exist: before
+# it first appeared or after it disappeared.
+class PriceHistory:
+    def __init__(self, log, cache_size = 256):
+        self.log = log
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self._series = OrderedDict()
+        self._snapshots = OrderedDict()
+
+    def _cached(self, cache, key, compute):
+        with self.lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = compute()
+        with self.lock:
+            cache[key] = value
+            while len(cache) > self.cache_size:
+                cache.popitem(last = False)
+        return value
+
+    def keys(self):
+        cols = self.log.columns()
+        n_regions = len(self.log.regions)
+        pairs = np.unique(cols["type"].astype(np.int64) * n_regions + cols["region"]) if len(self.log) else np.zeros(0, dtype = np.int64)
+        return [(self.log.types[pair // n_regions], self.log.regions[pair % n_regions]) for pair in pairs.tolist()]
+
+    # The change times and prices of a series, as two arrays.
+    def series(self, instance_type, region):
+        def decode():
+            type_id = self.log.type_ids.get(instance_type)
+            region_id = self.log.region_ids.get(region)
+            if type_id is None or region_id is None:
+                return np.zeros(0, dtype = np.int64), np.zeros(0)
+            cols = self.log.columns()
+            rows = np.flatnonzero((cols["type"] == type_id) & (cols["region"] == region_id))
+            return np.asarray(cols["t"][rows]), np.asarray(cols["price"][rows])
+        return self._cached(self._series, (instance_type, region, len(self.log)), decode)
+
+    # Prices of a series at every time of ts (as of each time: the last
+    # change at or before it).
+    def prices_at(self, instance_type, region, ts):
+        return prices_as_of(self.series(instance_type, region), ts)
+
+    def price_at(self, instance_type, region, t):
+        price = float(self.prices_at(instance_type, region, [t])[0])
+        return None if price != price else price
+
+    # The changes of a series between start and end (inclusive), as a list of
+    # (t, price) pairs, starting with its price as of start.
+    def changes(self, instance_type, region, start, end):
+        times, prices = self.series(instance_type, region)
+        first, last = np.searchsorted(times, [start, end], side = "right")
+        out = [(start, self.price_at(instance_type, region, start))]
+        for t, price in zip(times[first:last].tolist(), prices[first:last].tolist()):
+            out.append((t, None if price != price else price))
+        return out
+
+    # Minimum, time-weighted mean and maximum price of a series over buckets
+    # of `bucket` seconds from start to end. Returns the bucket start times
+    # and the three arrays (nan for buckets where the series never existed).
+    def resample(self, instance_type, region, start, end, bucket):
+        edges = np.arange(start, end + bucket, bucket, dtype = np.int64)
+        edges[-1] = min(edges[-1], end)
+        times, prices = self.series(instance_type, region)
+        inside = times[(times > start) & (times < edges[-1])]
+
+        # The series is constant between consecutive breakpoints.
+        breakpoints = np.union1d(edges, inside)
+        values = self.prices_at(instance_type, region, breakpoints[:-1])
+        durations = np.diff(breakpoints).astype(np.float64)
+        bucket_idx = np.searchsorted(edges, breakpoints[:-1], side = "right") - 1
+
+        n_buckets = len(edges) - 1
+        known = ~np.isnan(values)
+        mins = np.full(n_buckets, np.inf)
+        maxs = np.full(n_buckets, -np.inf)
+        np.minimum.at(mins, bucket_idx[known], values[known])
+        np.maximum.at(maxs, bucket_idx[known], values[known])
+        weights = np.bincount(bucket_idx[known], durations[known], minlength = n_buckets)
+        sums = np.bincount(bucket_idx[known], values[known] * durations[known], minlength = n_buckets)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            means = sums / weights
+        mins[np.isinf(mins)] = np.nan
+        maxs[np.isinf(maxs)] = np.nan
+        return edges[:-1], mins, means, maxs
+
+    # The full snapshot as of t (see PriceDeltaLog.state_at()), cached by
+    # tick.
+    def snapshot_at(self, t):
+        ticks = self.log.ticks()
+        idx = int(np.searchsorted(ticks, t, side = "right")) - 1
+        if idx < 0:
+            return None
+        tick = int(ticks[idx])
+        return self._cached(self._snapshots, tick, lambda: self.log.state_at(tick))
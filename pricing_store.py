@@ -0,0 +1,276 @@
+from glob import glob
+import json
+import os
+import os.path
+
+import numpy as np
+
+# On-disk layout of a pricing store directory. Every column is a raw
+# little-endian array that only ever gets appended to, so a reader can
+# memory-map it without parsing anything.
+COLUMNS = {
+    "t": np.dtype("<i8"),
+    "type": np.dtype("<i4"),
+    "region": np.dtype("<i4"),
+    "price": np.dtype("<f8"),
+}
+STRINGS_FILE = "strings.json"
+
+# Append-only columnar store of (timestamp, instance-type, region, price) rows.
+# Instance types and regions are interned: the columns only hold integer ids
+# into self.types / self.regions.
+class PricingStore:
+    def __init__(self, path = "pricing_store"):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+        self.types, self.regions = [], []
+        strings_path = os.path.join(path, STRINGS_FILE)
+        if os.path.isfile(strings_path):
+            strings = json.load(open(strings_path))
+            self.types, self.regions = strings["instance-type"], strings["region"]
+        self.type_ids = {name: idx for idx, name in enumerate(self.types)}
+        self.region_ids = {name: idx for idx, name in enumerate(self.regions)}
+
+        self._repair()
+        self._columns = None
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + ".bin")
+
+    # A crash in the middle of an append can leave columns of different
+    # lengths. Cut every column back to the number of complete rows.
+    def _repair(self):
+        lengths = {}
+        for name, dtype in COLUMNS.items():
+            fname = self._column_path(name)
+            if not os.path.isfile(fname):
+                open(fname, "wb").close()
+            lengths[name] = os.path.getsize(fname) // dtype.itemsize
+
+        self.n_rows = min(lengths.values())
+        for name, dtype in COLUMNS.items():
+            fname = self._column_path(name)
+            if os.path.getsize(fname) != self.n_rows * dtype.itemsize:
+                with open(fname, "r+b") as f:
+                    f.truncate(self.n_rows * dtype.itemsize)
+
+    def __len__(self):
+        return self.n_rows
+
+    def _intern(self, table, ids, name):
+        if name not in ids:
+            ids[name] = len(table)
+            table.append(name)
+        return ids[name]
+
+    def _save_strings(self):
+        strings_path = os.path.join(self.path, STRINGS_FILE)
+        tmp_path = strings_path + ".tmp"
+        open(tmp_path, "w").write(json.dumps({"instance-type": self.types, "region": self.regions}))
+        os.replace(tmp_path, strings_path)
+
+    # Appends rows given as parallel sequences. Timestamps must not go
+    # backwards: readers rely on the t column being sorted.
+    def append_rows(self, ts, instance_types, regions, prices):
+        ts = np.asarray(ts, dtype = COLUMNS["t"])
+        if len(ts) == 0:
+            return
+        if np.any(np.diff(ts) < 0) or (self.n_rows and ts[0] < self.last_t()):
+            raise ValueError("pricing rows must be appended in timestamp order")
+
+        n_strings = len(self.types) + len(self.regions)
+        type_col = np.array([self._intern(self.types, self.type_ids, x) for x in instance_types], dtype = COLUMNS["type"])
+        region_col = np.array([self._intern(self.regions, self.region_ids, x) for x in regions], dtype = COLUMNS["region"])
+        price_col = np.asarray(prices, dtype = COLUMNS["price"])
+        if not (len(ts) == len(type_col) == len(region_col) == len(price_col)):
+            raise ValueError("pricing columns have different lengths")
+
+        # Strings first, so that the ids referenced by the new rows always
+        # exist on disk by the time the rows do.
+        if len(self.types) + len(self.regions) != n_strings:
+            self._save_strings()
+
+        for name, col in (("t", ts), ("type", type_col), ("region", region_col), ("price", price_col)):
+            with open(self._column_path(name), "ab") as f:
+                f.write(col.tobytes())
+
+        self.n_rows += len(ts)
+        self._columns = None
+
+    # Appends a whole get_defined_machine_types(return_all = True) result
+    # observed at time t.
+    def append_snapshot(self, t, machine_types):
+        self.append_rows(
+            [t] * len(machine_types),
+            [x["instance-type"] for x in machine_types],
+            [x["region"] for x in machine_types],
+            [x["price"] for x in machine_types],
+        )
+
+    def last_t(self):
+        if not self.n_rows:
+            return None
+        return int(self.columns()["t"][-1])
+
+    # Memory-mapped views of every column, in row order.
+    def columns(self):
+        if self._columns is None:
+            self._columns = {}
+            for name, dtype in COLUMNS.items():
+                if self.n_rows == 0:
+                    self._columns[name] = np.zeros(0, dtype = dtype)
+                else:
+                    self._columns[name] = np.memmap(self._column_path(name), dtype = dtype, mode = "r", shape = (self.n_rows,))
+        return self._columns
+
+    # Returns the sorted distinct snapshot timestamps and, for each of them,
+    # the index of its first row. Snapshot i spans rows offsets[i]:offsets[i + 1].
+    def snapshots(self):
+        t = self.columns()["t"]
+        if len(t) == 0:
+            return np.zeros(0, dtype = COLUMNS["t"]), np.zeros(1, dtype = np.int64)
+        starts = np.flatnonzero(np.diff(t)) + 1
+        offsets = np.concatenate(([0], starts, [len(t)])).astype(np.int64)
+        return np.asarray(t[offsets[:-1]]), offsets
+
+    # Decodes the rows of a row range back into the machine type dicts
+    # get_defined_machine_types(return_all = True) returns.
+    def decode(self, start, end):
+        cols = self.columns()
+        return [{
+            "instance-type": self.types[type_id],
+            "price": float(price),
+            "region": self.regions[region_id],
+        } for type_id, region_id, price in zip(cols["type"][start:end], cols["region"][start:end], cols["price"][start:end])]
+
+# Imports a directory of legacy pricing_data/<epoch>.json snapshots into a
+# store. Snapshots that are not newer than what the store already holds are
+# skipped, so running it again only picks up new files.
+def import_json_dir(src_dir, store, batch_size = 1000):
+    files = []
+    for f in glob(os.path.join(src_dir, "*.json")):
+        try:
+            files.append((int(os.path.basename(f).split(".")[0]), f))
+        except ValueError:
+            continue
+    files.sort()
+
+    last_t = store.last_t()
+    if last_t is not None:
+        files = [x for x in files if x[0] > last_t]
+
+    n_imported = 0
+    for batch_start in range(0, len(files), batch_size):
+        ts, instance_types, regions, prices = [], [], [], []
+        for t, f in files[batch_start:batch_start + batch_size]:
+            for machine_type in json.load(open(f)):
+                ts.append(t)
+                instance_types.append(machine_type["instance-type"])
+                regions.append(machine_type["region"])
+                prices.append(machine_type["price"])
+        store.append_rows(ts, instance_types, regions, prices)
+        n_imported += min(batch_size, len(files) - batch_start)
+
+    return n_imported
+
+TICKS_FILE = "ticks.bin"
+
+# A PricingStore that only holds changes: a row is written when a
+# (instance-type, region) pair appears or changes price, and a nan price
+# row when it disappears. The time of every observation, changed or not, is
+# kept in ticks.bin. The prices at any time are the last row of every pair
+# up to it, so the full snapshots can be rebuilt exactly.
+class PriceDeltaLog(PricingStore):
+    def __init__(self, path = "pricing_deltas"):
+        super().__init__(path)
+        self._ticks_path = os.path.join(path, TICKS_FILE)
+        if not os.path.isfile(self._ticks_path):
+            open(self._ticks_path, "wb").close()
+        # Same as _repair(): drop a half-written tick.
+        n_ticks = os.path.getsize(self._ticks_path) // COLUMNS["t"].itemsize
+        if os.path.getsize(self._ticks_path) != n_ticks * COLUMNS["t"].itemsize:
+            with open(self._ticks_path, "r+b") as f:
+                f.truncate(n_ticks * COLUMNS["t"].itemsize)
+        self.n_ticks = n_ticks
+        self._ticks = None
+
+        self.current = self._state_until(len(self))
+        # Rows written by a process that died before writing their tick.
+        if self.n_rows and (self.n_ticks == 0 or self.last_t() > self.ticks()[-1]):
+            self._append_tick(self.last_t())
+
+    # (type id, region id) -> price after the first end rows, removed pairs
+    # left out.
+    def _state_until(self, end):
+        cols = self.columns()
+        state = {}
+        for type_id, region_id, price in zip(cols["type"][:end].tolist(), cols["region"][:end].tolist(), cols["price"][:end].tolist()):
+            state[(type_id, region_id)] = price
+        return {key: price for key, price in state.items() if price == price}
+
+    def _append_tick(self, t):
+        with open(self._ticks_path, "ab") as f:
+            f.write(np.array([t], dtype = COLUMNS["t"]).tobytes())
+        self.n_ticks += 1
+        self._ticks = None
+
+    def ticks(self):
+        if self._ticks is None:
+            if self.n_ticks == 0:
+                self._ticks = np.zeros(0, dtype = COLUMNS["t"])
+            else:
+                self._ticks = np.memmap(self._ticks_path, dtype = COLUMNS["t"], mode = "r", shape = (self.n_ticks,))
+        return self._ticks
+
+    # Records a get_defined_machine_types(return_all = True) result observed
+    # at time t, writing only what changed since the last one. Returns the
+    # number of rows written.
+    def append_snapshot(self, t, machine_types):
+        if self.n_ticks and t < self.ticks()[-1]:
+            raise ValueError("pricing snapshots must be appended in timestamp order")
+
+        n_strings = len(self.types) + len(self.regions)
+        seen = {}
+        for x in machine_types:
+            key = (self._intern(self.types, self.type_ids, x["instance-type"]), self._intern(self.regions, self.region_ids, x["region"]))
+            seen[key] = float(x["price"])
+        if len(self.types) + len(self.regions) != n_strings:
+            self._save_strings()
+        changed = [(key, price) for key, price in seen.items() if self.current.get(key) != price]
+        changed += [(key, float("nan")) for key in self.current if key not in seen]
+
+        self.append_rows(
+            [t] * len(changed),
+            [self.types[key[0]] for key, price in changed],
+            [self.regions[key[1]] for key, price in changed],
+            [price for key, price in changed],
+        )
+        self._append_tick(t)
+        self.current = seen
+        return len(changed)
+
+    # The machine type dicts observed at the last tick at or before t, or
+    # None if there is none.
+    def state_at(self, t):
+        if self.n_ticks == 0 or t < self.ticks()[0]:
+            return None
+        end = int(np.searchsorted(self.columns()["t"], t, side = "right"))
+        return [{
+            "instance-type": self.types[type_id],
+            "price": price,
+            "region": self.regions[region_id],
+        } for (type_id, region_id), price in sorted(self._state_until(end).items())]
+
+# Replays the snapshots of a PricingStore newer than the last tick of a
+# PriceDeltaLog into it. Returns the number of snapshots replayed.
+def import_store(store, log):
+    snapshot_times, offsets = store.snapshots()
+    last_tick = log.ticks()[-1] if log.n_ticks else None
+    n_imported = 0
+    for idx, t in enumerate(snapshot_times.tolist()):
+        if last_tick is not None and t <= last_tick:
+            continue
+        log.append_snapshot(t, store.decode(offsets[idx], offsets[idx + 1]))
+        n_imported += 1
+    return n_imported
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+
+from bench_orchestrator import log
+from benchmark_registry import BenchmarkRegistry
+import fleet_solver
+import simulator
+
+# A cloud we can price, benchmark and run workers on. name is the one its
+# benchmarks are filed under (fishnet_benchmarker/data/<name>/, see
+# benchmark_registry). catalog is a function returning its machine types at
+# their current spot price, as {"instance-type", "price", "region"} dicts;
+# compute its instance lifecycle and remote execution API
+# (compute.GcloudCompute, aws.AwsCompute, fake_compute.FakeCompute), with
+# the zone_index.ZoneIndex and inventory.FleetInventory to use with it, if
+# any.
+class Provider:
+    def __init__(self, name, catalog, compute = None, zone_index = None, inventory = None):
+        self.name = name
+        self.catalog = catalog
+        self.compute = compute
+        self.zone_index = zone_index
+        self.inventory = inventory
+
+    # The catalog, every machine type tagged with the provider's name.
+    def machine_types(self):
+        return [dict(x, provider = self.name) for x in self.catalog()]
+
+# The machine types of every provider, their catalogs fetched concurrently.
+# A provider whose catalog can't be fetched is left out with a warning, so
+# that one cloud being unreachable doesn't stop us from using the others,
+# but if none of them can be fetched this raises a RuntimeError rather than
+# returning nothing to price.
+def machine_types(providers, max_workers = 8):
+    errors = {}
+    def fetch(provider):
+        try:
+            return provider.machine_types()
+        except Exception as e:
+            log(provider.name, "could not fetch prices, leaving it out: {}".format(e))
+            errors[provider.name] = e
+            return []
+
+    if not providers:
+        return []
+    with ThreadPoolExecutor(max_workers = min(max_workers, len(providers))) as executor:
+        result = [x for provider_types in executor.map(fetch, providers) for x in provider_types]
+    if len(errors) == len(providers):
+        raise RuntimeError("Could not fetch the prices of any provider ({})".format(
+            "; ".join("{}: {}".format(name, e) for name, e in sorted(errors.items()))))
+    return result
+
+# dict provider name -> (instance type -> mnps), from the benchmark
+# registry (see simulator.load_benchmarks()).
+def benchmarks(providers, registry = None, engine = "fishnet"):
+    if registry is None:
+        registry = BenchmarkRegistry()
+    return {provider.name: simulator.load_benchmarks(registry, provider.name, engine) for provider in providers}
+
+# fleet_solver options over the machine types of several providers (see
+# machine_types()), each one priced against its own provider's benchmarks,
+# so that the solver picks the cheapest mnps wherever it is.
+def make_options(machine_types, benchmarks, hazard_rates = None):
+    options = []
+    machine_types = sorted(machine_types, key = lambda x: x["provider"])
+    for name, provider_types in itertools.groupby(machine_types, key = lambda x: x["provider"]):
+        options += fleet_solver.make_options(list(provider_types), benchmarks.get(name, {}), hazard_rates)
+    return options
@@ -0,0 +1,145 @@
+import csv
+import itertools
+import os
+import os.path
+
+from preemption_log import effective_cost_per_mnps
+from simulator import cumulative
+from zone_index import family_of
+
+REPORT_DIR = "reports"
+# Benchmarks shorter than this (in seconds) are too noisy to rank by.
+MIN_BENCH_LENGTH = 1000
+FORMATS = ["png", "svg", "csv", "parquet"]
+
+# A table of equally long named columns, and how to chart it: a `kind`
+# ("line" or "bar") chart of the y columns against the x column.
+class Report:
+    def __init__(self, name, columns, kind = "line", x = None, y = None, title = None, ylabel = None):
+        self.name = name
+        self.columns = columns
+        self.kind = kind
+        self.x = x or list(columns)[0]
+        self.y = y or [name for name in columns if name != self.x]
+        self.title = title or name
+        self.ylabel = ylabel
+
+    def rows(self):
+        return list(zip(*self.columns.values()))
+
+# Lichess' costs against ours per step, and their running totals, from a
+# simulator.simulate() result.
+def simulation_reports(result):
+    hours = (result["t"] / 3600).tolist()
+    return [
+        Report("simulate_delta", {
+            "hours": hours,
+            "lichess costs": result["lichess_costs"].tolist(),
+            "dynascript costs": result["dynascript_costs"].tolist(),
+        }, title = "Cost per step", ylabel = "$"),
+        Report("simulate_cum", {
+            "hours": hours,
+            "lichess costs": cumulative(result["lichess_costs"]).tolist(),
+            "dynascript costs": cumulative(result["dynascript_costs"]).tolist(),
+        }, title = "Cumulative cost", ylabel = "$"),
+    ]
+
+# Dollars per mnps of every benchmarked machine type in its cheapest region,
+# preemptions included (see preemption_log.effective_cost_per_mnps()),
+# cheapest first, across providers. machine_types is
+# get_defined_machine_types() or providers.machine_types() output (untagged
+# machine types being "gcp" ones), and best maps a provider name to its
+# BenchmarkRegistry.best(min_length = MIN_BENCH_LENGTH) result. Shapes of
+# anything but n1 with only "short" benchmarks are left out, like unpriced
+# machine types.
+def price_per_mnps_report(machine_types, best, hazard_rates = None):
+    cheapest = {}
+    for x in machine_types:
+        key = (x.get("provider", "gcp"), x["instance-type"])
+        if x["price"] > 0.000001 and (key not in cheapest or x["price"] < cheapest[key]["price"]):
+            cheapest[key] = x
+
+    rows = []
+    for provider, provider_best in sorted(best.items()):
+        for instance_name, bench in provider_best.items():
+            if bench["short"] and "n1" not in instance_name:
+                continue
+            if (provider, instance_name) not in cheapest:
+                continue
+            region = cheapest[(provider, instance_name)]["region"]
+            rate = (hazard_rates or {}).get((region, family_of(instance_name)), {}).get("rate", 0.0)
+            cost = effective_cost_per_mnps(cheapest[(provider, instance_name)]["price"], bench["mnps"], rate)
+            rows.append((instance_name.replace("-custom", "") + "-" + region, provider, instance_name, region, cost, bench["n_runs"], rate))
+    rows.sort(key = lambda x: x[4])
+
+    names = ["machine", "provider", "instance-type", "region", "dollars per mnps", "runs", "preemptions per hour"]
+    return Report("price_per_mnps", {name: [row[idx] for row in rows] for idx, name in enumerate(names)},
+        kind = "bar", x = "machine", y = ["dollars per mnps"], title = "Price per mnps", ylabel = "$/h/mnps")
+
+# How much cheaper the cheapest region of every machine type is than its
+# most expensive one, from get_defined_machine_types(return_all = True)
+# output.
+def price_variation_report(machine_types):
+    rows = []
+    machine_types_grouped = itertools.groupby(sorted(machine_types, key = lambda t: t["instance-type"]), key = lambda t: t["instance-type"])
+    for machine_type, machines in machine_types_grouped:
+        machines = sorted(machines, key = lambda x: x["price"])
+        name = machine_type.replace("-custom", "").replace("-standard", "")
+        rows.append((name, machine_type, machines[0]["region"], machines[0]["price"], machines[-1]["region"], machines[-1]["price"], machines[0]["price"] / machines[-1]["price"]))
+
+    names = ["machine", "instance-type", "cheapest region", "cheapest price", "most expensive region", "most expensive price", "ratio"]
+    return Report("price_variation", {name: [row[idx] for row in rows] for idx, name in enumerate(names)},
+        kind = "bar", x = "machine", y = ["ratio"], title = "Cheapest over most expensive region")
+
+def write_csv(report, path):
+    with open(path, "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(report.columns))
+        writer.writerows(report.rows())
+
+# Needs pyarrow.
+def write_parquet(report, path):
+    import pyarrow
+    import pyarrow.parquet
+    pyarrow.parquet.write_table(pyarrow.table(report.columns), path)
+
+# Charts a report into a png or svg file. matplotlib is only imported here,
+# with a non-interactive backend, so that nothing needs a display.
+def render(report, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    fig, ax = plt.subplots(figsize = (max(8, len(report.columns[report.x]) * 0.3) if report.kind == "bar" else 10, 6))
+    for name in report.y:
+        if report.kind == "bar":
+            ax.bar(report.columns[report.x], report.columns[name], label = name)
+        else:
+            ax.plot(report.columns[report.x], report.columns[name], label = name)
+    if report.kind == "bar":
+        ax.tick_params(axis = "x", labelrotation = 90)
+    else:
+        ax.set_xlabel(report.x)
+    if report.ylabel:
+        ax.set_ylabel(report.ylabel)
+    if len(report.y) > 1:
+        ax.legend()
+    ax.set_title(report.title)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+WRITERS = {"png": render, "svg": render, "csv": write_csv, "parquet": write_parquet}
+
+# Writes a report in every format of formats into out_dir, as
+# <report name>.<format>. Returns the paths written.
+def export(report, out_dir = REPORT_DIR, formats = ("png", "csv")):
+    os.makedirs(out_dir, exist_ok = True)
+    paths = []
+    for fmt in formats:
+        if fmt not in WRITERS:
+            raise ValueError("unknown report format `{}` (not one of {})".format(fmt, ", ".join(FORMATS)))
+        path = os.path.join(out_dir, report.name + "." + fmt)
+        WRITERS[fmt](report, path)
+        paths.append(path)
+    return paths
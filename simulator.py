@@ -0,0 +1,243 @@
+import numpy as np
+
+from benchmark_registry import BenchmarkRegistry
+from calibration import calibrated_benchmarks
+
+LICHESS_INSTANCE_TYPE = "n1-custom-8-8192"
+LICHESS_REGION = "us-central1"
+
+# Returns a dict instance type -> million nodes per second, from the
+# benchmark registry (loaded once by the caller, or here). Fishnet figures
+# of types only benchmarked with the Stockfish bench are estimated from it
+# (see calibration.py).
+def load_benchmarks(registry = None, provider = "gcp", engine = "fishnet"):
+    if registry is None:
+        registry = BenchmarkRegistry()
+    if engine == "fishnet":
+        return calibrated_benchmarks(registry, provider)
+    return registry.mnps(provider, engine)
+
+# How many instances lichess runs at each time of the grid: 8 in the
+# evening and at night (UTC), 1 otherwise.
+def lichess_demand(ts):
+    day_hour = (np.asarray(ts) % (24 * 60 * 60)) // (60 * 60)
+    return np.where((day_hour <= 2) | (day_hour >= 18), 8, 1)
+
+# Index of the snapshot closest to each grid time. Ties go to the earlier
+# snapshot, like min() over the time-sorted snapshots does.
+def nearest_snapshots(snapshot_times, grid):
+    if len(snapshot_times) == 1:
+        return np.zeros(len(grid), dtype = np.int64)
+    idx = np.clip(np.searchsorted(snapshot_times, grid, side = "left"), 1, len(snapshot_times) - 1)
+    before = grid - snapshot_times[idx - 1]
+    after = snapshot_times[idx] - grid
+    return np.where(before <= after, idx - 1, idx)
+
+# First row that satisfies mask of every segment of rows, the segments
+# starting at the (sorted) rows of starts, as an array with one entry per
+# segment (-1 when no row of the segment does).
+def _first_per_segment(mask, starts):
+    rows = np.flatnonzero(mask)
+    segs = np.searchsorted(starts, rows, side = "right") - 1
+    first = np.concatenate(([True], segs[1:] != segs[:-1]))[:len(rows)]
+    out = np.full(len(starts), -1, dtype = np.int64)
+    out[segs[first]] = rows[first]
+    return out
+
+# For every snapshot of a pricing store, the price and mnps of the lichess
+# machine and of the machine with the lowest cost per mnps. Every row of the
+# store is looked at, so this takes time in proportion to its size; the
+# store is read chunk_rows rows (whole snapshots) at a time to bound
+# memory. A pricing_store.PriceDeltaLog of the same prices, which
+# history_costs() works on, is much faster.
+def snapshot_costs(store, benchmarks, lichess_type = LICHESS_INSTANCE_TYPE, lichess_region = LICHESS_REGION, chunk_rows = 1 << 20):
+    cols = store.columns()
+    t = cols["t"]
+
+    # mnps of every interned instance type, nan for the unbenchmarked ones.
+    type_mnps = np.array([benchmarks.get(name, np.nan) for name in store.types], dtype = np.float64)
+    lichess_ids = None
+    if lichess_type in store.type_ids and lichess_region in store.region_ids and lichess_type in benchmarks:
+        lichess_ids = (store.type_ids[lichess_type], store.region_ids[lichess_region])
+
+    chunks = []
+    start = 0
+    while start < len(t):
+        end = min(len(t), start + chunk_rows)
+        if end < len(t):
+            end = max(int(np.searchsorted(t, t[end], side = "left")), int(np.searchsorted(t, t[start], side = "right")))
+        times = np.asarray(t[start:end])
+        types = np.asarray(cols["type"][start:end])
+        regions = np.asarray(cols["region"][start:end])
+        prices = np.asarray(cols["price"][start:end])
+        starts = np.concatenate(([0], np.flatnonzero(times[1:] != times[:-1]) + 1))
+
+        row_mnps = type_mnps[types]
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            cost_per_mnps = prices / row_mnps
+        cost_per_mnps[~np.isfinite(cost_per_mnps) | (prices <= 0)] = np.inf
+        seg_min = np.minimum.reduceat(cost_per_mnps, starts)
+        if np.any(np.isinf(seg_min)):
+            raise ValueError("some pricing snapshots contain no benchmarked machine type")
+        cheapest = _first_per_segment(cost_per_mnps == np.repeat(seg_min, np.diff(np.append(starts, len(times)))), starts)
+
+        lichess = np.full(len(starts), -1, dtype = np.int64)
+        if lichess_ids is not None:
+            lichess = _first_per_segment((types == lichess_ids[0]) & (regions == lichess_ids[1]), starts)
+        if np.any(lichess < 0):
+            raise ValueError("some pricing snapshots have no {} price in {}".format(lichess_type, lichess_region))
+
+        chunks.append((times[starts], prices[lichess], row_mnps[lichess], prices[cheapest], row_mnps[cheapest], types[cheapest], regions[cheapest]))
+        start = end
+
+    columns = [np.concatenate(values) for values in zip(*chunks)] or [np.zeros(0)] * 7
+    return {
+        "t": columns[0].astype(np.int64),
+        "lichess_price": columns[1],
+        "lichess_mnps": columns[2],
+        "cheapest_price": columns[3],
+        "cheapest_mnps": columns[4],
+        "cheapest_type": [store.types[x] for x in columns[5].astype(np.int64).tolist()],
+        "cheapest_region": [store.regions[x] for x in columns[6].astype(np.int64).tolist()],
+    }
+
+# Lichess' fleet and a fleet of the cheapest machine with the same
+# throughput, given the prices of both at every time of a grid of step
+# seconds.
+def _fleet_costs(grid, costs, step):
+    n_lichess_instances = lichess_demand(grid)
+    n_dynascript_instances = np.round(costs["lichess_mnps"] / costs["cheapest_mnps"] * n_lichess_instances)
+
+    return {
+        "t": grid,
+        "n_lichess_instances": n_lichess_instances,
+        "n_dynascript_instances": n_dynascript_instances.astype(np.int64),
+        "lichess_costs": costs["lichess_price"] * n_lichess_instances * step / 3600,
+        "dynascript_costs": costs["cheapest_price"] * n_dynascript_instances * step / 3600,
+    }
+
+# Simulates lichess' fleet against a fleet of the cheapest machine with the
+# same throughput, on a grid of step seconds between start_t and end_t
+# (defaulting to the span of the pricing store). Prices are hourly, so the
+# returned per-step costs are in dollars per step.
+def simulate(store, benchmarks, start_t = None, end_t = None, step = 60):
+    costs = snapshot_costs(store, benchmarks)
+    snapshot_times = costs["t"]
+    if len(snapshot_times) == 0:
+        raise ValueError("the pricing store is empty")
+
+    start_t = int(snapshot_times[0]) if start_t is None else start_t
+    end_t = int(snapshot_times[-1]) if end_t is None else end_t
+    grid = np.arange(start_t, end_t + 1, step, dtype = np.int64)
+    snap = nearest_snapshots(snapshot_times, grid)
+
+    result = _fleet_costs(grid, {name: values[snap] for name, values in costs.items() if name.endswith("_price") or name.endswith("_mnps")}, step)
+    result["snapshot"] = snap
+    return result
+
+# Sets the prices and costs per mnps of the series of some log rows, the
+# last row of a series winning.
+def _apply_rows(prices, costs, keys, row_prices, row_costs):
+    last = len(keys) - 1 - np.unique(keys[::-1], return_index = True)[1]
+    prices[keys[last]] = row_prices[last]
+    costs[keys[last]] = row_costs[last]
+
+# The same as snapshot_costs(), at every time of a grid, from a
+# price_history.PriceHistory: prices are the ones in effect at each time.
+# Prices only change at the times of the log's rows, and the cheapest
+# machine only at the rows that make one cheaper than it or change its own
+# price, so those are scanned for, block_size rows at a time, and the
+# cheapest machine is only looked for again at their times. Every time of
+# the grid then takes the cheapest machine of the last one at or before it.
+def history_costs(history, benchmarks, grid, lichess_type = LICHESS_INSTANCE_TYPE, lichess_region = LICHESS_REGION, block_size = 1024):
+    keys = [key for key in history.keys() if benchmarks.get(key[0], 0) > 0]
+    if not keys:
+        raise ValueError("the price history has no benchmarked machine type")
+    key_mnps = np.array([benchmarks[key[0]] for key in keys])
+
+    lichess_price = history.prices_at(lichess_type, lichess_region, grid)
+    if lichess_type not in benchmarks or np.any(np.isnan(lichess_price)):
+        raise ValueError("the price history has no {} price in {} for some times".format(lichess_type, lichess_region))
+    if len(grid) == 0:
+        return {"t": grid, "lichess_price": lichess_price, "lichess_mnps": np.zeros(0), "cheapest_price": np.zeros(0),
+            "cheapest_mnps": np.zeros(0), "cheapest_type": [], "cheapest_region": []}
+
+    # The log's rows of benchmarked series up to the end of the grid, as key
+    # indices, prices and costs per mnps, and the time of the last row at or
+    # before the start of the grid (there is one, the lichess price being
+    # known there).
+    log = history.log
+    cols = log.columns()
+    key_ids = np.full((len(log.types), len(log.regions)), -1, dtype = np.int64)
+    for idx, (instance_type, region) in enumerate(keys):
+        key_ids[log.type_ids[instance_type], log.region_ids[region]] = idx
+    row_times = np.asarray(cols["t"])
+    end_row = np.searchsorted(row_times, grid[-1], side = "right")
+    start_t = row_times[np.searchsorted(row_times, grid[0], side = "right") - 1]
+    row_keys = key_ids[cols["type"][:end_row], cols["region"][:end_row]]
+    benchmarked = row_keys >= 0
+    row_times, row_keys, row_prices = row_times[:end_row][benchmarked], row_keys[benchmarked], np.asarray(cols["price"][:end_row])[benchmarked]
+    with np.errstate(invalid = "ignore"):
+        row_costs = np.where(row_prices > 0, row_prices / key_mnps[row_keys], np.inf)
+
+    # Prices as of start_t.
+    pos = np.searchsorted(row_times, start_t, side = "right")
+    prices = np.full(len(keys), np.nan)
+    costs = np.full(len(keys), np.inf)
+    _apply_rows(prices, costs, row_keys[:pos], row_prices[:pos], row_costs[:pos])
+
+    # The times from which a machine is the cheapest, and its price.
+    best = int(np.argmin(costs))
+    event_times, event_best, event_prices = [start_t], [best], [prices[best]]
+    while True:
+        if costs[best] == np.inf:
+            raise ValueError("some times have no price for any benchmarked machine type")
+        hit = None
+        block_start = pos
+        while hit is None and block_start < len(row_keys):
+            block_keys = row_keys[block_start:block_start + block_size]
+            block_costs = row_costs[block_start:block_start + block_size]
+            found = np.flatnonzero((block_keys == best) | (block_costs < costs[best]) | ((block_costs == costs[best]) & (block_keys < best)))
+            if len(found):
+                hit = block_start + found[0]
+            block_start += block_size
+        if hit is None:
+            break
+
+        # Every row of the hit's time is in effect before we look again.
+        end = np.searchsorted(row_times, row_times[hit], side = "right")
+        _apply_rows(prices, costs, row_keys[pos:end], row_prices[pos:end], row_costs[pos:end])
+        pos = end
+        best = int(np.argmin(costs))
+        event_times.append(row_times[hit])
+        event_best.append(best)
+        event_prices.append(prices[best])
+
+    event = np.searchsorted(np.array(event_times), grid, side = "right") - 1
+    cheapest = np.array(event_best)[event]
+    return {
+        "t": grid,
+        "lichess_price": lichess_price,
+        "lichess_mnps": np.full(len(grid), benchmarks[lichess_type], dtype = np.float64),
+        "cheapest_price": np.array(event_prices)[event],
+        "cheapest_mnps": key_mnps[cheapest],
+        "cheapest_type": np.array([key[0] for key in keys], dtype = object)[cheapest].tolist(),
+        "cheapest_region": np.array([key[1] for key in keys], dtype = object)[cheapest].tolist(),
+    }
+
+# simulate(), on a price_history.PriceHistory instead of full snapshots,
+# defaulting to the span of its ticks.
+def simulate_history(history, benchmarks, start_t = None, end_t = None, step = 60):
+    ticks = history.log.ticks()
+    if len(ticks) == 0:
+        raise ValueError("the price history is empty")
+
+    start_t = int(ticks[0]) if start_t is None else start_t
+    end_t = int(ticks[-1]) if end_t is None else end_t
+    grid = np.arange(start_t, end_t + 1, step, dtype = np.int64)
+    return _fleet_costs(grid, history_costs(history, benchmarks, grid), step)
+
+# Running total of a cost series. Like the original plot, the value at step
+# i only includes the costs of the steps before it.
+def cumulative(costs):
+    return np.concatenate(([0.0], np.cumsum(costs)[:-1])) if len(costs) else np.zeros(0)
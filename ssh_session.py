@@ -0,0 +1,103 @@
+import os.path
+import subprocess
+import tempfile
+import threading
+
+# A multiplexed ssh connection to one VM. gcloud is only asked once for the
+# ssh command line to use (key, known hosts, user@ip); after that, every
+# upload, command and download goes through plain ssh/scp sharing a single
+# ControlMaster connection, so only the first one pays for the handshake.
+# A connection attempt gives up after connect_timeout seconds. ssh's errors
+# read the same whether the VM is gone or still booting, so after a failure
+# the cloud is asked again how to reach the VM, and its answer is added to
+# the output if it says the VM is gone (see compute.is_preempted()).
+class SshSession:
+    def __init__(self, compute, vm_name, zone, persist = 600, connect_timeout = 30):
+        self.compute = compute
+        self.vm_name = vm_name
+        self.zone = zone
+        self.persist = persist
+        self.connect_timeout = connect_timeout
+        self.control_path = os.path.join(tempfile.gettempdir(), "ssh-" + vm_name)
+        self.options = None
+        self.destination = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # The ssh options to reach the VM through the shared connection, or
+    # None with gcloud's output if the VM can't be reached (e.g. because it
+    # was preempted and lost its external IP).
+    def _ssh_options(self):
+        if self.options is None:
+            success, options, destination, out = self.compute.ssh_args(self.vm_name, self.zone)
+            if not success:
+                return None, out
+            self.options, self.destination = options, destination
+        return self.options + [
+            "-o", "ControlMaster=auto",
+            "-o", "ControlPath=" + self.control_path,
+            "-o", "ControlPersist={}".format(self.persist),
+            "-o", "ConnectTimeout={}".format(self.connect_timeout),
+        ], ""
+
+    def _run(self, args):
+        p = subprocess.run(args, capture_output = True, encoding = "utf8")
+        return p.returncode, p.stdout, p.stderr
+
+    # What the cloud says about the VM after a failure: "" if it can still be
+    # reached, why not otherwise.
+    def _recheck(self):
+        self.options = None
+        options, out = self._ssh_options()
+        return "" if options is not None else "\n" + out
+
+    def put_file(self, local_fname, remote_fname):
+        options, out = self._ssh_options()
+        if options is None:
+            return False, out
+        returncode, stdout, stderr = self._run(["scp"] + options + [local_fname, self.destination + ":" + remote_fname])
+        if returncode != 0:
+            return False, stdout + stderr + self._recheck()
+        return True, stdout + stderr
+
+    def get_file(self, remote_fname, local_fname):
+        options, out = self._ssh_options()
+        if options is None:
+            return False, out
+        returncode, stdout, stderr = self._run(["scp"] + options + [self.destination + ":" + remote_fname, local_fname])
+        if returncode != 0:
+            return False, stdout + stderr + self._recheck()
+        return True, stdout + stderr
+
+    # Runs a command on the VM. If on_line is given, it is called with every
+    # line of the command's stdout as soon as it arrives.
+    def exec_ssh(self, command, on_line = None):
+        options, out = self._ssh_options()
+        if options is None:
+            return False, "", out
+        p = subprocess.Popen(["ssh"] + options + [self.destination, command], stdout = subprocess.PIPE, stderr = subprocess.PIPE, encoding = "utf8")
+
+        stderr = []
+        stderr_reader = threading.Thread(target = lambda: stderr.append(p.stderr.read()))
+        stderr_reader.start()
+
+        stdout = []
+        for line in p.stdout:
+            stdout.append(line)
+            if on_line is not None:
+                on_line(line.rstrip("\n"))
+        p.wait()
+        stderr_reader.join()
+
+        if p.returncode != 0:
+            return False, "".join(stdout), "".join(stderr) + self._recheck()
+        return True, "".join(stdout), "".join(stderr)
+
+    # Tears the shared connection down.
+    def close(self):
+        if self.destination is not None and os.path.exists(self.control_path):
+            self._run(["ssh", "-o", "ControlPath=" + self.control_path, "-O", "exit", self.destination])
@@ -0,0 +1,110 @@
+import json
+import os
+import re
+import threading
+import time
+
+ZONE_INDEX_FILE = "zone_index.json"
+ZONE_LETTERS = "abcdef"
+
+# "n2d-custom-16-8192" -> "n2d", "c2-standard-8" -> "c2", "c5a.2xlarge" -> "c5a"
+def family_of(instance_type):
+    return instance_type.split("-")[0].split(".")[0]
+
+# Compute Engine regions look like "us-central1", with zones like
+# "us-central1-a"; AWS ones like "us-east-1", with zones like "us-east-1a".
+def is_aws_region(region):
+    return re.search(r"-[0-9]+$", region) is not None
+
+def region_of(zone):
+    if re.search(r"-[0-9]+[a-z]$", zone):
+        return zone[:-1]
+    return zone.rsplit("-", 1)[0]
+
+def zone_name(region, letter):
+    return region + letter if is_aws_region(region) else region + "-" + letter
+
+# Which zones can create which machine families, built from a single
+# machine type listing and refreshed every ttl seconds. It also remembers the
+# zones that recently failed to create a family (stockouts, mostly) and
+# avoids them for failure_ttl seconds. Everything is persisted in path, so
+# that it is shared by every process.
+class ZoneIndex:
+    def __init__(self, compute, path = ZONE_INDEX_FILE, ttl = 24 * 60 * 60, failure_ttl = 60 * 60):
+        self.compute = compute
+        self.path = path
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.lock = threading.Lock()
+
+        self.data = {"built_at": 0, "zones": {}, "failures": {}}
+        if os.path.isfile(path):
+            try:
+                self.data = json.load(open(path))
+            except ValueError:
+                pass
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        open(tmp_path, "w").write(json.dumps(self.data))
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, force = False):
+        with self.lock:
+            if not force and time.time() - self.data["built_at"] < self.ttl:
+                return
+
+            zones = {}
+            for machine_type in self.compute.list_machine_types():
+                zones.setdefault(machine_type["zone"], set()).add(family_of(machine_type["name"]))
+            self.data["zones"] = {zone: sorted(families) for zone, families in zones.items()}
+            self.data["built_at"] = time.time()
+            self._save()
+
+    def _failed_recently(self, zone, family):
+        t = self.data["failures"].get(zone, {}).get(family)
+        return t is not None and time.time() - t < self.failure_ttl
+
+    # The zones of a region that can create an instance type, the ones that
+    # failed recently last. Empty if the index doesn't know the region.
+    def zones_for(self, instance_type, region):
+        self.refresh()
+        family = family_of(instance_type)
+        with self.lock:
+            zones = sorted(zone for zone, families in self.data["zones"].items() if region_of(zone) == region and family in families)
+            return sorted(zones, key = lambda zone: self._failed_recently(zone, family))
+
+    def record_failure(self, zone, instance_type):
+        with self.lock:
+            self.data["failures"].setdefault(zone, {})[family_of(instance_type)] = time.time()
+            self._save()
+
+    def record_success(self, zone, instance_type):
+        with self.lock:
+            if self.data["failures"].get(zone, {}).pop(family_of(instance_type), None) is not None:
+                self._save()
+
+# The zones of a region worth trying for an instance type. Without a zone
+# index (or if it doesn't know the region), every zone letter is tried.
+def candidate_zones(instance_type, region, zone_index = None):
+    zones = []
+    if zone_index is not None:
+        zones = zone_index.zones_for(instance_type, region)
+    return zones or [zone_name(region, letter) for letter in ZONE_LETTERS]
+
+# Tries the candidate zones of a region until one can create the instance
+# type, recording stockouts in the zone index. Returns the zone, or None,
+# with the compute API's output.
+def create_in_region(compute, vm_name, instance_type, region, zone_index = None):
+    out = ""
+    for zone in candidate_zones(instance_type, region, zone_index):
+        success, out = compute.make_spot_instance(vm_name, instance_type, zone)
+        if success:
+            if zone_index is not None:
+                zone_index.record_success(zone, instance_type)
+            return zone, out
+        if compute.is_stockout(out) and zone_index is not None:
+            zone_index.record_failure(zone, instance_type)
+        elif not compute.is_unsupported(out):
+            return None, out
+    return None, out